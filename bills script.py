@@ -1,21 +1,77 @@
+import numpy as np
 import pandas as pd
 import mysql.connector
 from mysql.connector import Error
-from datetime import datetime, timedelta
 import os
+import queue
+from itertools import chain
+import tempfile
+import threading
 from dotenv import load_dotenv
 
+try:
+    import python_calamine  # noqa: F401  (enables pandas' Rust-based 'calamine' Excel engine)
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
 # Load environment variables
 load_dotenv()
 
+# Set BILLS_LOAD_DATA_INFILE=y to bulk load the prepared rows through a
+# staging table with LOAD DATA LOCAL INFILE (the server must allow local_infile)
+USE_LOAD_DATA_INFILE = os.getenv('BILLS_LOAD_DATA_INFILE', 'n').strip().lower() == 'y'
+
+# Set BILLS_REBUILD_INDEXES=y to drop the secondary indexes of the target tables
+# before the load and rebuild them afterwards in one ALTER TABLE per table
+REBUILD_INDEXES = os.getenv('BILLS_REBUILD_INDEXES', 'n').strip().lower() == 'y'
+INDEXED_TABLES = ('revolving_credit_limits', 'loans')
+
 # Database connection details from environment variables
 db_config = {
     'host': os.getenv('LOCAL_MYSQL_HOST'),
     'user': os.getenv('LOCAL_MYSQL_USER'),
     'password': os.getenv('LOCAL_MYSQL_PASSWORD'),
-    'database': os.getenv('LOCAL_MYSQL_DATABASE')
+    'database': os.getenv('LOCAL_MYSQL_DATABASE'),
+    # Use the libmysqlclient-backed C extension when it is installed; the
+    # connector falls back to the pure-Python protocol otherwise
+    'use_pure': False,
+    'charset': 'utf8mb4',
+    'use_unicode': True,
+    'allow_local_infile': USE_LOAD_DATA_INFILE
 }
 
+# Fixed terms of every imported loan
+LOAN_TERM_DAYS = 120
+INTEREST_RATE = 0.00113
+PENALTIES = LOAN_TERM_DAYS * 0.0005  # Total period of loan is 120 days
+FEES = 150
+DISBURSEMENT_CHARGES = 75
+
+REVOLVING_CREDIT_INSERT_SQL = """
+    INSERT INTO revolving_credit_limits (client_id, applied_amount, approved_amount, officer_id, created_by_id, branch_id,
+     created_at, status, corporate_id, product_id, currency_id, fund_id, purpose_id, activity_type_id, activity_id, activity_name)
+    VALUES """
+# Per row: client_id, applied_amount, approved_amount, created_at, status
+REVOLVING_CREDIT_ROW_SQL = "(%s, %s, %s, 57368, 57368, 1, %s, %s, 0, 17, 1, 1, 1, 1, 1, '')"
+
+LOAN_COLUMNS_SQL = """
+        client_id, branch_id, created_by_id, loan_officer_id, created_at, revolving_enabled, currency_id,
+        loan_product_id, loan_transaction_processing_strategy_id, fund_id, loan_purpose_id, submitted_on_date,
+        approved_on_date, submitted_by_user_id, approved_by_user_id, expected_maturity_date, disbursed_on_date,
+        approved_amount, applied_amount, principal, interest_rate, flat_interest_rate, interest_disbursed_derived, fees_disbursed_derived, penalties_disbursed_derived, loan_term,
+        applied_loan_term, repayment_frequency, repayment_frequency_type, interest_rate_type, disbursement_charges, revolving_credit_id, activity_name
+    """
+LOAN_INSERT_SQL = "INSERT INTO loans (" + LOAN_COLUMNS_SQL + ")\n    VALUES "
+# Per row: client_id, created_at, submitted_on_date, approved_on_date,
+# expected_maturity_date, disbursed_on_date, approved_amount, applied_amount,
+# principal, interest_disbursed_derived, revolving_credit_id
+LOAN_ROW_SQL = (
+    f"(%s, 1, 57368, 57368, %s, 1, 1, 17, 3, 1, 1, %s, %s, 57368, 57368, %s, %s, %s, %s, %s, "
+    f"{INTEREST_RATE!r}, {INTEREST_RATE!r}, %s, {FEES!r}, {PENALTIES!r}, 4, 4, 1, 'months', 'day', "
+    f"{DISBURSEMENT_CHARGES!r}, %s, '')"
+)
+
 # Function to connect to the MySQL database
 def create_db_connection():
     try:
@@ -25,105 +81,359 @@ def create_db_connection():
         print(f"Error: {e}")
         return None
 
-# Function to get the client ID by name
-def get_client_id(connection, client_national_id):
-    cursor = connection.cursor()
-    query = "SELECT id FROM clients WHERE national_id = %s"
-    cursor.execute(query, (client_national_id,))
-    result = cursor.fetchone()
-    return result[0] if result else None
-
-# Function to insert a record into the revolving_credit_limits table
-def insert_revolving_credit_limit(connection, client_id, applied_amount, approved_amount, created_at, status):
-    status = 'approved' if status == 'active' else status
-    cursor = connection.cursor()
-    query = """
-    INSERT INTO revolving_credit_limits (client_id, applied_amount, approved_amount, officer_id, created_by_id, branch_id,
-     created_at, status, corporate_id, product_id, currency_id, fund_id, purpose_id, activity_type_id, activity_id, activity_name)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0, 17, 1, 1, 1, 1, 1, '')
-    """
-    values = (client_id, applied_amount, approved_amount, 57368, 57368, 1, created_at, status)
-    cursor.execute(query, values)
-    connection.commit()
-    return cursor.lastrowid  # Return the last inserted ID
-
-# Function to calculate late days
-def calculate_late_days(created_at, expected_maturity_date):
-    today = datetime.today()
-    if today < expected_maturity_date:
-        return (today - created_at).days
-    else:
-        return (expected_maturity_date - created_at).days
-
-# Function to insert a record into the loans table
-def insert_loan(connection, client_id, created_at, approved_amount, revolving_credit_id):
-    cursor = connection.cursor()
-    expected_maturity_date = created_at + timedelta(days=120)
-    late_days = calculate_late_days(created_at, expected_maturity_date)
-    interest_rate = 0.00113
-    interest = interest_rate * late_days
-    penalties = 120 * 0.0005  # Total period of loan is 120 days
-    fees = 150
-    disbursement_charges = 75
-
-    query = """
-    INSERT INTO loans (
-        client_id, branch_id, created_by_id, loan_officer_id, created_at, revolving_enabled, currency_id,
-        loan_product_id, loan_transaction_processing_strategy_id, fund_id, loan_purpose_id, submitted_on_date,
-        approved_on_date, submitted_by_user_id, approved_by_user_id, expected_maturity_date, disbursed_on_date,
-        approved_amount, applied_amount, principal, interest_rate, flat_interest_rate, interest_disbursed_derived, fees_disbursed_derived, penalties_disbursed_derived, loan_term,
-        applied_loan_term, repayment_frequency, repayment_frequency_type, interest_rate_type, disbursement_charges, revolving_credit_id, activity_name
+# Number of national ids resolved per clients lookup query
+LOOKUP_CHUNK_SIZE = 10000
+
+# Function to read the bills sheet. Parquet/CSV exports are read directly;
+# Excel files go through calamine when it is installed (much faster than openpyxl).
+def read_bills(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(file_path)
+    if extension == '.csv':
+        return pd.read_csv(file_path)
+    if CALAMINE_AVAILABLE:
+        return pd.read_excel(file_path, engine='calamine')
+    return pd.read_excel(file_path)
+
+# Session settings relaxed while the import runs. This is for the one-off
+# migration only: the rows are trusted (clients resolved beforehand, ids
+# generated by the import), so per-row unique/foreign key checks are skipped.
+# innodb_flush_log_at_trx_commit and sync_binlog are global-only variables and
+# are left to the DBA; batching already limits the import to one fsync per batch.
+BULK_LOAD_SESSION_SETTINGS = {
+    'unique_checks': 0,
+    'foreign_key_checks': 0,
+    'bulk_insert_buffer_size': 256 * 1024 * 1024,
+}
+
+# Function to apply BULK_LOAD_SESSION_SETTINGS, returning the previous values
+def tune_session_for_bulk_load(cursor):
+    names = list(BULK_LOAD_SESSION_SETTINGS)
+    cursor.execute("SELECT " + ", ".join(f"@@SESSION.{name}" for name in names))
+    previous = dict(zip(names, cursor.fetchone()))
+    cursor.execute("SET " + ", ".join(f"SESSION {name} = %s" for name in names), list(BULK_LOAD_SESSION_SETTINGS.values()))
+    return previous
+
+# Function to restore the session settings saved by tune_session_for_bulk_load
+def restore_session_settings(cursor, previous):
+    cursor.execute("SET " + ", ".join(f"SESSION {name} = %s" for name in previous), list(previous.values()))
+
+# Function to drop the plain secondary indexes of a table. Unique indexes,
+# non-BTREE indexes and indexes that back a foreign key are kept.
+# Returns {index_name: [column definition, ...]} for rebuild_secondary_indexes.
+def drop_secondary_indexes(cursor, table):
+    cursor.execute(
+        "SELECT DISTINCT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+        (table,)
     )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '')
-    """
-    values = (
-        client_id, 1, 57368, 57368, created_at, 1, 1, 17, 3, 1, 1, created_at, created_at, 57368, 57368,
-        expected_maturity_date, created_at, approved_amount, approved_amount, approved_amount, interest_rate, interest_rate,
-        interest, fees, penalties, 4, 4, 1, 'months', 'day', disbursement_charges, revolving_credit_id
+    foreign_key_columns = {row[0] for row in cursor.fetchall()}
+
+    cursor.execute(f"SHOW INDEX FROM {table}")
+    columns = [description[0] for description in cursor.description]
+    index_parts = {}
+    skipped = set()
+    for row in cursor.fetchall():
+        index = dict(zip(columns, row))
+        name = index['Key_name']
+        if name == 'PRIMARY' or not index['Non_unique'] or index['Index_type'] != 'BTREE' or not index['Column_name']:
+            skipped.add(name)
+            continue
+        definition = f"`{index['Column_name']}`"
+        if index['Sub_part']:
+            definition += f"({index['Sub_part']})"
+        if index['Collation'] == 'D':
+            definition += " DESC"
+        index_parts.setdefault(name, []).append((index['Seq_in_index'], index['Column_name'], definition))
+
+    indexes = {}
+    for name, parts in index_parts.items():
+        parts.sort()
+        if name in skipped or parts[0][1] in foreign_key_columns:
+            continue
+        indexes[name] = [definition for _, _, definition in parts]
+
+    if indexes:
+        cursor.execute(f"ALTER TABLE {table} " + ", ".join(f"DROP INDEX `{name}`" for name in indexes))
+        print(f"Dropped {len(indexes)} secondary indexes on {table}")
+    return indexes
+
+# Function to build the ALTER TABLE that recreates indexes removed by drop_secondary_indexes
+def secondary_indexes_ddl(table, indexes):
+    return f"ALTER TABLE {table} " + ", ".join(
+        f"ADD INDEX `{name}` ({', '.join(definitions)})" for name, definitions in indexes.items()
     )
-    cursor.execute(query, values)
-    connection.commit()
+
+# Function to recreate indexes removed by drop_secondary_indexes in one pass
+def rebuild_secondary_indexes(cursor, table, indexes):
+    if not indexes:
+        return
+    cursor.execute(secondary_indexes_ddl(table, indexes))
+    print(f"Rebuilt {len(indexes)} secondary indexes on {table}")
+
+# Function to turn a national ID cell into the digit string stored in clients.
+# With a blank cell in the column pandas reads the IDs as floats, so integral
+# numbers are written without their '.0'.
+def normalize_national_id(national_id):
+    if isinstance(national_id, float) and national_id.is_integer():
+        national_id = int(national_id)
+    return str(national_id).strip()
+
+# Function to resolve client IDs for many national IDs at once.
+# Returns a dict keyed by the national ID normalized by normalize_national_id.
+def get_client_ids(cursor, client_national_ids):
+    national_ids = list(dict.fromkeys(normalize_national_id(national_id) for national_id in client_national_ids))
+    client_ids = {}
+    for start in range(0, len(national_ids), LOOKUP_CHUNK_SIZE):
+        chunk = national_ids[start:start + LOOKUP_CHUNK_SIZE]
+        query = f"SELECT national_id, id FROM clients WHERE national_id IN ({', '.join(['%s'] * len(chunk))})"
+        cursor.execute(query, chunk)
+        for national_id, client_id in cursor.fetchall():
+            client_ids.setdefault(normalize_national_id(national_id), client_id)
+    return client_ids
+
+# Number of Excel rows written per multi-row INSERT / commit
+BATCH_SIZE = 10000
+
+# Function to insert a batch of records into the revolving_credit_limits table.
+# `params` holds the REVOLVING_CREDIT_ROW_SQL values of `row_count` rows back to
+# back. Returns the ids of the inserted rows in order.
+def insert_revolving_credit_limits_batch(cursor, params, row_count):
+    query = REVOLVING_CREDIT_INSERT_SQL + ", ".join([REVOLVING_CREDIT_ROW_SQL] * row_count)
+    cursor.execute(query, params)
+    # A multi-row INSERT reports LAST_INSERT_ID() (the id of its first row) in
+    # its OK packet. With innodb_autoinc_lock_mode=2 (the MySQL 8 default) the
+    # rest are only contiguous if nothing else inserts concurrently, so the
+    # assumed ids are checked against the clients of the batch
+    if cursor.rowcount != row_count:
+        raise Error(msg=f"Expected {row_count} revolving credit limits to be inserted, got {cursor.rowcount}")
+    first_id = cursor.lastrowid
+    ids = range(first_id, first_id + row_count)
+    cursor.execute(
+        "SELECT id, client_id FROM revolving_credit_limits WHERE id BETWEEN %s AND %s ORDER BY id",
+        (ids[0], ids[-1])
+    )
+    # client_id is the first of the five parameters of each row
+    if cursor.fetchall() != list(zip(ids, params[::5])):
+        raise Error(msg=f"Revolving credit limit ids {ids[0]}-{ids[-1]} do not match the inserted batch")
+    return ids
+
+# Function to calculate late days for whole columns of dates
+def calculate_late_days(created_at, expected_maturity_date, today):
+    return pd.Series(
+        np.where(
+            today < expected_maturity_date,
+            (today - created_at).dt.days,
+            (expected_maturity_date - created_at).dt.days,
+        ),
+        index=created_at.index,
+    )
+
+# Function to derive every per-row value of the import on the whole DataFrame.
+# Rows whose client is unknown are reported and dropped.
+def prepare_bills(df, client_ids, today):
+    df = df.iloc[:, :5].copy()
+    df.columns = ['national_id', 'approved_amount', 'invoice_amount', 'transfer_date', 'active']
+
+    df['client_id'] = df['national_id'].map(normalize_national_id).map(client_ids)
+    missing = df.loc[df['client_id'].isna(), 'national_id'].tolist()
+    if missing:
+        more = "..." if len(missing) > 20 else ""
+        print(f"{len(missing)} clients not found in the database. Skipping: {missing[:20]}{more}")
+    df = df[df['client_id'].notna()].copy()
+    df['client_id'] = df['client_id'].astype('int64')
+
+    df['created_at'] = pd.to_datetime(df['transfer_date'])
+    df['status'] = np.where(df['active'] == 1, 'approved', 'closed')
+    df['expected_maturity_date'] = df['created_at'] + pd.Timedelta(days=LOAN_TERM_DAYS)
+    df['late_days'] = calculate_late_days(df['created_at'], df['expected_maturity_date'], today)
+    df['interest'] = INTEREST_RATE * df['late_days']
+    return df
+
+# Function to insert a batch of records into the loans table.
+# `params` holds the LOAN_ROW_SQL values of `row_count` rows back to back.
+def insert_loans_batch(cursor, params, row_count):
+    cursor.execute(LOAN_INSERT_SQL + ", ".join([LOAN_ROW_SQL] * row_count), params)
+
+# Function to turn one slice of prepared rows into INSERT parameters. The
+# parameters are flattened straight from the columns so no tuple is kept per
+# row. Loan parameters need the revolving credit ids, which are only known
+# once the revolving credit limits of the batch are inserted, so the loan
+# columns are returned as-is.
+def build_batch(batch):
+    client_ids = batch['client_id'].tolist()
+    approved_amounts = batch['approved_amount'].tolist()
+    created_ats = list(batch['created_at'].dt.to_pydatetime())
+    maturity_dates = list(batch['expected_maturity_date'].dt.to_pydatetime())
+    interests = batch['interest'].tolist()
+
+    revolving_credit_params = list(chain.from_iterable(
+        zip(client_ids, approved_amounts, approved_amounts, created_ats, batch['status'].tolist())
+    ))
+    loan_columns = (client_ids, created_ats, maturity_dates, approved_amounts, interests)
+    return len(client_ids), revolving_credit_params, loan_columns
+
+# Function to write one built batch: revolving credit limits first, then the
+# loans pointing at them
+def write_batch(cursor, row_count, revolving_credit_params, loan_columns):
+    revolving_credit_ids = insert_revolving_credit_limits_batch(cursor, revolving_credit_params, row_count)
+    client_ids, created_ats, maturity_dates, approved_amounts, interests = loan_columns
+    loan_params = list(chain.from_iterable(zip(
+        client_ids, created_ats, created_ats, created_ats, maturity_dates, created_ats,
+        approved_amounts, approved_amounts, approved_amounts, interests, revolving_credit_ids
+    )))
+    insert_loans_batch(cursor, loan_params, row_count)
+
+# Function to write all prepared rows batch by batch. A writer thread inserts
+# and commits batch N while the main thread builds batch N+1; the bounded
+# queue keeps at most two built batches in memory. Only the writer thread
+# touches the connection until it has finished.
+def write_batches_pipelined(connection, cursor, df):
+    batches = queue.Queue(maxsize=2)
+    failures = []
+
+    def writer():
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            if failures:
+                # Keep draining so the producer never blocks on a dead writer
+                continue
+            try:
+                write_batch(cursor, *item)
+                connection.commit()
+            except Exception as e:
+                failures.append(e)
+
+    writer_thread = threading.Thread(target=writer, name='bills-writer', daemon=True)
+    writer_thread.start()
+    try:
+        for start in range(0, len(df), BATCH_SIZE):
+            if failures:
+                break
+            batches.put(build_batch(df.iloc[start:start + BATCH_SIZE]))
+    finally:
+        batches.put(None)
+        writer_thread.join()
+
+    if failures:
+        raise failures[0]
+
+# Function to load all prepared rows server-side: the rows are streamed into a
+# temporary staging table with LOAD DATA LOCAL INFILE, then copied into
+# revolving_credit_limits and loans with two INSERT ... SELECT statements.
+def load_bills_via_infile(cursor, df):
+    cursor.execute("""
+    CREATE TEMPORARY TABLE staging_bills (
+        row_no INT NOT NULL PRIMARY KEY,
+        client_id BIGINT NOT NULL,
+        approved_amount DECIMAL(20, 4),
+        created_at DATETIME,
+        expected_maturity_date DATETIME,
+        status VARCHAR(16),
+        interest DOUBLE
+    )""")
+
+    staging = df[['client_id', 'approved_amount', 'created_at', 'expected_maturity_date', 'status', 'interest']].copy()
+    staging.insert(0, 'row_no', range(1, len(staging) + 1))
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, newline='') as csv_file:
+        staging.to_csv(csv_file, index=False, header=False, na_rep='\\N', date_format='%Y-%m-%d %H:%M:%S',
+                       lineterminator='\n')
+        csv_path = csv_file.name
+
+    try:
+        cursor.execute("""
+        LOAD DATA LOCAL INFILE %s INTO TABLE staging_bills
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+        LINES TERMINATED BY '\\n'
+        (row_no, client_id, approved_amount, created_at, expected_maturity_date, status, interest)""", (csv_path,))
+    finally:
+        os.remove(csv_path)
+
+    # INSERT ... SELECT does not guarantee consecutive auto-increment values, so
+    # the revolving credit ids are assigned explicitly from the current maximum
+    # (locked for the rest of the transaction) and reused to link the loans
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM revolving_credit_limits FOR UPDATE")
+    base_id = cursor.fetchone()[0]
+
+    cursor.execute("""
+    INSERT INTO revolving_credit_limits (id, client_id, applied_amount, approved_amount, officer_id, created_by_id, branch_id,
+     created_at, status, corporate_id, product_id, currency_id, fund_id, purpose_id, activity_type_id, activity_id, activity_name)
+    SELECT %s + row_no, client_id, approved_amount, approved_amount, 57368, 57368, 1,
+     created_at, status, 0, 17, 1, 1, 1, 1, 1, ''
+    FROM staging_bills ORDER BY row_no""", (base_id,))
+
+    cursor.execute("""
+    INSERT INTO loans (""" + LOAN_COLUMNS_SQL + """)
+    SELECT client_id, 1, 57368, 57368, created_at, 1, 1, 17, 3, 1, 1, created_at, created_at, 57368, 57368,
+        expected_maturity_date, created_at, approved_amount, approved_amount, approved_amount, %s, %s,
+        interest, %s, %s, 4, 4, 1, 'months', 'day', %s, %s + row_no, ''
+    FROM staging_bills ORDER BY row_no""",
+                   (INTEREST_RATE, INTEREST_RATE, FEES, PENALTIES, DISBURSEMENT_CHARGES, base_id))
+
+    cursor.execute("DROP TEMPORARY TABLE staging_bills")
 
 # Main function to process the Excel file
 def process_credits_excel(file_path):
+    # Every late-days figure of the run is measured against the same day
+    today = pd.Timestamp.today()
+
     # Read the Excel file
-    df = pd.read_excel(file_path)
+    df = read_bills(file_path)
 
     # Connect to the database
     connection = create_db_connection()
     if connection is None:
         return
 
-    # Iterate over each row in the Excel file
-    for index, row in df.iterrows():
-        client_national_id = row.iloc[0]
-        approved_amount = row.iloc[1]
-        invoice_amount = row.iloc[2]
-        transfer_date = row.iloc[3]
-        active = row.iloc[4]
-
-        # Get the client ID
-        client_id = get_client_id(connection, client_national_id)
-        if not client_id:
-            print(f"Client '{client_national_id}' not found in the database. Skipping...")
-            continue
+    # A single cursor is reused for every statement of the run
+    cursor = connection.cursor()
+
+    # Resolve every client up front instead of querying once per row
+    client_ids = get_client_ids(cursor, df.iloc[:, 0].dropna().unique().tolist())
 
-        # Convert Transfer Date to datetime
-        created_at = pd.to_datetime(transfer_date)
+    # Compute dates, status and interest for all rows at once
+    df = prepare_bills(df, client_ids, today)
 
-        # Determine status
-        status = 'active' if active == 1 else 'closed'
+    # One explicit transaction per batch instead of a commit per statement
+    connection.autocommit = False
+    previous_settings = None
 
-        # Insert into revolving_credit_limits table
-        revolving_credit_id = insert_revolving_credit_limit(
-            connection, client_id, approved_amount, approved_amount, created_at, status
-        )
+    # ALTER TABLE commits implicitly, so indexes are dropped before the first
+    # batch and rebuilt after the last commit. A table is recorded as soon as
+    # its indexes are dropped, so they are rebuilt whatever fails afterwards
+    dropped_indexes = {}
 
-        # Insert into loans table
-        insert_loan(connection, client_id, created_at, approved_amount, revolving_credit_id)
+    try:
+        previous_settings = tune_session_for_bulk_load(cursor)
+        if REBUILD_INDEXES:
+            for table in INDEXED_TABLES:
+                dropped_indexes[table] = drop_secondary_indexes(cursor, table)
 
-    # Close the database connection
-    connection.close()
+        if USE_LOAD_DATA_INFILE:
+            load_bills_via_infile(cursor, df)
+            connection.commit()
+        else:
+            write_batches_pipelined(connection, cursor, df)
+    except Error as e:
+        connection.rollback()
+        print(f"Error: {e}. Rolled back the current batch.")
+    finally:
+        try:
+            for table, indexes in dropped_indexes.items():
+                try:
+                    rebuild_secondary_indexes(cursor, table, indexes)
+                except Exception as e:
+                    print(f"Error rebuilding the secondary indexes of {table}: {e}. "
+                          f"Recreate them with: {secondary_indexes_ddl(table, indexes)}")
+            if previous_settings is not None:
+                restore_session_settings(cursor, previous_settings)
+        finally:
+            # Close the database connection
+            connection.close()
 
 # Path to your Excel file
 excel_file_path = 'bills.xlsx'
@@ -1,25 +1,695 @@
 import logging
 import datetime
+from collections import Counter
+from itertools import product
+from operator import itemgetter
 from general_helper import (
     insert_record,
+    insert_records,
+    check_inserted_ids,
     get_record_details_by_id, 
     get_record_value,
+    get_records_by_ids,
 )
 from custom_helper import (
     get_governorate_from_national_id,
-    create_placeholder_application,
-    extract_lat_lon_from_wkb
+    build_placeholder_application,
+    extract_lat_lon_from_wkb,
+    extract_lat_lon_batch,
+    join_non_empty,
+    resolve_user_ids
 )
 
+# Source status codes -> destination status, anything else is 'pending'
+APPLICATION_STATUS_MAP = {1: 'approved', 2: 'rejected'}
+LOAN_STATUS_MAP = {0: 'submitted', 1: 'active', 5: 'closed', 6: 'withdrawn'}
+
+# Used when the source leaves the client's marital status / qualification empty
+DEFAULT_MARITAL_STATUS_ID = 6
+DEFAULT_QUALIFICATION_ID = 8
+# Values the source uses for "not set", including the text forms some columns come back as
+_FALSY = frozenset((None, 0, "", " ", "0"))
+
+# Source gender code -> destination gender flag, 1 is male and anything else female
+GENDER_MAP = {1: True}
+
+# Flat interest rates and their terms of a loan product row
+_PRODUCT_RATES_AND_TERMS = itemgetter(
+    "flat_default_interest_rate", "flat_minimum_interest_rate", "flat_maximum_interest_rate",
+    "default_loan_term", "minimum_loan_term", "maximum_loan_term"
+)
+
+def flat_to_declining(flat_rate, periods):
+    """Convert flat interest rate (percent) to declining balance rate (percent)."""
+    # Formula: r = 2R/(n+1) where R is flat rate, n is number of periods
+    return round(2 * flat_rate * periods / (periods + 1), 4)
+
+# Source transaction type -> destination loan_transaction_type_id, types missing here are skipped
+TRANS_TYPE_MAP = {
+    1: 2,           # Repayment
+    3: 1,           # Disbursement
+    7: 6,           # Write Off
+    17: 10,         # Apply Charges
+    # Cancellation transaction types map to the same target types
+    2: 2,           # Cancel Repayment
+    4: 1,           # Cancel Disbursement
+    8: 6,           # Cancel Write Off
+    18: 10,         # Cancel Apply Charges
+}
+# Source transaction types that cancel an earlier transaction
+CANCELLATION_TRANS_TYPES = frozenset((2, 4, 8, 18))
+# Destination transaction types whose amount goes on the debit side
+DEBIT_TRANS_TYPES = frozenset((1, 10))
+
+# Transaction amounts made positive for regular and negative for cancellation transactions
+TRANSACTION_AMOUNT_FIELDS = ('amount', 'interest_repaid_derived', 'penalties_repaid_derived')
+
+# Installment amounts the source may store negated
+INSTALLMENT_AMOUNT_FIELDS = (
+    'principal', 'principal_repaid_derived', 'interest', 'interest_repaid_derived', 'fees', 'fees_repaid_derived'
+)
+
+def _negate_positive(row_data, fields):
+    """Make the positive values of fields negative. Returns the names of the fields that changed."""
+    negated = [field for field in fields if row_data[field] > 0]
+    for field in negated:
+        row_data[field] = -row_data[field]
+    return negated
+
+# (loan written off and inst_cond 2, inst_status 8, principal not fully repaid) -> installment status
+INSTALLMENT_STATUS_TABLE = {
+    key: 'written_off' if key[0] else 'rescheduled' if key[1] else 'active' if key[2] else 'closed'
+    for key in product((False, True), repeat=3)
+}
+
+# Last day of each month in a non-leap year
+_MONTH_LAST = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
 class CustomLogic:
+    # (table, source column, migrations) for the external_id -> id lookups done in process_columns
+    PREFETCH_KEYS = [
+        ("branches", "branch_code", ("officers", "clients", "loan_applications", "loans", "transactions")),
+        ("branches", "org_branch_code", ("clients", "loans", "transactions")),
+        ("clients", "client_key", ("loan_applications", "loans")),
+        ("users", "officer_key", ("clients", "loan_applications", "loans", "transactions")),
+        ("loan_products", "loan_type_code", ("loan_applications", "loans")),
+        ("loan_applications", "application_key", ("loans",)),
+        ("loans", "loan_key", ("installments", "transactions")),
+        ("loan_repayment_schedules", "installment_key", ("transactions",)),
+    ]
+
+    # loan_products columns copied onto every loan
+    PRODUCT_COLUMNS = [
+        "product_type", "fund_id", "repayment_frequency", "repayment_frequency_type",
+        "interest_rate_type", "interest_methodology", "amortization_method",
+        "decimals", "loan_transaction_processing_strategy_id"
+    ]
+    # loan_applications columns a loan falls back to
+    DEST_APPLICATION_COLUMNS = ["loan_product_id", "client_id", "branch_id"]
+    # Source application columns copied onto every loan
+    APPLICATION_COLUMNS = [
+        "req_am", "req_no", "br_deputy_note", "officer_supervisor_note",
+        "loan_gen_user", "loan_gen_date", "user_name", "dec_user", "dec_date", "br_deputy_user_name",
+        "officer_supervisor_user_name", "br_deputy_bus_location"
+    ]
+    # Source client columns describing the client's business
+    CLIENT_INFO_COLUMNS = ["bus_name", "bus_add_1", "bus_add_2", "bus_add_3"]
+
     def __init__(self):
         self.dest_conn = None
         self.logger = logging.getLogger('migration')  # Default logger
         self.skipped_transactions = 0
         self.inserted_transactions = 0
-        self.skipped_types_count = {}
+        self.skipped_types_count = Counter()
+        # Transaction counts at which the next skipped types summary / progress summary is printed
+        self._next_skipped_summary = 100
+        self._next_progress_summary = 100
+        # (table, column, key_col, key_val) -> looked up value, None included as a negative entry
+        self._lookup_cache = {}
+        # (table, column, condition) -> server-side prepared cursor on dest_conn for the lookups the prefetch missed
+        self._lookup_cursors = {}
+        # client ids that already have a loan, loaded on the first loans row
+        self._clients_with_loans = None
+        # client id -> wallet id / user id / external id, loaded on the first loans row
+        self._client_to_wallet = None
+        self._client_to_user = None
+        self._client_external_ids = None
+        # (row_data, user_data, wallet_data) of clients waiting for flush_pending_inserts
+        self._pending_clients = []
+        # application_key -> (placeholder application data, loan rows waiting for its id)
+        self._pending_applications = {}
+        # Interest, penalty and charges transactions split off the source transactions, waiting for take_split_off_transactions
+        self._pending_transactions = []
+        # raw home_geography value -> (lat, lon), parsed for the current batch by prefetch_lookups
+        self._coordinates = {}
+        # loan product id -> PRODUCT_COLUMNS values, loaded on the first loans row
+        self._loan_products_by_id = None
+        # loan application id -> DEST_APPLICATION_COLUMNS values, prefetched per batch of loans
+        self._application_details = {}
+        # str(application_key) / str(client_key) -> source details (None if missing), prefetched per batch of loans
+        self._src_application_details = {}
+        self._src_client_details = {}
+        # Refreshed by bind() so the hot path can skip building debug messages
+        self._log_debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
         self.logger.info("CustomLogic instance initialized")
 
+    def reset_caches(self):
+        """Drop every cached lookup. Called at the start of each migration run."""
+        self._lookup_cache.clear()
+        # dest_conn may have been replaced, prepare the lookups again on the current one
+        for lookup_cursor in self._lookup_cursors.values():
+            try:
+                lookup_cursor.close()
+            except Exception:
+                pass
+        self._lookup_cursors = {}
+        self._clients_with_loans = None
+        self._client_to_wallet = None
+        self._client_to_user = None
+        self._client_external_ids = None
+        self._pending_clients = []
+        self._pending_applications = {}
+        self._pending_transactions = []
+        self._coordinates = {}
+        self._loan_products_by_id = None
+        self._application_details = {}
+        self._src_application_details = {}
+        self._src_client_details = {}
+
+    def invalidate(self, table=None):
+        """
+        Forget negative lookups so rows inserted since the lookup become visible.
+        Args:
+            table (str, optional): Only invalidate entries of this table. All tables if None.
+        """
+        # Inserts never change an id we already resolved, so only the "not found" entries can go stale
+        stale = [key for key, value in self._lookup_cache.items()
+                 if value is None and (table is None or key[0] == table)]
+        for key in stale:
+            del self._lookup_cache[key]
+
+    def _cached_lookup(self, table, column, key_col, key_val, cursor=None):
+        """
+        Memoized get_record_value for "key_col = key_val" style lookups.
+        Args:
+            table (str): The table to query
+            column (str): The column to return
+            key_col (str or tuple): Key column name, or a tuple of names for composite keys
+            key_val: Key value, or a tuple of values matching key_col
+            cursor: Database cursor to use for the lookup
+        Returns:
+            Any: The looked up value, None if no record matched
+        """
+        cache_key = (table, column, key_col, key_val)
+        if cache_key in self._lookup_cache:
+            return self._lookup_cache[cache_key]
+
+        # Bind the keys as strings, the way the quoted literals used to compare
+        if isinstance(key_col, tuple):
+            condition = " AND ".join(f"{col} = %s" for col in key_col)
+            params = tuple(str(val) for val in key_val)
+        else:
+            condition = f"{key_col} = %s"
+            params = (str(key_val),)
+
+        value = get_record_value(
+            table=table,
+            condition=condition,
+            column=column,
+            cursor=self._lookup_cursor(table, column, condition) or cursor,
+            conn=self.dest_conn,
+            logger=self.logger,
+            params=params
+        )
+        self._lookup_cache[cache_key] = value
+        return value
+
+    def _lookup_cursor(self, table, column, condition):
+        """
+        Get the prepared cursor of a lookup query, so the server parses it once per migration.
+        Each query keeps its own cursor since a prepared cursor only holds its last statement.
+        Args:
+            table (str): The table to query
+            column (str): The column to return
+            condition (str): The WHERE condition, with %s placeholders
+        Returns:
+            The prepared cursor, None if there is no destination connection or it cannot prepare statements
+        """
+        lookup_key = (table, column, condition)
+        if lookup_key not in self._lookup_cursors:
+            lookup_cursor = None
+            if self.dest_conn is not None:
+                try:
+                    lookup_cursor = self.dest_conn.cursor(prepared=True)
+                except Exception as e:
+                    self.logger.warning("Could not open a prepared cursor for %s lookups, using the batch cursor: %s", table, e)
+            self._lookup_cursors[lookup_key] = lookup_cursor
+        return self._lookup_cursors[lookup_key]
+
+    def lookup_tables(self, migration_name):
+        """
+        Get the tables process_columns looks rows up in by external_id during a migration.
+        Args:
+            migration_name (str): The name of the migration.
+        Returns:
+            list[str]: Table names, without duplicates
+        """
+        return list(dict.fromkeys(table for table, _, migrations in self.PREFETCH_KEYS if migration_name in migrations))
+
+    def prefetch_lookups(self, migration_name, source_rows, cursor, src_cursor=None):
+        """
+        Resolve the lookups of a whole batch of source rows up front so process_columns hits the cache.
+        Args:
+            migration_name (str): The name of the migration.
+            source_rows (list[dict]): Source rows of the batch, keyed by source column.
+            cursor: Destination database cursor
+            src_cursor: Source database cursor, for the source details of loans
+        """
+        # Collect the distinct keys per table that are not cached yet
+        pending = {}
+        for table, source_column, migrations in self.PREFETCH_KEYS:
+            if migration_name not in migrations:
+                continue
+            keys = pending.setdefault(table, set())
+            for source_row in source_rows:
+                key_val = source_row.get(source_column)
+                if key_val and (table, "id", "external_id", key_val) not in self._lookup_cache:
+                    keys.add(key_val)
+
+        for table, keys in pending.items():
+            if not keys:
+                continue
+            # external_id comes back as stored in the destination, so match on its string form
+            requested = {str(key_val): key_val for key_val in keys}
+            found = get_records_by_ids(cursor, table, list(requested), ["id"], logger=self.logger, id_name="external_id")
+            if found is None:
+                # Leave these keys to the per-row lookup
+                continue
+            found = {str(external_id): record for external_id, record in found.items()}
+            for external_id, key_val in requested.items():
+                record = found.get(external_id)
+                self._lookup_cache[(table, "id", "external_id", key_val)] = record["id"] if record else None
+            self.logger.debug("Prefetched %s/%s %s ids for %s", len(found), len(keys), table, migration_name)
+
+        if migration_name in ("installments", "transactions"):
+            self._prefetch_loan_statuses(source_rows, cursor)
+
+        if migration_name == "clients":
+            geographies = list({source_row["home_geography"] for source_row in source_rows if source_row.get("home_geography")})
+            self._coordinates = dict(zip(geographies, extract_lat_lon_batch(geographies, logger=self.logger)))
+
+        if migration_name == "loans":
+            self._prefetch_loan_activities(source_rows, cursor)
+
+            application_ids = {self._lookup_cache.get(("loan_applications", "id", "external_id", source_row.get("application_key")))
+                               for source_row in source_rows}
+            application_ids.discard(None)
+            found = get_records_by_ids(cursor, "loan_applications", application_ids, self.DEST_APPLICATION_COLUMNS, logger=self.logger)
+            # On error keep an empty map, the rows then look their application up one by one
+            self._application_details = found or {}
+
+            if src_cursor is not None:
+                self._src_application_details = self._prefetch_source_details(
+                    src_cursor, "ilts.c1_loan_application", "application_key",
+                    {source_row.get("application_key") for source_row in source_rows}, self.APPLICATION_COLUMNS
+                )
+                self._src_client_details = self._prefetch_source_details(
+                    src_cursor, "ilts.c1_client_info_table", "client_key",
+                    {source_row.get("client_key") for source_row in source_rows}, self.CLIENT_INFO_COLUMNS
+                )
+                locations = list({details["br_deputy_bus_location"] for details in self._src_application_details.values()
+                                  if details and details.get("br_deputy_bus_location")})
+                self._coordinates = dict(zip(locations, extract_lat_lon_batch(locations, logger=self.logger)))
+
+    def _fetch_loan_id_and_status(self, loan_key, cursor):
+        """
+        Get the id and status of a loan by its external id, both with one query if the prefetch missed it.
+        Args:
+            loan_key: External id of the loan
+            cursor: Destination database cursor, used if there is no prepared lookup cursor
+        Returns:
+            tuple: (loan id, loan status), (None, None) if the loan does not exist or the query failed
+        """
+        id_key = ("loans", "id", "external_id", loan_key)
+        if id_key in self._lookup_cache:
+            loan_id = self._lookup_cache[id_key]
+            if loan_id is None:
+                return None, None
+            if ("loans", "status", "id", loan_id) in self._lookup_cache:
+                return loan_id, self._lookup_cache[("loans", "status", "id", loan_id)]
+
+        lookup_cursor = self._lookup_cursor("loans", "id, status", "external_id = %s") or cursor
+        try:
+            lookup_cursor.execute("SELECT id, status FROM loans WHERE external_id = %s LIMIT 1", (str(loan_key),))
+            result = lookup_cursor.fetchone()
+        except Exception as e:
+            error_msg = f"Error looking up loan with external_id {loan_key}: {str(e)}"
+            self.logger.error(error_msg)
+            print(error_msg)
+            return None, None
+
+        loan_id, loan_status = result if result else (None, None)
+        self._lookup_cache[id_key] = loan_id
+        if loan_id is not None:
+            self._lookup_cache[("loans", "status", "id", loan_id)] = loan_status
+        return loan_id, loan_status
+
+    def _prefetch_loan_statuses(self, source_rows, cursor):
+        """
+        Cache the status of the loans a batch of installments or transactions belongs to.
+        Args:
+            source_rows (list[dict]): Source rows of the batch
+            cursor: Destination database cursor
+        """
+        loan_ids = {self._lookup_cache.get(("loans", "id", "external_id", source_row.get("loan_key")))
+                    for source_row in source_rows}
+        loan_ids.discard(None)
+        loan_ids = [loan_id for loan_id in loan_ids if ("loans", "status", "id", loan_id) not in self._lookup_cache]
+        found = get_records_by_ids(cursor, "loans", loan_ids, ["status"], logger=self.logger)
+        if found is None:
+            # Leave these loans to the per-row lookup
+            return
+        for loan_id in loan_ids:
+            record = found.get(loan_id)
+            self._lookup_cache[("loans", "status", "id", loan_id)] = record["status"] if record else None
+
+    def _prefetch_source_details(self, src_cursor, table_name, id_name, keys, columns):
+        """
+        Fetch source details for a batch of keys.
+        Args:
+            src_cursor: Source database cursor
+            table_name (str): Source table
+            id_name (str): Key column of the table
+            keys (set): Keys to fetch, None is ignored
+            columns (list): Columns to fetch
+        Returns:
+            dict: str(key) -> details dict, or None for keys that do not exist. Empty if the query failed.
+        """
+        keys.discard(None)
+        found = get_records_by_ids(src_cursor, table_name, keys, columns, logger=self.logger, id_name=id_name)
+        if found is None:
+            return {}
+        details = {str(key): None for key in keys}
+        details.update((str(key), record) for key, record in found.items())
+        return details
+
+    def _prefetch_loan_activities(self, source_rows, cursor, chunk_size=500):
+        """
+        Resolve the (category, integration id) loan activity keys of a batch with row-constructor IN queries.
+        Args:
+            source_rows (list[dict]): Source rows of the batch
+            cursor: Destination database cursor
+            chunk_size (int): Maximum number of key pairs per query
+        """
+        key_col = ("loan_activity_category_id", "integration_loan_activity_id")
+        pairs = {}
+        for source_row in source_rows:
+            if not source_row.get("bs_div_2_code"):
+                continue
+            pair = (source_row.get("bs_div_1_code"), source_row["bs_div_2_code"])
+            if ("loan_activities", "id", key_col, pair) not in self._lookup_cache:
+                pairs[(str(pair[0]), str(pair[1]))] = pair
+        if not pairs:
+            return
+
+        requested = list(pairs)
+        found = {}
+        try:
+            for start in range(0, len(requested), chunk_size):
+                chunk = requested[start:start + chunk_size]
+                placeholders = ", ".join(["(%s, %s)"] * len(chunk))
+                query = (f"SELECT loan_activity_category_id, integration_loan_activity_id, id FROM loan_activities "
+                         f"WHERE ({', '.join(key_col)}) IN ({placeholders})")
+                cursor.execute(query, [value for pair in chunk for value in pair])
+                for category_id, integration_id, activity_id in cursor.fetchall():
+                    found.setdefault((str(category_id), str(integration_id)), activity_id)
+        except Exception as e:
+            # Leave the remaining pairs to the per-row lookup
+            error_msg = f"Error prefetching loan activities: {str(e)}"
+            self.logger.error(error_msg)
+            print(error_msg)
+            return
+
+        for str_pair, pair in pairs.items():
+            self._lookup_cache[("loan_activities", "id", key_col, pair)] = found.get(str_pair)
+
+    def flush_pending_inserts(self, cursor):
+        """
+        Bulk insert the records deferred by process_columns and fill in their ids on the waiting rows.
+        Args:
+            cursor: Destination database cursor
+        """
+        if self._pending_clients:
+            self._flush_pending_clients(cursor)
+        if self._pending_applications:
+            self._flush_pending_applications(cursor)
+
+    def _flush_pending_clients(self, cursor):
+        """
+        Bulk insert the users and wallets of the pending clients and fill in the user_id of their rows.
+        If the bulk insert fails they are created one by one, like before they were deferred, and the
+        rows of the clients whose user or wallet fails are flagged with _skip_this_row.
+        Args:
+            cursor: Destination database cursor
+        """
+        pending, self._pending_clients = self._pending_clients, []
+
+        cursor.execute("SAVEPOINT pending_inserts")
+        try:
+            user_ids = insert_records(cursor, "users", [user_data for _, user_data, _ in pending], self.logger)
+            check_inserted_ids(cursor, "users", user_ids, "national_id",
+                               [user_data["national_id"] for _, user_data, _ in pending])
+
+            for user_id, (row_data, _, wallet_data) in zip(user_ids, pending):
+                row_data["user_id"] = user_id
+                wallet_data["user_id"] = user_id
+            insert_records(cursor, "wallets", [wallet_data for _, _, wallet_data in pending], self.logger)
+            cursor.execute("RELEASE SAVEPOINT pending_inserts")
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT pending_inserts")
+            self.logger.warning("Bulk insert of %s client users and wallets failed, inserting them one by one: %s",
+                                len(pending), e)
+            for row_data, user_data, wallet_data in pending:
+                # A client's user and wallet are written together or not at all
+                cursor.execute("SAVEPOINT pending_client")
+                try:
+                    user_id = insert_record(cursor, "users", user_data, self.logger)
+                    wallet_data["user_id"] = user_id
+                    insert_record(cursor, "wallets", wallet_data, self.logger)
+                    cursor.execute("RELEASE SAVEPOINT pending_client")
+                    row_data["user_id"] = user_id
+                except Exception as row_e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT pending_client")
+                    error_msg = f"Error creating user for client with national ID {user_data['national_id']}: {str(row_e)}"
+                    self.logger.error(error_msg)
+                    print(error_msg)
+                    row_data["user_id"] = None
+                    row_data["_skip_this_row"] = True
+
+        self.invalidate("users")
+        self.invalidate("wallets")
+        self.logger.debug("Inserted %s deferred client users and wallets", len(pending))
+
+    def _flush_pending_applications(self, cursor):
+        """
+        Bulk insert the pending placeholder applications and fill in the application_id of their loans.
+        If the bulk insert fails they are created one by one, like before they were deferred.
+        Args:
+            cursor: Destination database cursor
+        """
+        pending, self._pending_applications = self._pending_applications, {}
+        application_keys = list(pending)
+        applications = [pending[key][0] for key in application_keys]
+
+        cursor.execute("SAVEPOINT pending_applications")
+        try:
+            application_ids = insert_records(cursor, "loan_applications", applications, self.logger)
+            check_inserted_ids(cursor, "loan_applications", application_ids, "external_id",
+                               [application["external_id"] for application in applications])
+            cursor.execute("RELEASE SAVEPOINT pending_applications")
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT pending_applications")
+            self.logger.warning("Bulk insert of %s placeholder applications failed, inserting them one by one: %s",
+                                len(applications), e)
+            application_ids = []
+            for application in applications:
+                try:
+                    application_ids.append(insert_record(cursor, "loan_applications", application, self.logger))
+                except Exception as row_e:
+                    error_msg = f"Error creating placeholder application: {str(row_e)}"
+                    self.logger.error(error_msg)
+                    print(error_msg)
+                    application_ids.append(None)
+
+        for application_key, application_id in zip(application_keys, application_ids):
+            if application_id:
+                self._lookup_cache[("loan_applications", "id", "external_id", application_key)] = application_id
+            for row_data in pending[application_key][1]:
+                row_data["application_id"] = application_id
+        self.logger.info("Created %s placeholder applications", sum(1 for application_id in application_ids if application_id))
+
+    def take_split_off_transactions(self):
+        """
+        Hand over the transactions split off the source transactions processed since the last call.
+        The driver inserts them just before the transaction they were split off, so that every loan's
+        transactions keep the id order settle_transactions relies on.
+        Returns:
+            list[dict]: Split-off loan_transactions rows, in the order they were created
+        """
+        pending, self._pending_transactions = self._pending_transactions, []
+        return pending
+
+    def _load_loan_products(self, cursor):
+        """
+        Load the PRODUCT_COLUMNS of every loan product, there are only a few of them.
+        Args:
+            cursor: Destination database cursor
+        """
+        cursor.execute(f"SELECT id, {', '.join(self.PRODUCT_COLUMNS)} FROM loan_products")
+        self._loan_products_by_id = {result[0]: dict(zip(self.PRODUCT_COLUMNS, result[1:])) for result in cursor.fetchall()}
+        self.logger.debug("Loaded %s loan products", len(self._loan_products_by_id))
+
+    def _load_client_maps(self, cursor):
+        """
+        Load the wallet, user and external id of every client with one joined query.
+        Args:
+            cursor: Destination database cursor
+        """
+        cursor.execute(
+            "SELECT c.id, w.id, c.user_id, c.external_id FROM clients c "
+            "LEFT JOIN wallets w ON w.user_id = c.user_id AND w.role_id = 3 "
+            "ORDER BY c.id, w.id"
+        )
+        self._client_to_wallet = {}
+        self._client_to_user = {}
+        self._client_external_ids = {}
+        for client_id, wallet_id, user_id, external_id in cursor.fetchall():
+            # Keep the first wallet when a user has several
+            if wallet_id is not None:
+                self._client_to_wallet.setdefault(client_id, wallet_id)
+            self._client_to_user[client_id] = user_id
+            self._client_external_ids[client_id] = external_id
+        self.logger.debug("Loaded wallet and user ids of %s clients", len(self._client_to_user))
+
+    def _lookup_user_ids(self, names, emails, cursor):
+        """
+        Resolve user IDs by name and email, querying only the ones that are not cached yet.
+        Args:
+            names (list): User names to resolve
+            emails (list): User emails to resolve
+            cursor: Database cursor
+        Returns:
+            tuple[dict, dict]: (name -> user ID or None, email -> user ID or None)
+        """
+        missing_names = {name for name in names if ("users", "id", "name", name) not in self._lookup_cache}
+        missing_emails = {email for email in emails if ("users", "id", "email", email) not in self._lookup_cache}
+        if missing_names or missing_emails:
+            try:
+                by_name, by_email = resolve_user_ids(cursor, missing_names, missing_emails, self.logger)
+            except Exception as e:
+                error_msg = f"Error resolving users {sorted(map(str, missing_names | missing_emails))}: {str(e)}"
+                self.logger.error(error_msg)
+                print(error_msg)
+                return {name: None for name in names}, {email: None for email in emails}
+            for name in missing_names:
+                self._lookup_cache[("users", "id", "name", name)] = by_name.get(name)
+            for email in missing_emails:
+                self._lookup_cache[("users", "id", "email", email)] = by_email.get(email)
+
+        return ({name: self._lookup_cache[("users", "id", "name", name)] for name in names},
+                {email: self._lookup_cache[("users", "id", "email", email)] for email in emails})
+
+    def _resolve_branch(self, row_data, source_row, cursor):
+        """Set branch_id from the source branch_code."""
+        if source_row.get("branch_code"):
+            if self._log_debug_enabled:
+                self.logger.debug("Looking up branch with code: %s", source_row['branch_code'])
+            branch_id = self._cached_lookup("branches", "id", "external_id", source_row['branch_code'], cursor)
+            if branch_id:
+                if self._log_debug_enabled:
+                    self.logger.debug("Found branch_id: %s", branch_id)
+                row_data["branch_id"] = branch_id
+            else:
+                self.logger.warning("Branch not found for code: %s", source_row['branch_code'])
+
+    def _resolve_org_branch(self, row_data, source_row, cursor):
+        """Set old_branch_code from the source org_branch_code."""
+        if source_row.get("org_branch_code"):
+            if self._log_debug_enabled:
+                self.logger.debug("Looking up original branch with code: %s", source_row['org_branch_code'])
+            org_branch_id = self._cached_lookup("branches", "id", "external_id", source_row['org_branch_code'], cursor)
+            if org_branch_id:
+                if self._log_debug_enabled:
+                    self.logger.debug("Found original branch_id: %s", org_branch_id)
+                row_data["old_branch_code"] = org_branch_id
+            else:
+                self.logger.warning("Original branch not found for code: %s", source_row['org_branch_code'])
+
+    def _resolve_client(self, row_data, source_row, cursor):
+        """Set client_id from the source client_key."""
+        if source_row.get("client_key"):
+            if self._log_debug_enabled:
+                self.logger.debug("Looking up client with key: %s", source_row['client_key'])
+            client_id = self._cached_lookup("clients", "id", "external_id", source_row['client_key'], cursor)
+            if client_id:
+                if self._log_debug_enabled:
+                    self.logger.debug("Found client_id: %s", client_id)
+                row_data["client_id"] = client_id
+            else:
+                self.logger.warning("Client not found for key: %s", source_row['client_key'])
+
+    def _resolve_officer(self, row_data, source_row, cursor):
+        """Set loan_officer_id and created_by_id from the source officer_key."""
+        if source_row.get("officer_key"):
+            loan_officer_id = self._cached_lookup("users", "id", "external_id", source_row['officer_key'], cursor)
+            if loan_officer_id:
+                row_data["loan_officer_id"] = loan_officer_id
+                row_data["created_by_id"] = loan_officer_id
+
+    def _resolve_loan_product(self, row_data, source_row, cursor):
+        """Set loan_product_id from the source loan_type_code."""
+        if source_row.get("loan_type_code"):
+            loan_product_id = self._cached_lookup("loan_products", "id", "external_id", source_row['loan_type_code'], cursor)
+            if loan_product_id:
+                row_data["loan_product_id"] = loan_product_id
+
+    def _resolve_application(self, row_data, source_row, cursor):
+        """Set application_id from the source application_key, creating a placeholder application if missing."""
+        if source_row.get("application_key"):
+            application_key = source_row['application_key']
+            application_id = self._cached_lookup("loan_applications", "id", "external_id", application_key, cursor)
+            if application_id:
+                row_data["application_id"] = application_id
+            elif application_key in self._pending_applications:
+                # Placeholder already queued by an earlier loan of the batch
+                self._pending_applications[application_key][1].append(row_data)
+                row_data["application_id"] = None
+            elif "client_id" in row_data and "loan_product_id" in row_data:
+                # Queue a placeholder application, flush_pending_inserts creates it and sets application_id
+                self._pending_applications[application_key] = (build_placeholder_application(row_data, source_row), [row_data])
+                row_data["application_id"] = None
+
+    def bind(self, migration_name):
+        """
+        Get the processing function of a migration, so the per-row work skips the dispatch on its name.
+        Args:
+            migration_name (str): The name of the migration.
+        Returns:
+            callable: Function taking (row_data, source_row=None, cursor=None, src_cursor=None) and
+            returning the processed row like process_columns.
+        """
+        self._log_debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        processors = {
+            "officers": self._process_officers,
+            "clients": self._process_clients,
+            "loan_products": self._process_loan_products,
+            "loan_applications": self._process_loan_applications,
+            "loans": self._process_loans,
+            "installments": self._process_installments,
+            "transactions": self._process_transactions,
+        }
+        return processors.get(migration_name, self._process_default)
+
     def process_columns(self, migration_name, row_data, source_row=None, cursor=None, src_cursor=None):
         """
         Override this method to add custom logic for specific migrations.
@@ -32,899 +702,664 @@ class CustomLogic:
         Returns:
             dict: Modified row data after processing.
         """
-        self.logger.debug(f"Processing columns for migration: {migration_name}")
-        
-        # Common lookups for multiple migration types
+        self.logger.debug("Processing columns for migration: %s", migration_name)
+        row_data = self.bind(migration_name)(row_data, source_row, cursor, src_cursor)
+        self.logger.debug("Finished processing columns for %s", migration_name)
+        return row_data
+
+    def _process_default(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Migrations without custom logic keep their row as is."""
+        return row_data
+
+    def _process_officers(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the officers migration."""
         if source_row:
-            # Branch lookup - used in multiple migrations
-            if source_row.get("branch_code") and migration_name in ["officers", "clients", "loan_applications", "loans", "transactions"]:
-                self.logger.debug(f"Looking up branch with code: {source_row['branch_code']}")
-                branch_id = get_record_value(
-                    table="branches", 
-                    condition=f"external_id = '{source_row['branch_code']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if branch_id:
-                    self.logger.debug(f"Found branch_id: {branch_id}")
-                    row_data["branch_id"] = branch_id
-                else:
-                    self.logger.warning(f"Branch not found for code: {source_row['branch_code']}")
-            
-            if source_row.get("org_branch_code") and migration_name in ["clients", "loans", "transactions"]:
-                self.logger.debug(f"Looking up original branch with code: {source_row['org_branch_code']}")
-                org_branch_id = get_record_value(
-                    table="branches", 
-                    condition=f"external_id = '{source_row['org_branch_code']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if org_branch_id:
-                    self.logger.debug(f"Found original branch_id: {org_branch_id}")
-                    row_data["old_branch_code"] = org_branch_id
-                else:
-                    self.logger.warning(f"Original branch not found for code: {source_row['org_branch_code']}")
-
-            # Client lookup
-            if source_row.get("client_key") and migration_name in ["loan_applications", "loans"]:
-                self.logger.debug(f"Looking up client with key: {source_row['client_key']}")
-                client_id = get_record_value(
-                    table="clients", 
-                    condition=f"external_id = '{source_row['client_key']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if client_id:
-                    self.logger.debug(f"Found client_id: {client_id}")
-                    row_data["client_id"] = client_id
-                else:
-                    self.logger.warning(f"Client not found for key: {source_row['client_key']}")
-
-            # Loan officer lookup
-            if source_row.get("officer_key") and migration_name in ["clients", "loan_applications", "loans", "transactions"]:
-                loan_officer_id = get_record_value(
-                    table="users", 
-                    condition=f"external_id = '{source_row['officer_key']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if loan_officer_id:
-                    row_data["loan_officer_id"] = loan_officer_id
-                    row_data["created_by_id"] = loan_officer_id
-            
-            # Loan product lookup
-            if source_row.get("loan_type_code") and migration_name in ["loan_applications", "loans"]:
-                loan_product_id = get_record_value(
-                    table="loan_products", 
-                    condition=f"external_id = '{source_row['loan_type_code']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if loan_product_id:
-                    row_data["loan_product_id"] = loan_product_id
-                    
-            # Application lookup for loans
-            if source_row.get("application_key") and migration_name == "loans":
-                application_id = get_record_value(
-                    table="loan_applications", 
-                    condition=f"external_id = '{source_row['application_key']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if application_id:
-                    row_data["application_id"] = application_id
-                elif "client_id" in row_data and "loan_product_id" in row_data:
-                    # Create a placeholder application if it doesn't exist
-                    application_id = create_placeholder_application(
-                        cursor, 
-                        row_data, 
-                        source_row,
-                        self.logger
-                    )
-                    if application_id:
-                        row_data["application_id"] = application_id
-
-        # Migration-specific logic
-        if migration_name == "officers":
-            # Add email field for officers
-            if "name" in row_data:
-                name_part = str(row_data["name"]).lower().replace(' ', '.')
-                row_data["email"] = f"{name_part}@sandah.org"
-            # Add gender field (1 male and 2 female)
-            row_data["gender"] = bool(row_data['gender'] == 1)
-            # Set role id to officers id type (60)
-            row_data["role_id"] = 60
-
-        elif migration_name == "clients":
-            # Insert user using the general insert_record function
-            user_data = {
-                "name": row_data["name"],
-                "national_id": row_data["national_id"],
-                "branch_id": row_data["branch_id"],
-                "gender": row_data["gender"],
-                "created_at": row_data["created_at"],
-                "role_id": 3
-            }
-            self.logger.debug(f"Inserting user record for client: {user_data['name']}")
-            user_id = insert_record(cursor, "users", user_data, self.logger)
-            row_data["user_id"] = user_id
-            self.logger.debug(f"User created with ID: {user_id}")
-
-            # Insert wallet for the user
-            wallet_data = {
-                "user_id": user_id,
-                "role_id": 3,
-                "currency_id": 1,
-                "wallet_type": "cash",
-                "amount": 0,
-                "active": True,
-                "created_at": row_data["created_at"]
-            }
-            insert_record(cursor, "wallets", wallet_data, self.logger)
+            self._resolve_branch(row_data, source_row, cursor)
 
-            row_data["gender"] = bool(source_row['gender'] == 1)
-            row_data["is_guarantor"] = bool(source_row['client_status'] == 0)
-            
-            # Create address from parts, filtering out empty values
-            address_parts = [
-                source_row['home_add_1'],
-                source_row['home_add_2'],
-                source_row['home_add_3']
-            ]
-            address_parts = [part for part in address_parts if part and str(part).strip()]
-            row_data["address"] = ", ".join(address_parts) if address_parts else None
-            
-            # Get birthplace from national ID
-            row_data["birthplace_id"] = get_governorate_from_national_id(row_data["national_id"])
-            
-            # Extract latitude and longitude from location if available
-            if source_row.get('home_geography'):
-                home_geography = source_row['home_geography']
-                lat, lon = extract_lat_lon_from_wkb(home_geography, logger=self.logger)
+        # Add email field for officers
+        if "name" in row_data:
+            name_part = str(row_data["name"]).lower().replace(' ', '.')
+            row_data["email"] = f"{name_part}@sandah.org"
+        # Add gender field (1 male and 2 female)
+        row_data["gender"] = GENDER_MAP.get(row_data['gender'], False)
+        # Set role id to officers id type (60)
+        row_data["role_id"] = 60
+
+        return row_data
 
-                row_data["latitude"] = lat
-                row_data["approved_latitude"] = lat
-                row_data["longitude"] = lon
-                row_data["approved_longitude"] = lon
+    def _process_clients(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the clients migration."""
+        if source_row:
+            self._resolve_branch(row_data, source_row, cursor)
+            self._resolve_org_branch(row_data, source_row, cursor)
+            self._resolve_officer(row_data, source_row, cursor)
+
+        # User and wallet are inserted in bulk by flush_pending_inserts, which also sets user_id
+        user_data = {
+            "name": row_data["name"],
+            "national_id": row_data["national_id"],
+            "branch_id": row_data["branch_id"],
+            "gender": row_data["gender"],
+            "created_at": row_data["created_at"],
+            "role_id": 3
+        }
+        self.logger.debug("Deferring user record for client: %s", user_data['name'])
+        row_data["user_id"] = None
+
+        # Wallet for the user
+        wallet_data = {
+            "user_id": None,
+            "role_id": 3,
+            "currency_id": 1,
+            "wallet_type": "cash",
+            "amount": 0,
+            "active": True,
+            "created_at": row_data["created_at"]
+        }
+        self._pending_clients.append((row_data, user_data, wallet_data))
+
+        row_data["gender"] = GENDER_MAP.get(source_row['gender'], False)
+        row_data["is_guarantor"] = source_row['client_status'] == 0
+        
+        # Create address from parts, filtering out empty values
+        row_data["address"] = join_non_empty(source_row['home_add_1'], source_row['home_add_2'], source_row['home_add_3'])
+        
+        # Get birthplace from national ID
+        row_data["birthplace_id"] = get_governorate_from_national_id(row_data["national_id"])
+        
+        # Extract latitude and longitude from location if available
+        if source_row.get('home_geography'):
+            home_geography = source_row['home_geography']
+            if home_geography in self._coordinates:
+                lat, lon = self._coordinates[home_geography]
             else:
-                row_data["latitude"] = 0.00000000
-                row_data["approved_latitude"] = 0.00000000
-                row_data["longitude"] = 0.00000000
-                row_data["approved_longitude"] = 0.00000000
-            
-            # default values
-            row_data["corporate_id"] = 0
-            row_data["country_id"] = 63
-            row_data["display_name"] = row_data['name']
-            row_data["third_name"] = ''
-            row_data["active"] = True
-            row_data["status"] = "active"
-            marital_status = row_data.get("marital_status_id")
-            row_data["marital_status_id"] = 6 if marital_status is None or marital_status == 0 or marital_status == "" else marital_status
-            qualification = row_data.get("qualification_id")
-            row_data["qualification_id"] = 8 if qualification is None or qualification == 0 or qualification == "" else qualification
+                lat, lon = extract_lat_lon_from_wkb(home_geography, logger=self.logger)
+
+            row_data["latitude"] = lat
+            row_data["approved_latitude"] = lat
+            row_data["longitude"] = lon
+            row_data["approved_longitude"] = lon
+        else:
+            row_data["latitude"] = 0.00000000
+            row_data["approved_latitude"] = 0.00000000
+            row_data["longitude"] = 0.00000000
+            row_data["approved_longitude"] = 0.00000000
         
-        elif migration_name == "loan_products":
-            row_data["decimals"] = 0
-            row_data["product_type"] = "commercial"
-            row_data["active"] = 1
-            row_data["penalty_id"] = 3
-            row_data["fund_id"] = 1
-            
-            def flat_to_declining(flat_rate, periods):
-                """Convert flat interest rate to declining balance rate."""
-                self.logger.debug(f"Converting flat rate {flat_rate}% over {periods} periods to declining balance")
-                flat_rate = float(flat_rate) / 100  # Convert percentage to decimal
-                # Formula: r = 2R/(n+1) where R is flat rate, n is number of periods
-                declining_rate = (2 * flat_rate * periods) / (periods + 1)
-                return round(declining_rate * 100, 4)  # Convert back to percentage
-            
-            # Convert flat interest rates to declining balance using respective terms
-            flat_default = float(row_data.get("flat_default_interest_rate", 0))
-            flat_minimum = float(row_data.get("flat_minimum_interest_rate", 0))
-            flat_maximum = float(row_data.get("flat_maximum_interest_rate", 0))
-            
-            default_term = int(row_data.get("default_loan_term", 12))
-            minimum_term = int(row_data.get("minimum_loan_term", 12))
-            maximum_term = int(row_data.get("maximum_loan_term", 12))
-            
-            row_data["default_interest_rate"] = flat_to_declining(flat_default, default_term) if flat_default else 0.0
-            row_data["minimum_interest_rate"] = flat_to_declining(flat_minimum, minimum_term) if flat_minimum else 0.0
-            row_data["maximum_interest_rate"] = flat_to_declining(flat_maximum, maximum_term) if flat_maximum else 0.0
-            
-            row_data["interest_rate_type"] = "year"
-            row_data["repayment_frequency"] = 1
-            row_data["repayment_frequency_type"] = "months"
-            row_data["amortization_method"] = "equal_installments"
-            row_data["interest_methodology"] = "declining_balance"
-            row_data["loan_transaction_processing_strategy_id"] = 24 if row_data["loan_transaction_processing_strategy_id"] == 2 else 23
-
-        elif migration_name == "loan_applications":
-            # Application status mapping
-            application_status = source_row.get("application_status")
-            if application_status == 1:
-                status = 'approved'
-            elif application_status == 2:
-                status = 'rejected'
+        # default values
+        row_data["corporate_id"] = 0
+        row_data["country_id"] = 63
+        row_data["display_name"] = row_data['name']
+        row_data["third_name"] = ''
+        row_data["active"] = True
+        row_data["status"] = "active"
+        marital_status = row_data.get("marital_status_id")
+        row_data["marital_status_id"] = DEFAULT_MARITAL_STATUS_ID if marital_status in _FALSY else marital_status
+        qualification = row_data.get("qualification_id")
+        row_data["qualification_id"] = DEFAULT_QUALIFICATION_ID if qualification in _FALSY else qualification
+
+        return row_data
+
+    def _process_loan_products(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the loan products migration."""
+        row_data["decimals"] = 0
+        row_data["product_type"] = "commercial"
+        row_data["active"] = 1
+        row_data["penalty_id"] = 3
+        row_data["fund_id"] = 1
+
+        # Convert flat interest rates to declining balance using respective terms
+        flat_default, flat_minimum, flat_maximum, default_term, minimum_term, maximum_term = _PRODUCT_RATES_AND_TERMS(row_data)
+        flat_default, flat_minimum, flat_maximum = float(flat_default), float(flat_minimum), float(flat_maximum)
+        default_term, minimum_term, maximum_term = int(default_term), int(minimum_term), int(maximum_term)
+        self.logger.debug("Converting flat rates %s/%s/%s%% over %s/%s/%s periods to declining balance",
+                          flat_default, flat_minimum, flat_maximum, default_term, minimum_term, maximum_term)
+
+        row_data["default_interest_rate"] = flat_to_declining(flat_default, default_term) if flat_default else 0.0
+        row_data["minimum_interest_rate"] = flat_to_declining(flat_minimum, minimum_term) if flat_minimum else 0.0
+        row_data["maximum_interest_rate"] = flat_to_declining(flat_maximum, maximum_term) if flat_maximum else 0.0
+        
+        row_data["interest_rate_type"] = "year"
+        row_data["repayment_frequency"] = 1
+        row_data["repayment_frequency_type"] = "months"
+        row_data["amortization_method"] = "equal_installments"
+        row_data["interest_methodology"] = "declining_balance"
+        row_data["loan_transaction_processing_strategy_id"] = 24 if row_data["loan_transaction_processing_strategy_id"] == 2 else 23
+
+        return row_data
+
+    def _process_loan_applications(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the loan applications migration."""
+        if source_row:
+            self._resolve_branch(row_data, source_row, cursor)
+            self._resolve_client(row_data, source_row, cursor)
+            self._resolve_officer(row_data, source_row, cursor)
+            self._resolve_loan_product(row_data, source_row, cursor)
+
+        # Application status mapping
+        row_data["status"] = APPLICATION_STATUS_MAP.get(source_row.get("application_status"), 'pending')
+        row_data["revolving_enabled"] = False
+
+        return row_data
+
+    def _process_loans(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the loans migration."""
+        if source_row:
+            self._resolve_branch(row_data, source_row, cursor)
+            self._resolve_org_branch(row_data, source_row, cursor)
+            self._resolve_client(row_data, source_row, cursor)
+            self._resolve_officer(row_data, source_row, cursor)
+            self._resolve_loan_product(row_data, source_row, cursor)
+            self._resolve_application(row_data, source_row, cursor)
+
+        if source_row and source_row.get("bs_div_2_code"):
+            self.logger.debug("Looking up loan activity with category: %s and integration ID: %s", source_row['bs_div_1_code'], source_row['bs_div_2_code'])
+            loan_activity_id = self._cached_lookup(
+                "loan_activities", "id",
+                ("loan_activity_category_id", "integration_loan_activity_id"),
+                (source_row['bs_div_1_code'], source_row['bs_div_2_code']),
+                cursor
+            )
+            if loan_activity_id:
+                self.logger.debug("Found loan_activity_id: %s", loan_activity_id)
+                row_data["loan_activity_id"] = loan_activity_id
             else:
-                status = 'pending'
-            row_data["status"] = status
-            row_data["revolving_enabled"] = False
-
-        elif migration_name == "loans":
-            if source_row and source_row.get("bs_div_2_code"):
-                self.logger.debug(f"Looking up loan activity with category: {source_row['bs_div_1_code']} and integration ID: {source_row['bs_div_2_code']}")
-                loan_activity_id = get_record_value(
-                    table="loan_activities", 
-                    condition=f"loan_activity_category_id = '{source_row['bs_div_1_code']}' AND integration_loan_activity_id = '{source_row['bs_div_2_code']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if loan_activity_id:
-                    self.logger.debug(f"Found loan_activity_id: {loan_activity_id}")
-                    row_data["loan_activity_id"] = loan_activity_id
-                else:
-                    self.logger.warning(f"Loan activity not found for category: {source_row['bs_div_1_code']} and integration ID: {source_row['bs_div_2_code']}")
+                self.logger.warning("Loan activity not found for category: %s and integration ID: %s", source_row['bs_div_1_code'], source_row['bs_div_2_code'])
 
-            # Determine if the loan is renewed
-            client_id = row_data.get("client_id")
-            if client_id:
-                existing_loans_count = get_record_value(
-                    table="loans",
-                    condition=f"client_id = {client_id}",
-                    column="COUNT(*)",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                row_data["is_renewed"] = existing_loans_count > 0
-                self.logger.debug(f"Set is_renewed to {row_data['is_renewed']} for client_id {client_id}")
+        # Determine if the loan is renewed
+        client_id = row_data.get("client_id")
+        if client_id:
+            if self._clients_with_loans is None:
+                cursor.execute("SELECT DISTINCT client_id FROM loans")
+                self._clients_with_loans = {result[0] for result in cursor.fetchall()}
+                self.logger.debug("Loaded %s clients with existing loans", len(self._clients_with_loans))
+            row_data["is_renewed"] = client_id in self._clients_with_loans
+            # Any later loan of this client in the run is a renewal
+            self._clients_with_loans.add(client_id)
+            self.logger.debug("Set is_renewed to %s for client_id %s", row_data['is_renewed'], client_id)
 
-            # Loan status mapping
-            loan_status = source_row.get("loan_status")
-            loan_cond = source_row.get("loan_cond")
-            
-            if loan_cond == 2 and source_row.get("fully_paid_date") is not None:
-                status = 'written_off'
-                self.logger.info(f"Setting loan status to written_off based on loan_cond={loan_cond} and fully_paid_date is present")
-            elif loan_status == 0:
-                status = 'submitted'
-            elif loan_status == 1:
-                status = 'active'
-            elif loan_status == 5:
-                status = 'closed'
-            elif loan_status == 6:
-                status = 'withdrawn'
+        # Loan status mapping
+        loan_status = source_row.get("loan_status")
+        loan_cond = source_row.get("loan_cond")
+        
+        if loan_cond == 2 and source_row.get("fully_paid_date") is not None:
+            status = 'written_off'
+            self.logger.info("Setting loan status to written_off based on loan_cond=%s and fully_paid_date is present", loan_cond)
+        else:
+            status = LOAN_STATUS_MAP.get(loan_status, 'pending')
+        row_data["status"] = status
+
+        if status != 'approved':
+            row_data['principal_disbursed_derived'] = row_data['approved_amount']
+
+        # Get loan application details if available
+        if "application_id" in row_data:
+            application_key = source_row.get('application_key')
+            if str(application_key) in self._src_application_details:
+                application_details = self._src_application_details[str(application_key)]
             else:
-                status = 'pending'
-            row_data["status"] = status
-
-            if status != 'approved':
-                row_data['principal_disbursed_derived'] = row_data['approved_amount']
-
-            # Get loan application details if available
-            if "application_id" in row_data:
-                application_key = source_row.get('application_key')
-                app_columns = [
-                    "req_am", "req_no", "br_deputy_note", "officer_supervisor_note",
-                    "loan_gen_user", "loan_gen_date", "user_name", "dec_user", "dec_date", "br_deputy_user_name",
-                    "officer_supervisor_user_name", "br_deputy_bus_location"
-                ]
-                
                 application_details = get_record_details_by_id(src_cursor, "ilts.c1_loan_application", application_key,
-                                                            app_columns, logger=self.logger, id_name='application_key')
-                    
-                dest_app_columns = [
-                    "loan_product_id", "client_id", "branch_id"
-                ]
-                dist_application_details = get_record_details_by_id(cursor, "loan_applications", row_data.get('application_id'),
-                                                                    dest_app_columns, logger=self.logger)
+                                                            self.APPLICATION_COLUMNS, logger=self.logger, id_name='application_key')
                 
-                if application_details:
-                    row_data["applied_amount"] = application_details.get("req_am")
-                    row_data["applied_loan_term"] = application_details.get("req_no")
-                    row_data["approved_notes"] = application_details.get("br_deputy_note")
-                    row_data["report"] = application_details.get("officer_supervisor_note")
-                    row_data["created_at"] = application_details.get("loan_gen_date")
-                    # Extract latitude and longitude from location if available
-                    if application_details.get('br_deputy_bus_location'):
-                        br_deputy_bus_location = application_details.get('br_deputy_bus_location')
-                        lat, lon = extract_lat_lon_from_wkb(br_deputy_bus_location, logger=self.logger)
-                        row_data["latitude"] = lat
-                        row_data["longitude"] = lon
-
-                    row_data["created_by_id"] = get_record_value(
-                                                    table="users", 
-                                                    condition=f"name = '{application_details.get('loan_gen_user')}'",
-                                                    column="id",
-                                                    cursor=cursor,
-                                                    logger=self.logger
-                                                )
-                    row_data["submitted_by_user_id"] = get_record_value(
-                                                    table="users", 
-                                                    condition=f"name = '{application_details.get('loan_gen_user')}'",
-                                                    column="id",
-                                                    cursor=cursor,
-                                                    logger=self.logger
-                                                )
-                    row_data["approved_by_user_id"] = get_record_value(
-                                                    table="users", 
-                                                    condition=f"name = '{application_details.get('dec_user')}'",
-                                                    column="id",
-                                                    cursor=cursor,
-                                                    logger=self.logger
-                                                )
-
-                    username = row_data.get('disbursed_by_user_id')
-                    self.logger.debug(f"Looking up user with username: {username}")
-                    
-                    # Reset disbursed_by_user_id before setting new value
-                    row_data["disbursed_by_user_id"] = 1
-                    
-                    disbursed_by_user_id = get_record_value(
-                                                    table="users", 
-                                                    condition=f"email = '{username}@sandah.org'",
-                                                    column="id",
-                                                    cursor=cursor,
-                                                    logger=self.logger
-                                                )
-                    row_data["disbursed_by_user_id"] = disbursed_by_user_id
-                    if "loan_product_id" not in row_data and dist_application_details.get("loan_product_id"):
-                        row_data["loan_product_id"] = application_details.get("loan_product_id")
-                    if "client_id" not in row_data and dist_application_details.get("client_id"):
-                        row_data["client_id"] = application_details.get("client_id")
-                    if "branch_id" not in row_data and dist_application_details.get("branch_id"):
-                        row_data["branch_id"] = application_details.get("branch_id")
+            application_id = row_data.get('application_id')
+            if application_id in self._application_details:
+                dist_application_details = self._application_details[application_id]
+            elif application_id is None and application_key in self._pending_applications:
+                placeholder = self._pending_applications[application_key][0]
+                dist_application_details = {column: placeholder.get(column) for column in self.DEST_APPLICATION_COLUMNS}
+            else:
+                # Not prefetched, e.g. a placeholder application created for this loan
+                dist_application_details = get_record_details_by_id(cursor, "loan_applications", application_id,
+                                                                    self.DEST_APPLICATION_COLUMNS, logger=self.logger)
             
-            # Get loan product details if available
-            if "loan_product_id" in row_data:
-                loan_product_id = row_data["loan_product_id"]
-                product_columns = [
-                    "product_type", "fund_id", "repayment_frequency", "repayment_frequency_type",
-                    "interest_rate_type", "interest_methodology", "amortization_method",
-                    "decimals", "loan_transaction_processing_strategy_id"
-                ]
-                product_details = get_record_details_by_id(cursor, "loan_products", loan_product_id, product_columns, logger=self.logger)
-                
-                if product_details:
-                    row_data["fund_id"] = product_details.get("fund_id", 1)
-                    row_data["repayment_frequency"] = product_details.get("repayment_frequency", 1)
-                    row_data["repayment_frequency_type"] = product_details.get("repayment_frequency_type", "months")
-                    row_data["interest_rate_type"] = product_details.get("interest_rate_type", "year")
-                    row_data["interest_methodology"] = product_details.get("interest_methodology", "declining_balance")
-                    row_data["amortization_method"] = product_details.get("amortization_method", "equal_installments")
-                    row_data["decimals"] = product_details.get("decimals", 0)
-                    row_data["loan_transaction_processing_strategy_id"] = product_details.get("loan_transaction_processing_strategy_id", 23)
-                else:
-                    row_data["fund_id"] = 1
-                    row_data["repayment_frequency"] = 1
-                    row_data["repayment_frequency_type"] = "months"
-                    row_data["interest_rate_type"] = "year"
-                    row_data["interest_methodology"] = "declining_balance"
-                    row_data["amortization_method"] = "equal_installments"
-                    row_data["decimals"] = 0
-                    row_data["loan_transaction_processing_strategy_id"] = 24 if row_data.get("loan_transaction_processing_strategy_id") == 2 else 23
-
-            # Get client details if client_id is available (e.g., to get wallet_id)
-            if "client_id" in row_data:
-                user_id = get_record_value(
-                        table="clients", 
-                        condition=f"id = '{row_data['client_id']}'",
-                        column="user_id",
-                        cursor=cursor,
-                        conn=self.dest_conn,
-                        logger=self.logger)
-                wallet_id = get_record_value(
-                        table="wallets", 
-                        condition=f"user_id = '{user_id}'",
-                        column="id",
-                        cursor=cursor,
-                        conn=self.dest_conn,
-                        logger=self.logger)
-                if wallet_id:
-                    row_data["wallet_id"] = wallet_id
-
-                client_key = get_record_value(
-                    table="clients",
-                    condition=f"id = '{row_data['client_id']}'",
-                    column="external_id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger)
-
-                client_columns = [
-                    "bus_name", "bus_add_1", "bus_add_2", "bus_add_3"
-                ]
-
-                client_details = get_record_details_by_id(src_cursor, "ilts.c1_client_info_table", client_key, client_columns,
-                                                          logger=self.logger, id_name="client_key")
+            if application_details:
+                row_data["applied_amount"] = application_details.get("req_am")
+                row_data["applied_loan_term"] = application_details.get("req_no")
+                row_data["approved_notes"] = application_details.get("br_deputy_note")
+                row_data["report"] = application_details.get("officer_supervisor_note")
+                row_data["created_at"] = application_details.get("loan_gen_date")
+                # Extract latitude and longitude from location if available
+                if application_details.get('br_deputy_bus_location'):
+                    br_deputy_bus_location = application_details.get('br_deputy_bus_location')
+                    if br_deputy_bus_location in self._coordinates:
+                        lat, lon = self._coordinates[br_deputy_bus_location]
+                    else:
+                        lat, lon = extract_lat_lon_from_wkb(br_deputy_bus_location, logger=self.logger)
+                    row_data["latitude"] = lat
+                    row_data["longitude"] = lon
+
+                username = row_data.get('disbursed_by_user_id')
+                self.logger.debug("Looking up user with username: %s", username)
+                loan_gen_user = application_details.get('loan_gen_user')
+                dec_user = application_details.get('dec_user')
+                disbursed_by_email = f"{username}@sandah.org"
 
-                if client_details:
-                    row_data["activity_name"] = client_details.get("bus_name") if client_details.get("bus_name") is not None else ''
-                    # Create address from parts, filtering out empty values
-                    address_parts = [
-                        client_details.get("bus_add_1"),
-                        client_details.get("bus_add_2"),
-                        client_details.get("bus_add_3")
-                    ]
-                    address_parts = [part for part in address_parts if part and str(part).strip()]
-                    row_data["project_address"] = ", ".join(address_parts) if address_parts else None
-
-            # These fields are always set regardless of loan product or application
-            row_data["loan_purpose_id"] = 1
+                # One query for the creator, approver and disburser
+                by_name, by_email = self._lookup_user_ids([loan_gen_user, dec_user], [disbursed_by_email], cursor)
+                row_data["created_by_id"] = by_name[loan_gen_user]
+                row_data["submitted_by_user_id"] = by_name[loan_gen_user]
+                row_data["approved_by_user_id"] = by_name[dec_user]
+                row_data["disbursed_by_user_id"] = by_email[disbursed_by_email]
+                if "loan_product_id" not in row_data and dist_application_details.get("loan_product_id"):
+                    row_data["loan_product_id"] = application_details.get("loan_product_id")
+                if "client_id" not in row_data and dist_application_details.get("client_id"):
+                    row_data["client_id"] = application_details.get("client_id")
+                if "branch_id" not in row_data and dist_application_details.get("branch_id"):
+                    row_data["branch_id"] = application_details.get("branch_id")
+        
+        # Get loan product details if available
+        if "loan_product_id" in row_data:
+            if self._loan_products_by_id is None:
+                self._load_loan_products(cursor)
+            product_details = self._loan_products_by_id.get(row_data["loan_product_id"])
             
-            # Set first_payment_date to one month after disbursed_on_date without using relativedelta
-            if "disbursed_on_date" in row_data and row_data["disbursed_on_date"]:
-                # Get the disbursed date
-                disbursed_date = row_data["disbursed_on_date"]
-                
-                # Calculate one month later using standard datetime
-                month = disbursed_date.month + 1
-                year = disbursed_date.year
-                
-                # Handle month overflow
-                if month > 12:
-                    month = 1
-                    year += 1
-                
-                # Create new date with same day, but next month
-                try:
-                    # Handle edge cases like Jan 31 -> Feb 28
-                    first_payment_date = disbursed_date.replace(year=year, month=month)
-                except ValueError:
-                    # If the day doesn't exist in the target month, use the last day of that month
-                    if month == 12:
-                        first_payment_date = datetime.datetime(year + 1, 1, 1) - datetime.timedelta(days=1)
-                    else:
-                        first_payment_date = datetime.datetime(year, month + 1, 1) - datetime.timedelta(days=1)
-                
-                row_data["first_payment_date"] = first_payment_date
-                self.logger.debug(f"Set first_payment_date to {row_data['first_payment_date']}")
+            if product_details:
+                row_data["fund_id"] = product_details.get("fund_id", 1)
+                row_data["repayment_frequency"] = product_details.get("repayment_frequency", 1)
+                row_data["repayment_frequency_type"] = product_details.get("repayment_frequency_type", "months")
+                row_data["interest_rate_type"] = product_details.get("interest_rate_type", "year")
+                row_data["interest_methodology"] = product_details.get("interest_methodology", "declining_balance")
+                row_data["amortization_method"] = product_details.get("amortization_method", "equal_installments")
+                row_data["decimals"] = product_details.get("decimals", 0)
+                row_data["loan_transaction_processing_strategy_id"] = product_details.get("loan_transaction_processing_strategy_id", 23)
             else:
-                self.logger.warning("disbursed_on_date not available, cannot set first_payment_date")
+                row_data["fund_id"] = 1
+                row_data["repayment_frequency"] = 1
+                row_data["repayment_frequency_type"] = "months"
+                row_data["interest_rate_type"] = "year"
+                row_data["interest_methodology"] = "declining_balance"
+                row_data["amortization_method"] = "equal_installments"
+                row_data["decimals"] = 0
+                row_data["loan_transaction_processing_strategy_id"] = 24 if row_data.get("loan_transaction_processing_strategy_id") == 2 else 23
 
-            # Prepare charge data if app_charge exists and is valid
-            if source_row and "app_charge" in source_row and source_row["app_charge"] is not None:
-                try:
-                    app_charge_amount = float(source_row["app_charge"])
-                    if app_charge_amount > 0:
-                        # Use loan_date if available, otherwise use current time
-                        created_at_val = source_row.get("loan_date", datetime.datetime.now()) 
-                        # Ensure created_at_val is a datetime object if it comes from source_row
-                        if isinstance(created_at_val, datetime.date) and not isinstance(created_at_val, datetime.datetime):
-                             created_at_val = datetime.datetime.combine(created_at_val, datetime.datetime.min.time())
-                             self.logger.debug("Converted date to datetime for charge creation")
-                        elif not isinstance(created_at_val, datetime.datetime):
-                             # Attempt conversion or default if format is unexpected
-                             try:
-                                 created_at_val = datetime.datetime.fromisoformat(str(created_at_val))
-                                 self.logger.debug("Converted string to datetime for charge creation")
-                             except (ValueError, TypeError):
-                                 self.logger.warning(f"Could not parse date value: {created_at_val}, using current time")
-                                 created_at_val = datetime.datetime.now()
-
-
-                        charge_data = {
-                            "loan_charge_id": 4,
-                            "loan_charge_type_id": 1,
-                            "loan_charge_option_id": 7,
-                            "amount": app_charge_amount,
-                            "amount_paid_derived": app_charge_amount,
-                            "calculated_amount": app_charge_amount,
-                            "is_paid": True,
-                            "created_at": created_at_val, 
-                            "updated_at": created_at_val # Set updated_at as well
-                        }
-                        # Store charge data temporarily, prefixed to avoid column name conflicts
-                        row_data["_charge_to_add"] = charge_data 
-                except ValueError:
-                    print(f"Warning: Invalid app_charge value '{source_row['app_charge']}' for loan with external_id {source_row.get('loan_key')}. Skipping charge.")
-                    self.logger.warning(f"Invalid app_charge value '{source_row['app_charge']}' for loan with external_id {source_row.get('loan_key')}. Skipping charge.")
+        # Get client details if client_id is available (e.g., to get wallet_id)
+        if "client_id" in row_data:
+            client_id = row_data['client_id']
+            if self._client_to_user is None:
+                self._load_client_maps(cursor)
+
+            if client_id in self._client_to_user:
+                wallet_id = self._client_to_wallet.get(client_id)
+                client_key = self._client_external_ids[client_id]
+            else:
+                # Client created after the maps were loaded
+                user_id = self._cached_lookup("clients", "user_id", "id", client_id, cursor)
+                wallet_id = self._cached_lookup("wallets", "id", "user_id", user_id, cursor)
+                client_key = self._cached_lookup("clients", "external_id", "id", client_id, cursor)
+            if wallet_id:
+                row_data["wallet_id"] = wallet_id
+
+            if str(client_key) in self._src_client_details:
+                client_details = self._src_client_details[str(client_key)]
+            else:
+                client_details = get_record_details_by_id(src_cursor, "ilts.c1_client_info_table", client_key, self.CLIENT_INFO_COLUMNS,
+                                                          logger=self.logger, id_name="client_key")
+
+            if client_details:
+                row_data["activity_name"] = client_details.get("bus_name") if client_details.get("bus_name") is not None else ''
+                # Create address from parts, filtering out empty values
+                row_data["project_address"] = join_non_empty(
+                    client_details.get("bus_add_1"), client_details.get("bus_add_2"), client_details.get("bus_add_3")
+                )
+
+        # These fields are always set regardless of loan product or application
+        row_data["loan_purpose_id"] = 1
         
-        elif migration_name == "installments":
-            # Convert negative values to positive
-            for field in ['principal', 'principal_repaid_derived', 'interest', 'interest_repaid_derived', 'fees', 'fees_repaid_derived']:
-                if field in row_data and row_data[field] is not None:
-                    # Convert to float first
-                    value = float(row_data[field])
-                    # If negative, make positive
-                    if value < 0:
-                        row_data[field] = abs(value)
-                        self.logger.info(f"Converted negative {field} to positive: {abs(value)}")
-
-            principal = float(row_data['principal'])
-            principal_repaid_derived = float(row_data['principal_repaid_derived'])
+        # Set first_payment_date to one month after disbursed_on_date without using relativedelta
+        if "disbursed_on_date" in row_data and row_data["disbursed_on_date"]:
+            # Get the disbursed date
+            disbursed_date = row_data["disbursed_on_date"]
             
-            if source_row and source_row.get("loan_key"):
-                loan_id = get_record_value(
-                    table="loans", 
-                    condition=f"external_id = '{source_row['loan_key']}'",
-                    column="id",
-                    cursor=cursor,
-                    conn=self.dest_conn,
-                    logger=self.logger
-                )
-                if loan_id:
-                    row_data["loan_id"] = loan_id
-            # Determine status based on inst_cond and inst_status
-            if source_row and 'inst_cond' in source_row:
-                # Get loan status if loan_key is available
-                loan_status = None
-                if row_data.get("loan_id"):
-                    loan_status = get_record_value(
-                        table="loans", 
-                        condition=f"id = '{row_data['loan_id']}'",
-                        column="status",
-                        cursor=cursor,
-                        conn=self.dest_conn,
-                        logger=self.logger
-                    )
-                    self.logger.debug(f"Found loan status: {loan_status} for loan_id: {row_data['loan_id']}")
+            # Same day next month, clamped to the last day of that month (Jan 31 -> Feb 28/29)
+            year, month = (disbursed_date.year + 1, 1) if disbursed_date.month == 12 else (disbursed_date.year, disbursed_date.month + 1)
+            last_day = _MONTH_LAST[month - 1]
+            if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+                last_day = 29
+            row_data["first_payment_date"] = disbursed_date.replace(year=year, month=month, day=min(disbursed_date.day, last_day))
+            self.logger.debug("Set first_payment_date to %s", row_data['first_payment_date'])
+        else:
+            self.logger.warning("disbursed_on_date not available, cannot set first_payment_date")
+
+        # Prepare charge data if app_charge exists and is valid
+        if source_row and "app_charge" in source_row and source_row["app_charge"] is not None:
+            try:
+                app_charge_amount = float(source_row["app_charge"])
+                if app_charge_amount > 0:
+                    # Use loan_date if available, otherwise use current time
+                    created_at_val = source_row.get("loan_date", datetime.datetime.now()) 
+                    # Ensure created_at_val is a datetime object if it comes from source_row
+                    if isinstance(created_at_val, datetime.date) and not isinstance(created_at_val, datetime.datetime):
+                         created_at_val = datetime.datetime.combine(created_at_val, datetime.datetime.min.time())
+                         self.logger.debug("Converted date to datetime for charge creation")
+                    elif not isinstance(created_at_val, datetime.datetime):
+                         # Attempt conversion or default if format is unexpected
+                         try:
+                             created_at_val = datetime.datetime.fromisoformat(str(created_at_val))
+                             self.logger.debug("Converted string to datetime for charge creation")
+                         except (ValueError, TypeError):
+                             self.logger.warning("Could not parse date value: %s, using current time", created_at_val)
+                             created_at_val = datetime.datetime.now()
+
+
+                    charge_data = {
+                        "loan_charge_id": 4,
+                        "loan_charge_type_id": 1,
+                        "loan_charge_option_id": 7,
+                        "amount": app_charge_amount,
+                        "amount_paid_derived": app_charge_amount,
+                        "calculated_amount": app_charge_amount,
+                        "is_paid": True,
+                        "created_at": created_at_val, 
+                        "updated_at": created_at_val # Set updated_at as well
+                    }
+                    # Store charge data temporarily, prefixed to avoid column name conflicts
+                    row_data["_charge_to_add"] = charge_data 
+            except ValueError:
+                self.logger.warning("Invalid app_charge value '%s' for loan with external_id %s. Skipping charge.", source_row['app_charge'], source_row.get('loan_key'))
+
+        return row_data
+
+    def _process_installments(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the installments migration."""
+        # Convert the amounts to float once and negative values to positive
+        for field in INSTALLMENT_AMOUNT_FIELDS:
+            value = row_data.get(field)
+            if value is not None:
+                value = float(value)
+                # If negative, make positive
+                if value < 0:
+                    value = -value
+                    self.logger.debug("Converted negative %s to positive: %s", field, value)
+                row_data[field] = value
+
+        principal = float(row_data['principal'])
+        principal_repaid_derived = float(row_data['principal_repaid_derived'])
+        
+        if source_row and source_row.get("loan_key"):
+            # Also caches the loan status read below
+            loan_id, _ = self._fetch_loan_id_and_status(source_row["loan_key"], cursor)
+            if loan_id:
+                row_data["loan_id"] = loan_id
+        # Determine status based on inst_cond and inst_status, only the payment status without inst_cond
+        written_off = rescheduled = False
+        if source_row and 'inst_cond' in source_row:
+            # Get loan status if loan_key is available
+            loan_status = None
+            if row_data.get("loan_id"):
+                loan_status = self._cached_lookup("loans", "status", "id", row_data["loan_id"], cursor)
+                self.logger.debug("Found loan status: %s for loan_id: %s", loan_status, row_data['loan_id'])
+            written_off = loan_status == 'written_off' and source_row['inst_cond'] == 2
+            rescheduled = source_row.get('inst_status') == 8
+
+        status = INSTALLMENT_STATUS_TABLE[(written_off, rescheduled, principal > principal_repaid_derived)]
+        row_data['status'] = status
+        if status == 'active':
+            row_data['paid_by_date'] = None
+        self.logger.debug("Setting installment status to %s (written_off=%s, rescheduled=%s, principal=%s, paid=%s)",
+                          status, written_off, rescheduled, principal, principal_repaid_derived)
+
+        interest = float(row_data['interest'])
+        interest_repaid_derived = float(row_data['interest_repaid_derived'])
+        principal -= interest
+        principal_repaid_derived -= interest_repaid_derived
+        row_data['principal'] = principal
+        row_data['principal_repaid_derived'] = principal_repaid_derived
+
+        return row_data
+
+    def _resolve_transaction_loan(self, row_data, source_row, cursor):
+        """Set the loan, its reversed flag and the repayment schedule of a transaction."""
+        if source_row.get("loan_key"):
+            loan_id, loan_status = self._fetch_loan_id_and_status(source_row["loan_key"], cursor)
+            if loan_id:
+                row_data["loan_id"] = loan_id
                 
-                # Check both loan status and installment condition
-                if loan_status == 'written_off' and source_row['inst_cond'] == 2:
-                    row_data['status'] = 'written_off'
-                    self.logger.info(f"Setting installment status to written_off based on loan_status={loan_status} and inst_cond={source_row['inst_cond']}")
-                else:  # inst_cond is 0 (normal)
-                    if source_row.get('inst_status') == 8:
-                        row_data['status'] = 'rescheduled'
-                        self.logger.info(f"Setting installment status to rescheduled based on inst_status={source_row['inst_status']}")
-                    else:
-                        # Determine if active or closed based on payment status
-                        if principal > principal_repaid_derived:
-                            row_data['status'] = 'active'
-                            row_data['paid_by_date'] = None
-                            self.logger.info(f"Setting installment status to active (principal={principal}, paid={principal_repaid_derived})")
-                        else:
-                            row_data['status'] = 'closed'
-                            self.logger.info(f"Setting installment status to closed (principal={principal}, paid={principal_repaid_derived})")
-            else:
-                # Fallback if inst_cond is not available
-                if principal > principal_repaid_derived:
-                    row_data['status'] = 'active'
-                    row_data['paid_by_date'] = None
-                    self.logger.info("Setting installment status to active (fallback)")
+                # Check if the loan status is withdrawn or rejected
+                if loan_status in ["withdrawn", "rejected"]:
+                    row_data["reversed"] = True
+                    self.logger.debug("Setting transaction as reversed because loan (ID: %s) has status: %s", loan_id, loan_status)
                 else:
-                    row_data['status'] = 'closed'
-                    self.logger.info("Setting installment status to closed (fallback)")
-
-            interest = float(row_data['interest'])
-            interest_repaid_derived = float(row_data['interest_repaid_derived'])
-            principal -= interest
-            principal_repaid_derived -= interest_repaid_derived
-            row_data['interest'] = interest
-            row_data['interest_repaid_derived'] = interest_repaid_derived
-            row_data['principal'] = principal
-            row_data['principal_repaid_derived'] = principal_repaid_derived
-            
-        elif migration_name == "transactions":
-            if source_row:
-                if source_row.get("loan_key"):
-                    loan_id = get_record_value(
-                        table="loans", 
-                        condition=f"external_id = '{source_row['loan_key']}'",
-                        column="id",
-                        cursor=cursor,
-                        conn=self.dest_conn,
-                        logger=self.logger
-                    )
-                    if loan_id:
-                        row_data["loan_id"] = loan_id
-                        
-                        # Check if the loan status is withdrawn or rejected
-                        loan_status = get_record_value(
-                            table="loans", 
-                            condition=f"id = {loan_id}",
-                            column="status",
-                            cursor=cursor,
-                            conn=self.dest_conn,
-                            logger=self.logger
-                        )
-                        
-                        if loan_status in ["withdrawn", "rejected"]:
-                            row_data["reversed"] = True
-                            self.logger.info(f"Setting transaction as reversed because loan (ID: {loan_id}) has status: {loan_status}")
-                        else:
-                            row_data["reversed"] = False
-
-                    if source_row.get("installment_key"):
-                        repayment_schedule_id = get_record_value(
-                            table="loan_repayment_schedules",
-                            condition=f"external_id = '{source_row['installment_key']}'",
-                            column="id",
-                            cursor=cursor,
-                            conn=self.dest_conn,
-                            logger=self.logger
-                        )
-                        if loan_id:
-                            row_data["repayment_schedule_id"] = repayment_schedule_id
-                
-                # Ensure amount, interest_repaid_derived, or penalties_repaid_derived are not null, set to 0 if they are
-                if row_data.get('amount') is None:
-                    row_data['amount'] = 0
+                    row_data["reversed"] = False
 
-                if row_data.get('interest_repaid_derived') is None:
-                    row_data['interest_repaid_derived'] = 0
+            if source_row.get("installment_key"):
+                repayment_schedule_id = self._cached_lookup(
+                    "loan_repayment_schedules", "id", "external_id", source_row["installment_key"], cursor
+                )
+                if loan_id:
+                    row_data["repayment_schedule_id"] = repayment_schedule_id
 
-                if row_data.get('penalties_repaid_derived') is None:
-                    row_data['penalties_repaid_derived'] = 0
-                
-                # Check if transaction has no meaningful values and should be skipped
-                interest_value = float(row_data.get('interest_repaid_derived', 0) or 0)
-                penalties_value = float(row_data.get('penalties_repaid_derived', 0) or 0)
-                principal_value = float(row_data.get('principal_repaid_derived', 0) or 0)
-                
-                if interest_value == 0 and penalties_value == 0 and principal_value == 0:
-                    self.logger.info(f"Skipping transaction with ID {source_row.get('trans_key', 'unknown')} - all values are zero")
-                    row_data["_skip_this_row"] = True
-                    self.skipped_transactions += 1
-                    return row_data
-                
-                # Set submitted_on to created_at if not already set
-                if 'submitted_on' not in row_data or row_data['submitted_on'] is None:
-                    row_data['submitted_on'] = row_data.get('created_at', datetime.datetime.now())
-
-                # Map transaction types from old to new system
-                # Only process transactions with types that have a mapping
-                trans_type_mapping = {
-                    1: 2,           # Repayment
-                    3: 1,           # Disbursement
-                    7: 6,           # Write Off
-                    17: 10,         # Apply Charges
-                    # Cancellation transaction types map to the same target types
-                    2: 2,           # Cancel Repayment
-                    4: 1,           # Cancel Disbursement
-                    8: 6,           # Cancel Write Off
-                    18: 10,         # Cancel Apply Charges
-                }
-                
-                # Define which transaction types are cancellations
-                cancellation_types = {2, 4, 8, 18}
-                
-                # Get transaction type from source row
-                trans_type = source_row.get('trans_act')
-                
-                # Add debugging to see what transaction types are being encountered
-                self.logger.info(f"Processing transaction with type: {trans_type}")
-                print(f"Processing transaction with type: {trans_type}")
-                
-                # Convert trans_type to int for dictionary lookup
-                try:
-                    trans_type_int = int(trans_type) if trans_type is not None else None
-                    trans_type = trans_type_int  # Update trans_type to the integer version
-                except (ValueError, TypeError):
-                    self.logger.warning(f"Could not convert transaction type '{trans_type}' to integer")
-                    
-                # Special handling for disbursement (3) and cancel disbursement (4)
-                if trans_type_int in [3, 4] and 'loan_id' in row_data:
-                    # Get interest amount from source row
-                    interest_amount = float(source_row.get('trans_inst_int', 0))
-
-                    # Only proceed if there's interest to apply
-                    if interest_amount > 0:
-                        self.logger.info(f"Creating separate apply interest transaction with amount: {interest_amount}")
-                        
-                        # Determine if this is a cancellation transaction
-                        is_cancellation = trans_type_int == 4
-                        
-                        # Calculate adjusted amount based on cancellation status
-                        adjusted_interest_amount = -interest_amount if is_cancellation else interest_amount
-                        
-                        # For the main disbursement transaction, adjust the amount
-                        # (This transaction is already being created with the current row_data)
-                        row_data['amount'] = float(row_data['amount']) - interest_amount
-                        
-                        # Create transaction data for apply interest
-                        interest_tx_data = {
-                            "loan_id": row_data['loan_id'],
-                            "amount": adjusted_interest_amount,
-                            "debit": adjusted_interest_amount,
-                            "credit": 0,
-                            "loan_transaction_type_id": 11,  # Apply Interest
-                            "created_at": row_data.get('created_at', datetime.datetime.now()),
-                            "updated_at": datetime.datetime.now(),
-                            "submitted_on": row_data.get('submitted_on', datetime.date.today()),
-                            "branch_id": row_data.get('branch_id'),
-                            "loan_officer_id": row_data.get('loan_officer_id'),
-                            "description": "Apply Interest" if not is_cancellation else "Cancel Apply Interest",
-                            "reversed": row_data.get('reversed', False)
-                        }
-                        
-                        # Insert the apply interest transaction
-                        try:
-                            insert_record(cursor, "loan_transactions", interest_tx_data, self.logger)
-                            self.logger.info(f"Successfully created apply interest transaction for loan ID {row_data['loan_id']} with amount {adjusted_interest_amount}")
-                        except Exception as e:
-                            self.logger.error(f"Failed to create apply interest transaction: {str(e)}")
+    def _split_off_transactions(self, row_data, source_row, trans_type_int, now):
+        """
+        Queue the apply interest, penalty and pay charges transactions carried by a source transaction.
+        Args:
+            row_data (dict): The processed transaction with float amounts, its amount loses the split-off interest
+            source_row (dict): The source transaction
+            trans_type_int (int): Source transaction type
+            now (datetime.datetime): Timestamp used for the created/updated/submitted fallbacks
+        """
+        # Special handling for disbursement (3) and cancel disbursement (4)
+        if trans_type_int in [3, 4] and 'loan_id' in row_data:
+            # Get interest amount from source row
+            interest_amount = float(source_row.get('trans_inst_int', 0))
+
+            # Only proceed if there's interest to apply
+            if interest_amount > 0:
+                self.logger.debug("Creating separate apply interest transaction with amount: %s", interest_amount)
                 
-                # Create a separate transaction for penalties if penalties_repaid_derived is greater than zero
-                penalties_amount = float(row_data.get('penalties_repaid_derived', 0))
-                if penalties_amount > 0 and 'loan_id' in row_data:
-                    self.logger.info(f"Creating separate penalties transaction with amount: {penalties_amount}")
-                    
-                    # Determine if this is a cancellation transaction
-                    is_cancellation = trans_type_int in cancellation_types if trans_type_int is not None else False
-                    
-                    # Calculate adjusted amount based on cancellation status
-                    adjusted_penalties_amount = -penalties_amount if is_cancellation else penalties_amount
-                    
-                    # Create transaction data for penalties
-                    penalties_tx_data = {
-                        "loan_id": row_data['loan_id'],
-                        "amount": adjusted_penalties_amount,
-                        "debit": adjusted_penalties_amount,
-                        "credit": 0,
-                        "loan_transaction_type_id": 12,
-                        "created_at": row_data.get('created_at', datetime.datetime.now()),
-                        "updated_at": datetime.datetime.now(),
-                        "submitted_on": row_data.get('submitted_on', datetime.date.today()),
-                        "branch_id": row_data.get('branch_id'),
-                        "loan_officer_id": row_data.get('loan_officer_id'),
-                        "description": "Apply Penalty" if not is_cancellation else "Cancel Apply Penalty"
-                    }
-                    
-                    # Insert the penalties transaction
-                    try:
-                        insert_record(cursor, "loan_transactions", penalties_tx_data, self.logger)
-                        self.logger.info(f"Successfully created penalties transaction for loan ID {row_data['loan_id']} with amount {penalties_tx_data['amount']}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to create penalties transaction: {str(e)}")
+                # Determine if this is a cancellation transaction
+                is_cancellation = trans_type_int == 4
                 
-                # Create a separate transaction for apply charges if transaction type is 10 (Apply Charges)
-                if trans_type_int in [17, 18] and 'loan_id' in row_data:  # Apply Charges or Cancel Apply Charges
-                    fees_amount = float(row_data.get('amount', 0))
-                    if fees_amount > 0:
-                        self.logger.info(f"Creating separate apply charges transaction with amount: {fees_amount}")
-                        
-                        # Determine if this is a cancellation transaction (type 18)
-                        is_cancellation = trans_type_int == 18
-                        
-                        # Calculate adjusted amount based on cancellation status
-                        adjusted_fees_amount = -fees_amount if is_cancellation else fees_amount
-                        
-                        # Create transaction data for apply charges
-                        fees_tx_data = {
-                            "loan_id": row_data['loan_id'],
-                            "amount": adjusted_fees_amount,
-                            "debit": 0,
-                            "credit": adjusted_fees_amount,
-                            "fees_repaid_derived": adjusted_fees_amount,
-                            "loan_transaction_type_id": 2,
-                            "created_at": row_data.get('created_at', datetime.datetime.now()),
-                            "updated_at": datetime.datetime.now(),
-                            "submitted_on": row_data.get('submitted_on', datetime.date.today()),
-                            "branch_id": row_data.get('branch_id'),
-                            "loan_officer_id": row_data.get('loan_officer_id'),
-                            "description": "Pay Charges" if not is_cancellation else "Cancel Pay Charges"
-                        }
-                        
-                        # Insert the fees transaction
-                        try:
-                            insert_record(cursor, "loan_transactions", fees_tx_data, self.logger)
-                            self.logger.info(f"Successfully created apply charges transaction for loan ID {row_data['loan_id']} with amount {fees_amount}")
-                        except Exception as e:
-                            self.logger.error(f"Failed to create apply charges transaction: {str(e)}")
+                # Calculate adjusted amount based on cancellation status
+                adjusted_interest_amount = -interest_amount if is_cancellation else interest_amount
                 
-                # Convert negative values to positive
-                for field in ['amount', 'interest_repaid_derived', 'penalties_repaid_derived']:
-                    if field in row_data and row_data[field] is not None:
-                        # Convert to float first
-                        value = float(row_data[field])
-                        # If negative, make positive
-                        if value < 0:
-                            row_data[field] = abs(value)
-                            self.logger.info(f"Converted negative {field} to positive: {abs(value)}")
-
-                # Handle datetime fields properly to avoid insertion errors
-                row_data['updated_at'] = datetime.datetime.now()
+                # For the main disbursement transaction, adjust the amount
+                # (This transaction is already being created with the current row_data)
+                row_data['amount'] -= interest_amount
                 
-                # Increase created_at by one hour if it's a datetime
-                if 'created_at' in row_data and isinstance(row_data['created_at'], datetime.datetime):
-                    row_data['created_at'] = row_data['created_at'] + datetime.timedelta(hours=1)
-
-                # Convert to float before calculation
-                amount = float(row_data['amount'])
-                interest_repaid = float(row_data['interest_repaid_derived'])
-                row_data['principal_repaid_derived'] = amount - interest_repaid
-                row_data['amount'] = amount + float(row_data['penalties_repaid_derived'])
+                # Create transaction data for apply interest
+                interest_tx_data = {
+                    "loan_id": row_data['loan_id'],
+                    "amount": adjusted_interest_amount,
+                    "debit": adjusted_interest_amount,
+                    "credit": 0,
+                    "loan_transaction_type_id": 11,  # Apply Interest
+                    "created_at": row_data.get('created_at', now),
+                    "updated_at": now,
+                    "submitted_on": row_data.get('submitted_on', now.date()),
+                    "branch_id": row_data.get('branch_id'),
+                    "loan_officer_id": row_data.get('loan_officer_id'),
+                    "description": "Apply Interest" if not is_cancellation else "Cancel Apply Interest",
+                    "reversed": row_data.get('reversed', False)
+                }
                 
-                # Skip transactions that don't have a mapping
-                if trans_type not in trans_type_mapping:
-                    self.skipped_transactions += 1
-                    skip_msg = f"Skipping transaction with type {trans_type} - no mapping available"
-                    self.logger.info(skip_msg)
-                    print(skip_msg)
-                    
-                    # Count transaction types that are being skipped
-                    self.skipped_types_count[trans_type] = self.skipped_types_count.get(trans_type, 0) + 1
-                    
-                    # Print summary of skipped types every 100 transactions
-                    if self.skipped_transactions % 100 == 0:
-                        summary = f"Skipped transaction types summary: {self.skipped_types_count}"
-                        self.logger.info(summary)
-                        print(summary)
-                    
-                    # Set a special flag to indicate this row should be skipped
-                    row_data["_skip_this_row"] = True
-                    return row_data  # Return the modified row_data with the skip flag
+                # Queue the apply interest transaction for take_split_off_transactions
+                self._pending_transactions.append(interest_tx_data)
+        
+        # Create a separate transaction for penalties if penalties_repaid_derived is greater than zero
+        penalties_amount = row_data['penalties_repaid_derived']
+        if penalties_amount > 0 and 'loan_id' in row_data:
+            self.logger.debug("Creating separate penalties transaction with amount: %s", penalties_amount)
+            
+            # Determine if this is a cancellation transaction
+            is_cancellation = trans_type_int in CANCELLATION_TRANS_TYPES if trans_type_int is not None else False
+            
+            # Calculate adjusted amount based on cancellation status
+            adjusted_penalties_amount = -penalties_amount if is_cancellation else penalties_amount
+            
+            # Create transaction data for penalties
+            penalties_tx_data = {
+                "loan_id": row_data['loan_id'],
+                "amount": adjusted_penalties_amount,
+                "debit": adjusted_penalties_amount,
+                "credit": 0,
+                "loan_transaction_type_id": 12,
+                "created_at": row_data.get('created_at', now),
+                "updated_at": now,
+                "submitted_on": row_data.get('submitted_on', now.date()),
+                "branch_id": row_data.get('branch_id'),
+                "loan_officer_id": row_data.get('loan_officer_id'),
+                "description": "Apply Penalty" if not is_cancellation else "Cancel Apply Penalty"
+            }
+            
+            # Queue the penalties transaction for take_split_off_transactions
+            self._pending_transactions.append(penalties_tx_data)
+        
+        # Create a separate transaction for apply charges if transaction type is 10 (Apply Charges)
+        if trans_type_int in [17, 18] and 'loan_id' in row_data:  # Apply Charges or Cancel Apply Charges
+            fees_amount = row_data['amount']
+            if fees_amount > 0:
+                self.logger.debug("Creating separate apply charges transaction with amount: %s", fees_amount)
                 
-                # For cancellation transaction types, make the amount negative if it's not already
-                if trans_type in cancellation_types:
-                    # Make amount negative if it's positive - ensure it's a float first
-                    try:
-                        amount_val = float(row_data['amount'])
-                        if amount_val > 0:
-                            row_data['amount'] = -amount_val
-                            self.logger.info(f"Made amount negative for cancellation transaction type {trans_type}: {row_data['amount']}")
-                    except (ValueError, TypeError):
-                        self.logger.warning(f"Could not convert amount '{row_data['amount']}' to float for comparison")
-                    
-                    # Make interest_repaid_derived negative if it's positive
-                    try:
-                        interest_val = float(row_data['interest_repaid_derived'])
-                        if interest_val > 0:
-                            row_data['interest_repaid_derived'] = -interest_val
-                            self.logger.info(f"Made interest_repaid_derived negative for cancellation transaction type {trans_type}: {row_data['interest_repaid_derived']}")
-                    except (ValueError, TypeError):
-                        self.logger.warning(f"Could not convert interest_repaid_derived '{row_data['interest_repaid_derived']}' to float for comparison")
-                    
-                    # Make penalties_repaid_derived negative if it's positive
-                    try:
-                        penalties_val = float(row_data['penalties_repaid_derived'])
-                        if penalties_val > 0:
-                            row_data['penalties_repaid_derived'] = -penalties_val
-                            self.logger.info(f"Made penalties_repaid_derived negative for cancellation transaction type {trans_type}: {row_data['penalties_repaid_derived']}")
-                    except (ValueError, TypeError):
-                        self.logger.warning(f"Could not convert penalties_repaid_derived '{row_data['penalties_repaid_derived']}' to float for comparison")
-                    
-                    # Recalculate principal_repaid_derived with negative values
-                    try:
-                        amount = float(row_data['amount'])
-                        interest = float(row_data['interest_repaid_derived'])
-                        row_data['principal_repaid_derived'] = amount - interest
-                        self.logger.info(f"Recalculated principal_repaid_derived for cancellation: {row_data['principal_repaid_derived']}")
-                    except (ValueError, TypeError):
-                        self.logger.warning("Could not recalculate principal_repaid_derived due to conversion errors")
+                # Determine if this is a cancellation transaction (type 18)
+                is_cancellation = trans_type_int == 18
                 
-                # Count this as a transaction that will be inserted
-                self.inserted_transactions += 1
+                # Calculate adjusted amount based on cancellation status
+                adjusted_fees_amount = -fees_amount if is_cancellation else fees_amount
                 
-                # Set the transaction type in the target data
-                row_data['loan_transaction_type_id'] = trans_type_mapping[trans_type]
+                # Create transaction data for apply charges
+                fees_tx_data = {
+                    "loan_id": row_data['loan_id'],
+                    "amount": adjusted_fees_amount,
+                    "debit": 0,
+                    "credit": adjusted_fees_amount,
+                    "fees_repaid_derived": adjusted_fees_amount,
+                    "loan_transaction_type_id": 2,
+                    "created_at": row_data.get('created_at', now),
+                    "updated_at": now,
+                    "submitted_on": row_data.get('submitted_on', now.date()),
+                    "branch_id": row_data.get('branch_id'),
+                    "loan_officer_id": row_data.get('loan_officer_id'),
+                    "description": "Pay Charges" if not is_cancellation else "Cancel Pay Charges"
+                }
                 
-                # Set debit/credit based on transaction type
-                if trans_type_mapping[trans_type] in [1, 10]:
-                    self.logger.debug(f"Setting transaction as credit: {row_data['amount']}")
-                    row_data['debit'] = row_data['amount']
-                    row_data['credit'] = 0
-                    row_data['interest_repaid_derived'] = 0
-                    row_data['penalties_repaid_derived'] = 0
-                    row_data['principal_repaid_derived'] = 0
-                else:
-                    self.logger.debug(f"Setting transaction as debit: {row_data['amount']}")
-                    row_data['debit'] = 0
-                    row_data['credit'] = row_data['amount']
+                # Queue the fees transaction for take_split_off_transactions
+                self._pending_transactions.append(fees_tx_data)
+
+    def _skip_unmapped_transaction(self, row_data, trans_type):
+        """Flag a transaction of a type without mapping for skipping and count it."""
+        self.skipped_transactions += 1
+        self.logger.debug("Skipping transaction with type %s - no mapping available", trans_type)
+        
+        # Count transaction types that are being skipped
+        self.skipped_types_count[trans_type] += 1
+        
+        # Print summary of skipped types every 100 transactions
+        if self.skipped_transactions >= self._next_skipped_summary:
+            self._next_skipped_summary = self.skipped_transactions - self.skipped_transactions % 100 + 100
+            summary = f"Skipped transaction types summary: {dict(self.skipped_types_count)}"
+            self.logger.info(summary)
+            print(summary)
+        
+        # Set a special flag to indicate this row should be skipped
+        row_data["_skip_this_row"] = True
+        return row_data
+
+    def _process_transactions(self, row_data, source_row=None, cursor=None, src_cursor=None):
+        """Custom logic for the transactions migration."""
+        # One timestamp for every created/updated/submitted fallback of the row and its split-off transactions
+        now = datetime.datetime.now()
+        if source_row:
+            # Get transaction type from source row
+            trans_type = source_row.get('trans_act')
+            
+            # Add debugging to see what transaction types are being encountered
+            self.logger.debug("Processing transaction with type: %s", trans_type)
+            
+            # Convert trans_type to int for dictionary lookup
+            trans_type_int = None
+            try:
+                trans_type_int = int(trans_type) if trans_type is not None else None
+                trans_type = trans_type_int  # Update trans_type to the integer version
+            except (ValueError, TypeError):
+                self.logger.warning("Could not convert transaction type '%s' to integer", trans_type)
+
+            # Unmapped types are skipped, only a penalty to split off needs the lookups below
+            if trans_type not in TRANS_TYPE_MAP and not float(row_data.get('penalties_repaid_derived') or 0) > 0:
+                return self._skip_unmapped_transaction(row_data, trans_type)
 
+            self._resolve_branch(row_data, source_row, cursor)
+            self._resolve_org_branch(row_data, source_row, cursor)
+            self._resolve_officer(row_data, source_row, cursor)
+            self._resolve_transaction_loan(row_data, source_row, cursor)
 
-                # Print summary after every 100 transactions
-                if (self.skipped_transactions + self.inserted_transactions) % 100 == 0:
-                    summary = f"Transactions progress: {self.inserted_transactions} inserted, {self.skipped_transactions} skipped"
-                    self.logger.info(summary)
-                    print(summary)
+            # Convert the amounts to float once, null amounts becoming 0, everything below works on the converted values
+            for field in TRANSACTION_AMOUNT_FIELDS:
+                row_data[field] = float(row_data.get(field) or 0)
+            
+            # Check if transaction has no meaningful values and should be skipped
+            principal_value = float(row_data.get('principal_repaid_derived', 0) or 0)
+            
+            if row_data['interest_repaid_derived'] == 0 and row_data['penalties_repaid_derived'] == 0 and principal_value == 0:
+                self.logger.debug("Skipping transaction with ID %s - all values are zero", source_row.get('trans_key', 'unknown'))
+                row_data["_skip_this_row"] = True
+                self.skipped_transactions += 1
+                return row_data
+            
+            # Set submitted_on to created_at if not already set
+            if 'submitted_on' not in row_data or row_data['submitted_on'] is None:
+                row_data['submitted_on'] = row_data.get('created_at', now)
+
+            # Split the interest, penalties and charges off into transactions of their own
+            self._split_off_transactions(row_data, source_row, trans_type_int, now)
+
+            # Convert negative values to positive
+            for field in TRANSACTION_AMOUNT_FIELDS:
+                value = row_data[field]
+                if value < 0:
+                    row_data[field] = -value
+                    self.logger.debug("Converted negative %s to positive: %s", field, -value)
+
+            # Handle datetime fields properly to avoid insertion errors
+            row_data['updated_at'] = now
+            
+            # Increase created_at by one hour if it's a datetime
+            if 'created_at' in row_data and isinstance(row_data['created_at'], datetime.datetime):
+                row_data['created_at'] = row_data['created_at'] + datetime.timedelta(hours=1)
+
+            amount = row_data['amount']
+            row_data['principal_repaid_derived'] = amount - row_data['interest_repaid_derived']
+            row_data['amount'] = amount + row_data['penalties_repaid_derived']
+            
+            # Skip transactions that don't have a mapping, once their penalty is split off
+            if trans_type not in TRANS_TYPE_MAP:
+                return self._skip_unmapped_transaction(row_data, trans_type)
+            
+            # For cancellation transaction types, make the amount negative if it's not already
+            if trans_type in CANCELLATION_TRANS_TYPES:
+                # Make amount, interest_repaid_derived and penalties_repaid_derived negative if they are positive
+                negated = _negate_positive(row_data, TRANSACTION_AMOUNT_FIELDS)
+                if negated:
+                    self.logger.debug("Made %s negative for cancellation transaction type %s", ", ".join(negated), trans_type)
                 
-        self.logger.debug(f"Finished processing columns for {migration_name}")
+                # Recalculate principal_repaid_derived with negative values
+                row_data['principal_repaid_derived'] = row_data['amount'] - row_data['interest_repaid_derived']
+                self.logger.debug("Recalculated principal_repaid_derived for cancellation: %s", row_data['principal_repaid_derived'])
+            
+            # Count this as a transaction that will be inserted
+            self.inserted_transactions += 1
+            
+            # Set the transaction type in the target data
+            row_data['loan_transaction_type_id'] = TRANS_TYPE_MAP[trans_type]
+            
+            # Set debit/credit based on transaction type
+            if row_data['loan_transaction_type_id'] in DEBIT_TRANS_TYPES:
+                self.logger.debug("Setting transaction as credit: %s", row_data['amount'])
+                row_data['debit'] = row_data['amount']
+                row_data['credit'] = 0
+                row_data['interest_repaid_derived'] = 0
+                row_data['penalties_repaid_derived'] = 0
+                row_data['principal_repaid_derived'] = 0
+            else:
+                self.logger.debug("Setting transaction as debit: %s", row_data['amount'])
+                row_data['debit'] = 0
+                row_data['credit'] = row_data['amount']
+
+
+            # Print summary after every 100 transactions
+            processed = self.skipped_transactions + self.inserted_transactions
+            if processed >= self._next_progress_summary:
+                self._next_progress_summary = processed - processed % 100 + 100
+                summary = f"Transactions progress: {self.inserted_transactions} inserted, {self.skipped_transactions} skipped"
+                self.logger.info(summary)
+                print(summary)
+
         return row_data
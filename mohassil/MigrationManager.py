@@ -1,6 +1,8 @@
 from general_helper import *
 from custom_helper import *
 import datetime
+import time
+from collections import defaultdict
 from CustomLogic import CustomLogic
 from logger_setup import setup_logger
 import os
@@ -9,6 +11,418 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Number of source rows whose lookups are resolved together before processing
+PREFETCH_BATCH_SIZE = 1000
+# Maximum number of records per multi-row INSERT
+INSERT_BATCH_SIZE = 1000
+# Number of source records after which the migrated batches are committed, rounded up to whole batches.
+# MIGRATION_COMMIT_INTERVAL in .env overrides it, 0 commits once at the end of the migration
+COMMIT_INTERVAL = int(os.getenv('MIGRATION_COMMIT_INTERVAL') or 10000)
+# Minimum number of seconds between two progress lines
+PROGRESS_INTERVAL = 0.5
+# Source application columns holding the guarantors of a loan
+GUARANTOR_KEY_COLUMNS = ["co_client_key", "co2_client_key"]
+# Source client columns the profiles of a client are built from
+CLIENT_PROFILE_COLUMNS = ['bus_add_1', 'bus_add_2', 'bus_add_3', 'bus_name', 'id_date', 'com_reg', 'tax_reg']
+# SELECT with a record limit by source database type, LIMIT for anything but SQL Server
+LIMITED_SELECT_FORMATS = {
+    "sqlserver": "SELECT TOP {limit} {columns} FROM {table}",
+}
+DEFAULT_LIMITED_SELECT_FORMAT = "SELECT {columns} FROM {table} LIMIT {limit}"
+# Client profile document type -> name used in the logs
+PROFILE_TYPE_NAMES = {1: "national ID", 2: "commercial ID", 3: "tax ID"}
+# Source values of these types are inserted as they are. Binary values stay bytes, their string form
+# would be the Python repr
+SUPPORTED_VALUE_TYPES = (str, int, float, bool, datetime.date, datetime.datetime, bytes, bytearray)
+# Exact types of the values inserted as they are, checked with one set lookup per value
+SUPPORTED_EXACT_TYPES = frozenset(SUPPORTED_VALUE_TYPES + (type(None),))
+
+def env_conn_details(prefix):
+    """
+    Build connection details from the environment variables of a database.
+    Args:
+        prefix (str): Prefix of the variables in .env, SOURCE or DEST
+    Returns:
+        dict: Connection details as expected by test_connection
+    """
+    use_ssh = os.getenv(f'{prefix}_USE_SSH') == 'y'
+    return {
+        "db_type": os.getenv(f'{prefix}_DB_TYPE'),
+        "host": os.getenv(f'{prefix}_HOST'),
+        "user": os.getenv(f'{prefix}_USER'),
+        "password": os.getenv(f'{prefix}_PASSWORD'),
+        "database": os.getenv(f'{prefix}_DATABASE'),
+        "ssh_host": os.getenv(f'{prefix}_SSH_HOST') if use_ssh else None,
+        "ssh_user": os.getenv(f'{prefix}_SSH_USER') if use_ssh else None,
+        "ssh_password": os.getenv(f'{prefix}_SSH_PASSWORD') if use_ssh else None
+    }
+
+def location_record(processed_row, locationable_type, locationable_id):
+    """
+    Build the location of a migrated record from its coordinates.
+    Args:
+        processed_row (dict): Processed record, with latitude and longitude if its migration maps them
+        locationable_type (str): Model type of the record
+        locationable_id (int): ID of the inserted record
+    Returns:
+        dict: Dictionary of column-value pairs of the location, None if the record has no coordinates
+    """
+    try:
+        latitude, longitude = processed_row["latitude"], processed_row["longitude"]
+    except KeyError:
+        return None
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "locationable_type": locationable_type,
+        "locationable_id": locationable_id,
+        "active": 1,
+        "role_id": 3
+    }
+
+def to_supported_value(value, source_column):
+    """
+    Convert a source value of an unsupported ODBC SQL type to a string.
+    Args:
+        value: The source value, of none of the SUPPORTED_EXACT_TYPES
+        source_column (str): Column the value comes from, for the error message
+    Returns:
+        The value itself if it is of a subclass of a supported type, otherwise its string form,
+        None if it cannot be converted
+    """
+    if isinstance(value, SUPPORTED_VALUE_TYPES):
+        return value
+    try:
+        return str(value)
+    except Exception as e:
+        print(f"Error processing column {source_column}: {str(e)}")
+        return None
+
+def insert_linked_records(cursor, linked_records, logger=None, max_bytes=None):
+    """
+    Insert the records linked to a batch of migrated records with multi-row INSERTs per table.
+    Args:
+        cursor: Destination database cursor
+        linked_records (dict): Table name -> list of (index of the owning record, dict of column-value pairs)
+        logger (logging.Logger, optional): Logger instance
+        max_bytes (int, optional): Maximum estimated size of the values of one INSERT
+    Returns:
+        dict: Index of each owning record that has a linked record that could not be inserted -> the exception
+    """
+    failures = {}
+    for table, records in linked_records.items():
+        # Records with the same columns share INSERTs, so bring them together
+        records = sorted(records, key=lambda record: tuple(record[1]))
+        results = insert_records_batched(
+            cursor, table, [data for _, data in records], batch_size=INSERT_BATCH_SIZE, logger=logger,
+            max_bytes=max_bytes
+        )
+        for (owner, _), (_, error) in zip(records, results):
+            if error is not None:
+                if logger:
+                    logger.error(f"Error inserting {table} record of record {owner+1}: {str(error)}")
+                failures.setdefault(owner, error)
+    return failures
+
+def add_loan_linked_records(batch, i, last_inserted_id, processed_row, source_row, charge_to_add):
+    """
+    Collect the linked charge, profiles, guarantors and location of an inserted loan.
+    Args:
+        batch (dict): Batch context, see the migration loop
+        i (int): Index of the loan's source record
+        last_inserted_id (int): ID of the inserted loan
+        processed_row (dict): Processed loan record
+        source_row (dict): Source record of the loan
+        charge_to_add (dict): Linked charge taken from the processed record, if any
+    """
+    linked_records = batch["linked_records"]
+    migration_logger = batch["logger"]
+    cursor_dest = batch["cursor_dest"]
+    src_cursor = batch["src_cursor"]
+    client_profiles = batch["client_profiles"]
+    application_guarantors = batch["application_guarantors"]
+    guarantor_clients = batch["guarantor_clients"]
+    batch_now = batch["now"]
+
+    # Insert linked charge if applicable (after main loan insert)
+    if charge_to_add:
+        charge_data = charge_to_add
+        charge_data["loan_id"] = last_inserted_id # Add the loan_id now
+        linked_records["loan_linked_charges"].append((i, charge_data))
+
+    # Insert loan profiles after loan creation
+    client_id = processed_row.get("client_id")
+    if client_id is not None:
+        migration_logger.debug("Creating loan profiles for loan ID %s from client ID %s", last_inserted_id, client_id)
+
+        # Get client profiles
+        try:
+            if client_profiles is not None:
+                profiles_of_client = client_profiles.get(client_id, [])
+            else:
+                client_profiles_query = """
+                SELECT id ,document_type_id, document_id, career
+                FROM profiles 
+                WHERE profileable_type = %s AND profileable_id = %s
+                """
+                cursor_dest.execute(client_profiles_query, (CLIENT_MODEL_TYPE, client_id))
+                profiles_of_client = cursor_dest.fetchall()
+
+            if profiles_of_client:
+                for profile in profiles_of_client:
+                    # Create loan profile with same data but different model type
+                    loan_profile_data = {
+                        "profile_id": profile[0],
+                        "document_type_id": profile[1],
+                        "document_id": profile[2],
+                        "career": profile[3],
+                        "model_type": LOAN_MODEL_TYPE,
+                        "model_id": last_inserted_id
+                    }
+                    linked_records["loan_profiles"].append((i, loan_profile_data))
+
+                migration_logger.debug("Created %s loan profiles for loan ID %s", len(profiles_of_client), last_inserted_id)
+            else:
+                migration_logger.warning(f"No client profiles found for client ID {client_id}")
+        except Exception as e:
+            error_msg = f"Error creating loan profiles for loan ID {last_inserted_id}: {str(e)}"
+            migration_logger.error(error_msg)
+            print(f"    {error_msg}")
+
+    try:
+        # Get application details with guarantor information
+        application_key = source_row.get('application_key')
+
+        if application_guarantors is not None:
+            application_details = application_guarantors.get(str(application_key))
+        else:
+            application_details = get_record_details_by_id(
+                src_cursor, 
+                "ilts.c1_loan_application", 
+                application_key,
+                GUARANTOR_KEY_COLUMNS, 
+                logger=migration_logger, 
+                id_name='application_key'
+            )
+
+        if application_details:
+            # Process both guarantors
+            guarantor_keys = [
+                application_details.get("co_client_key"),
+                application_details.get("co2_client_key")
+            ]
+
+            for idx, guarantor_key in enumerate(guarantor_keys):
+                if guarantor_key:
+                    migration_logger.debug("Found guarantor key: %s for application %s", guarantor_key, application_key)
+
+                    # Find guarantor client by external_id
+                    if guarantor_clients is not None:
+                        guarantor_details = guarantor_clients.get(str(guarantor_key))
+                    else:
+                        guarantor_details = get_record_details_by_id(
+                            cursor_dest,
+                            "clients",
+                            guarantor_key,
+                            ["id", "created_at"],
+                            logger=migration_logger,
+                            id_name='external_id'
+                        )
+
+                    if guarantor_details:
+                        guarantor_id = guarantor_details.get("id")
+                        guarantor_created_at = guarantor_details.get("created_at")
+
+                        migration_logger.debug("Found guarantor client ID: %s", guarantor_id)
+
+                        # Create loan guarantor record with the correct field structure
+                        guarantor_data = {
+                            "model_type": LOAN_MODEL_TYPE,
+                            "model_id": last_inserted_id,
+                            "guarantor_id": guarantor_id,
+                            "created_at": guarantor_created_at or batch_now,
+                            "updated_at": guarantor_created_at or batch_now
+                        }
+
+                        linked_records["loan_guarantors"].append((i, guarantor_data))
+                        migration_logger.info("Created loan guarantor record for loan ID %s with guarantor ID %s", last_inserted_id, guarantor_id)
+                    else:
+                        migration_logger.warning(f"Guarantor client not found for client key: {guarantor_key}")
+                else:
+                    migration_logger.debug("No guarantor %s found for application %s", idx + 1, application_key)
+        else:
+            migration_logger.debug("No application details found for application key %s", application_key)
+
+    except Exception as e:
+        error_msg = f"Error creating loan guarantors for loan ID {last_inserted_id}: {str(e)}"
+        migration_logger.error(error_msg)
+        print(f"    {error_msg}")
+
+    # Insert location data if latitude and longitude are available
+    location_data = location_record(processed_row, LOAN_MODEL_TYPE, last_inserted_id)
+    if location_data:
+        linked_records["locations"].append((i, location_data))
+        migration_logger.debug("Created location record for loan ID %s", last_inserted_id)
+
+def add_officer_linked_records(batch, i, last_inserted_id, processed_row, source_row, charge_to_add):
+    """
+    Collect the cash wallet of an inserted officer.
+    Args:
+        batch (dict): Batch context, see the migration loop
+        i (int): Index of the officer's source record
+        last_inserted_id (int): ID of the inserted officer
+        processed_row (dict): Processed officer record
+        source_row (dict): Source record of the officer
+        charge_to_add: Unused, officers have no linked charge
+    """
+    linked_records = batch["linked_records"]
+    migration_logger = batch["logger"]
+
+    migration_logger.debug("Creating wallet for officer ID %s", last_inserted_id)
+    wallet_data = {
+        "user_id": last_inserted_id,
+        "role_id": 60,
+        "currency_id": 1,
+        "wallet_type": "cash",
+        "amount": 0,
+        "active": True,
+    }
+    linked_records["wallets"].append((i, wallet_data))
+
+def add_client_linked_records(batch, i, last_inserted_id, processed_row, source_row, charge_to_add):
+    """
+    Collect the document profiles and location of an inserted client.
+    Args:
+        batch (dict): Batch context, see the migration loop
+        i (int): Index of the client's source record
+        last_inserted_id (int): ID of the inserted client
+        processed_row (dict): Processed client record
+        source_row (dict): Source record of the client
+        charge_to_add: Unused, clients have no linked charge
+    """
+    linked_records = batch["linked_records"]
+    migration_logger = batch["logger"]
+    src_cursor = batch["src_cursor"]
+    client_details_by_key = batch["client_details_by_key"]
+
+    migration_logger.debug("Creating profiles for client ID %s", last_inserted_id)
+    if "national_id" in processed_row:
+        if client_details_by_key is not None:
+            client_details = client_details_by_key.get(str(source_row.get('client_key')))
+        else:
+            client_details = get_record_details_by_id(
+                src_cursor, 
+                "ilts.c1_client_info_table", 
+                source_row.get('client_key'),
+                CLIENT_PROFILE_COLUMNS, 
+                logger=migration_logger, 
+                id_name='client_key'
+            )
+        # Get document_issued_at date and calculate expiry date (8 years later)
+        document_issued_at = client_details.get('id_date', '')
+        document_expires_at = None
+
+        if document_issued_at and isinstance(document_issued_at, datetime.datetime):
+            document_expires_at = document_issued_at.replace(year=document_issued_at.year + 8)
+        elif document_issued_at and isinstance(document_issued_at, datetime.date):
+            document_expires_at = datetime.datetime.combine(
+                document_issued_at.replace(year=document_issued_at.year + 8),
+                datetime.datetime.min.time()
+            )
+
+        # Define profiles to create
+        profiles_to_create = [
+            {
+                "document_type_id": 1,
+                "document_id": processed_row["national_id"],
+                "document_issued_at": document_issued_at,
+                "document_expires_at": document_expires_at,
+                "profileable_type": CLIENT_MODEL_TYPE,
+                "profileable_id": last_inserted_id
+            },
+            {
+                "document_type_id": 2,
+                "document_id": client_details.get('com_reg'),
+                "career": client_details.get('bus_name', ''),
+                "employer_address": join_non_empty(
+                    client_details.get('bus_add_1', ''),
+                    client_details.get('bus_add_2', ''),
+                    client_details.get('bus_add_3', '')
+                ),
+                "profileable_type": CLIENT_MODEL_TYPE,
+                "profileable_id": last_inserted_id
+            }
+        ]
+
+        # Add tax profile if tax_reg exists
+        if client_details.get('tax_reg'):
+            profiles_to_create.append({
+                "document_type_id": 3,
+                "document_id": client_details.get('tax_reg'),
+                "profileable_type": CLIENT_MODEL_TYPE,
+                "profileable_id": last_inserted_id
+            })
+
+        # Create all profiles in a loop
+        for profile_data in profiles_to_create:
+            if profile_data.get("document_id"):
+                linked_records["profiles"].append((i, profile_data))
+                migration_logger.debug(
+                    "Created %s profile for client ID %s",
+                    PROFILE_TYPE_NAMES.get(profile_data["document_type_id"], "unknown"), last_inserted_id
+                )
+
+        # Insert location data if latitude and longitude are available
+        location_data = location_record(processed_row, CLIENT_MODEL_TYPE, last_inserted_id)
+        if location_data:
+            linked_records["locations"].append((i, location_data))
+            migration_logger.debug("Created location record for client ID %s", last_inserted_id)
+    else:
+        # Reported once for the whole batch
+        batch["missing_national_id"].append(last_inserted_id)
+
+def model_type_condition(column, model_type):
+    """
+    Build the WHERE clause selecting the records of a model type in a polymorphic column.
+    Args:
+        column (str): Model type column
+        model_type (str): Model type, with its backslashes unescaped
+    Returns:
+        str: WHERE clause with the model type as an escaped SQL string
+    """
+    return f"WHERE {column} = '" + model_type.replace("\\", "\\\\") + "'"
+
+# Migration name -> (table, WHERE clause) deleted by its cleanup, linked records before the records they
+# link to. A table of None stands for the target table of the migration
+CLEANUP_STEPS = {
+    "officers": [
+        ("wallets", "WHERE role_id = 60"),
+        (None, "WHERE role_id = 60"),
+    ],
+    "loans": [
+        ("loan_profiles", model_type_condition("model_type", LOAN_MODEL_TYPE)),
+        ("locations", model_type_condition("locationable_type", LOAN_MODEL_TYPE)),
+        ("loan_guarantors", model_type_condition("model_type", LOAN_MODEL_TYPE)),
+        ("loan_linked_charges", ""),
+        (None, ""),
+    ],
+    "clients": [
+        ("profiles", model_type_condition("profileable_type", CLIENT_MODEL_TYPE)),
+        ("locations", model_type_condition("locationable_type", CLIENT_MODEL_TYPE)),
+        ("users", "WHERE role_id = 3"),
+        ("wallets", "WHERE role_id = 3"),
+        (None, ""),
+    ],
+}
+DEFAULT_CLEANUP_STEPS = [(None, "")]
+
+# Migration name -> function collecting the records linked to each of its inserted records
+LINKED_RECORD_BUILDERS = {
+    "loans": add_loan_linked_records,
+    "officers": add_officer_linked_records,
+    "clients": add_client_linked_records,
+}
+
 class MigrationManager:
     def __init__(self, config_file):
         """
@@ -19,7 +433,7 @@ class MigrationManager:
         self.logger = setup_logger()
         self.logger.info("Initializing MigrationManager")
         self.migration_config = load_migration_config(config_file)
-        self.migrations = list(self.migration_config.keys())
+        self.migrations = tuple(self.migration_config)
         if not self.migrations:
             error_msg = "No migrations found in the configuration file."
             self.logger.error(error_msg)
@@ -34,20 +448,42 @@ class MigrationManager:
         for i, migration_name in enumerate(self.migrations, start=1):
             print(f"{i}: {migration_name}")
 
-    def get_migration_by_index(self, index):
+    def get_migration(self, index):
         """
-        Get the migration mappings by its index.
+        Get the name and mappings of a migration by its index.
         Args:
             index (int): Index of the migration.
         Returns:
-            list[dict]: List of column mappings for the selected migration name.
+            tuple: Migration name and its list of column mappings.
         """
         if 0 <= index < len(self.migrations):
             migration_name = self.migrations[index]
-            return self.migration_config[migration_name]
+            return migration_name, self.migration_config[migration_name]
         else:
             raise ValueError("Invalid migration index. Please select a valid option.")
 
+    def get_migration_by_index(self, index):
+        """
+        Get the migration mappings by its index.
+        Args:
+            index (int): Index of the migration.
+        Returns:
+            list[dict]: List of column mappings for the selected migration name.
+        """
+        return self.get_migration(index)[1]
+
+    def get_migration_by_name(self, migration_name):
+        """
+        Get the migration mappings by its name.
+        Args:
+            migration_name (str): Name of the migration.
+        Returns:
+            list[dict]: List of column mappings for the migration.
+        """
+        if migration_name not in self.migration_config:
+            raise ValueError(f"Unknown migration: {migration_name}")
+        return self.migration_config[migration_name]
+
 def run_script():
     import os
     
@@ -75,19 +511,9 @@ def run_script():
     # Source database connection with retry loop
     src_conn = None
     src_ssh_tunnel = None
+    # .env is only loaded at startup, so the details are the same for every attempt
+    src_conn_details = env_conn_details('SOURCE')
     while src_conn is None:
-        # Use environment variables with correct names from .env
-        src_conn_details = {
-            "db_type": os.getenv('SOURCE_DB_TYPE'),
-            "host": os.getenv('SOURCE_HOST'),
-            "user": os.getenv('SOURCE_USER'),
-            "password": os.getenv('SOURCE_PASSWORD'),
-            "database": os.getenv('SOURCE_DATABASE'),
-            "ssh_host": os.getenv('SOURCE_SSH_HOST') if os.getenv('SOURCE_USE_SSH') == 'y' else None,
-            "ssh_user": os.getenv('SOURCE_SSH_USER') if os.getenv('SOURCE_USE_SSH') == 'y' else None,
-            "ssh_password": os.getenv('SOURCE_SSH_PASSWORD') if os.getenv('SOURCE_USE_SSH') == 'y' else None
-        }
-        
         print(f"Connecting to source database: {src_conn_details['database']} ({src_conn_details['db_type']})")
         logger.info(f"Connecting to source database: {src_conn_details['database']} ({src_conn_details['db_type']})")
         
@@ -106,19 +532,8 @@ def run_script():
     # Target database connection with retry loop
     dest_conn = None
     dest_ssh_tunnel = None
+    dest_conn_details = env_conn_details('DEST')
     while dest_conn is None:
-        # Use environment variables with correct names from .env
-        dest_conn_details = {
-            "db_type": os.getenv('DEST_DB_TYPE'),
-            "host": os.getenv('DEST_HOST'),
-            "user": os.getenv('DEST_USER'),
-            "password": os.getenv('DEST_PASSWORD'),
-            "database": os.getenv('DEST_DATABASE'),
-            "ssh_host": os.getenv('DEST_SSH_HOST') if os.getenv('DEST_USE_SSH') == 'y' else None,
-            "ssh_user": os.getenv('DEST_SSH_USER') if os.getenv('DEST_USE_SSH') == 'y' else None,
-            "ssh_password": os.getenv('DEST_SSH_PASSWORD') if os.getenv('DEST_USE_SSH') == 'y' else None
-        }
-        
         print(f"Connecting to target database: {dest_conn_details['database']} ({dest_conn_details['db_type']})")
         logger.info(f"Connecting to target database: {dest_conn_details['database']} ({dest_conn_details['db_type']})")
         
@@ -139,6 +554,19 @@ def run_script():
         print("\nError: One or both database connections failed. Exiting.")
         return
 
+    # Source connection the records to migrate are streamed on, opened with the first migration and kept
+    # for the session
+    stream_conn = None
+    stream_ssh_tunnel = None
+
+    # The source type is fixed for the session, so pick its limit syntax once
+    limited_select_format = LIMITED_SELECT_FORMATS.get(src_conn_details["db_type"], DEFAULT_LIMITED_SELECT_FORMAT)
+
+    # A multi-row INSERT larger than max_allowed_packet is rejected and retried one record at a time, so
+    # batches are also capped by size. Half the packet leaves room for the statement and estimation errors
+    max_insert_bytes = get_max_allowed_packet(dest_conn.cursor(), logger=logger) // 2
+    logger.info(f"Multi-row INSERTs capped at {max_insert_bytes} bytes of values")
+
     # Enter main loop
     while True:
         print("\nMAIN MENU:")
@@ -170,6 +598,8 @@ def run_script():
                         logger.error("Failed to reconnect to destination database")
                         print("Failed to reconnect to destination database. Please try again.")
                         continue
+                    if dest_ssh_tunnel:
+                        release_tunnel(dest_ssh_tunnel)
                     dest_conn, dest_ssh_tunnel = connection_result
                     logger.info("Successfully reconnected to destination database")
                     print("Successfully reconnected to destination database")
@@ -182,6 +612,8 @@ def run_script():
                         logger.error("Failed to reconnect to source database")
                         print("Failed to reconnect to source database. Please try again.")
                         continue
+                    if src_ssh_tunnel:
+                        release_tunnel(src_ssh_tunnel)
                     src_conn, src_ssh_tunnel = connection_result
                     logger.info("Successfully reconnected to source database")
                     print("Successfully reconnected to source database")
@@ -215,6 +647,8 @@ def run_script():
                         logger.error("Failed to reconnect to destination database")
                         print("Failed to reconnect to destination database. Please try again.")
                         continue
+                    if dest_ssh_tunnel:
+                        release_tunnel(dest_ssh_tunnel)
                     dest_conn, dest_ssh_tunnel = connection_result
                     logger.info("Successfully reconnected to destination database")
                     print("Successfully reconnected to destination database")
@@ -227,6 +661,8 @@ def run_script():
                         logger.error("Failed to reconnect to source database")
                         print("Failed to reconnect to source database. Please try again.")
                         continue
+                    if src_ssh_tunnel:
+                        release_tunnel(src_ssh_tunnel)
                     src_conn, src_ssh_tunnel = connection_result
                     logger.info("Successfully reconnected to source database")
                     print("Successfully reconnected to source database")
@@ -249,8 +685,10 @@ def run_script():
             continue
 
         try:
-            migration = manager.get_migration_by_index(int(choice) - 1)
-            migration_name = manager.migrations[int(choice) - 1]
+            migration_name, migration = manager.get_migration(int(choice) - 1)
+            # Every mapping of a migration names the same tables
+            source_table = migration[0]["source_table"]
+            target_table = migration[0]["target_table"]
             logger.info(f"User selected migration: {migration_name}")
             print(f"\n=== Selected Migration: {migration_name} ===")
             print("1: Run Migration")
@@ -266,11 +704,16 @@ def run_script():
                 # Create a migration-specific logger
                 migration_logger = setup_logger(migration_name)
                 logic_processor.logger = migration_logger
+                # Cached lookups may point at rows removed by a cleanup or at a replaced connection
+                logic_processor.dest_conn = dest_conn
+                logic_processor.reset_caches()
+                # Processing function specialized for this migration
+                process_row = logic_processor.bind(migration_name)
 
                 migration_logger.info(f"=== Starting Migration: {migration_name} ===")
 
                 # Ask about foreign key constraints
-                fk_option = input("Migrate with foreign keys: \n1: Enabled (default)\n2: Disabled\nChoice: ").strip() or "1"
+                fk_option = input("Migrate with foreign keys: \n1: Enabled (default)\n2: Disabled (unique checks too)\nChoice: ").strip() or "1"
                 migration_logger.info(f"Foreign key constraints: {'Enabled' if fk_option == '1' else 'Disabled'}")
 
                 # Ask for record limit (for testing purposes)
@@ -283,26 +726,41 @@ def run_script():
                 # Fetch data from source
                 src_cursor = src_conn.cursor()
                 source_columns = [mapping["source_column"] for mapping in migration]
+                target_columns = tuple(mapping["target_column"] for mapping in migration)
+                # Builder of the records linked to each inserted record, None if the migration has none
+                add_linked_records = LINKED_RECORD_BUILDERS.get(migration_name)
                 
                 # Build query based on database type and record limit
                 if record_limit and record_limit.isdigit():
-                    # SQL Server uses TOP syntax
-                    if src_conn_details["db_type"] == "sqlserver":
-                        query_src = f"SELECT TOP {record_limit} {', '.join(source_columns)} FROM {migration[0]['source_table']}"
-                    # MySQL uses LIMIT syntax
-                    else:
-                        query_src = f"SELECT {', '.join(source_columns)} FROM {migration[0]['source_table']} LIMIT {record_limit}"
+                    query_src = limited_select_format.format(
+                        limit=record_limit, columns=', '.join(source_columns), table=source_table
+                    )
                 else:
-                    query_src = f"SELECT {', '.join(source_columns)} FROM {migration[0]['source_table']}"
+                    query_src = f"SELECT {', '.join(source_columns)} FROM {source_table}"
 
+                # The records are streamed on a connection of their own: the source lookups made while
+                # processing them would otherwise discard the rest of the result set
                 try:
-                    print(f"Executing query: {query_src}")
-                    migration_logger.info(f"Executing query: {query_src}")
-                    src_cursor.execute(query_src)
-                    data_to_migrate = src_cursor.fetchall()
-                    total_records = len(data_to_migrate)
+                    src_cursor.execute(f"SELECT COUNT(*) FROM {source_table}")
+                    total_records = src_cursor.fetchone()[0]
+                    if record_limit and record_limit.isdigit():
+                        total_records = min(total_records, int(record_limit))
                     migration_logger.info(f"Found {total_records} records to migrate")
                     print(f"Found {total_records} records to migrate")
+
+                    if stream_conn is None or not is_connection_alive(stream_conn):
+                        if stream_ssh_tunnel:
+                            release_tunnel(stream_ssh_tunnel)
+                        stream_conn = stream_ssh_tunnel = None
+                        connection_result = test_connection(src_conn_details)
+                        if connection_result is None:
+                            raise ConnectionError("Could not open a connection to stream the source records")
+                        stream_conn, stream_ssh_tunnel = connection_result
+                    stream_cursor = stream_conn.cursor()
+
+                    print(f"Executing query: {query_src}")
+                    migration_logger.info(f"Executing query: {query_src}")
+                    stream_cursor.execute(query_src)
                 except Exception as e:
                     error_msg = f"Error fetching data: {str(e)}"
                     migration_logger.error(error_msg)
@@ -314,10 +772,17 @@ def run_script():
                 
                 # Disable foreign key checks if requested
                 if fk_option == "2":
-                    migration_logger.info("Disabling foreign key checks for this migration")
-                    print("Disabling foreign key checks for this migration...")
+                    migration_logger.info("Disabling foreign key and unique checks for this migration")
+                    print("Disabling foreign key and unique checks for this migration...")
                     cursor_dest.execute("SET FOREIGN_KEY_CHECKS=0")
+                    # Lets InnoDB buffer the secondary unique index changes instead of checking every row
+                    cursor_dest.execute("SET UNIQUE_CHECKS=0")
                 
+                # Lookups by external_id scan the whole table without an index. Creating one commits,
+                # so it has to happen before the transaction starts
+                for lookup_table in logic_processor.lookup_tables(migration_name):
+                    ensure_index(cursor_dest, lookup_table, "external_id", logger=migration_logger)
+
                 # Start a transaction for the entire migration
                 migration_logger.info("Starting database transaction")
                 cursor_dest.execute("START TRANSACTION")
@@ -325,307 +790,259 @@ def run_script():
                 # Track unique branches to avoid duplicates if this is the branches migration
                 successful_inserts = 0
                 failed_inserts = 0
-                total_records = len(data_to_migrate)
+                last_progress = None
+                committed_up_to = 0
                 
-                for i, row in enumerate(data_to_migrate):
-                    # Show progress
-                    if i % 10 == 0 or i == total_records - 1:
-                        print(f"Processing record {i+1}/{total_records} ({(i+1)/total_records*100:.1f}%)")
+                # The next batches are read from the source while the current one is processed
+                for batch_start, batch in fetch_batches_ahead(stream_cursor, PREFETCH_BATCH_SIZE):
+                    # Commit between batches, once a batch and its linked records are fully written, to keep
+                    # the transaction bounded
+                    if COMMIT_INTERVAL and batch_start - committed_up_to >= COMMIT_INTERVAL:
+                        dest_conn.commit()
+                        cursor_dest.execute("START TRANSACTION")
+                        committed_up_to = batch_start
+                        migration_logger.info(f"Committed source records 1-{batch_start} ({successful_inserts} successful inserts so far)")
+
+                    # Resolve the lookups of the batch in a few IN (...) queries
+                    batch_rows = [dict(zip(source_columns, batch_row)) for batch_row in batch]
+                    try:
+                        logic_processor.prefetch_lookups(migration_name, batch_rows, cursor_dest, src_cursor)
+                    except Exception as e:
+                        # process_columns falls back to per-row lookups for anything not prefetched
+                        migration_logger.error(f"Error prefetching lookups for records {batch_start+1}-{batch_start+len(batch)}: {str(e)}")
+
+                    # Process the whole batch, then insert it
+                    prepared_rows = []
+                    # Rows to insert in order: the processed rows, each preceded by the transactions split off it
+                    insert_rows = []
+                    # Position of each prepared row in insert_rows
+                    prepared_positions = []
+
+                    for i, row in enumerate(batch, start=batch_start):
+                        # Show progress
+                        now = time.monotonic()
+                        if last_progress is None or now - last_progress >= PROGRESS_INTERVAL or i == total_records - 1:
+                            last_progress = now
+                            print(f"Processing record {i+1}/{total_records} ({(i+1)/total_records*100:.1f}%)")
+
+                        try:
+                            # Source values by source column, already built for the prefetch
+                            source_row = batch_rows[i - batch_start]
+
+                            # Target values by target column, with unsupported ODBC SQL types converted to strings
+                            processed_row = dict(zip(target_columns, [
+                                value if type(value) in SUPPORTED_EXACT_TYPES
+                                else to_supported_value(value, source_column)
+                                for source_column, value in zip(source_columns, row)
+                            ]))
+
+                            # Apply custom logic with both source and target data
+                            processed_row = process_row(
+                                processed_row, 
+                                source_row=source_row, 
+                                cursor=cursor_dest,
+                                src_cursor=src_cursor
+                            )
+
+                            # Split-off transactions go in just before their transaction, even if it is skipped
+                            insert_rows.extend(logic_processor.take_split_off_transactions())
+                    
+                            # Skip this record if processed_row is None (e.g., transaction type not mapped)
+                            if processed_row is None:
+                                migration_logger.debug("Skipping record %s - processing returned None", i + 1)
+                                continue
                     
+                            # Check if the row has a skip flag
+                            if processed_row.get("_skip_this_row", False):
+                                migration_logger.debug("Skipping record %s - marked for skipping by custom logic", i + 1)
+                                # Remove the skip flag from the dictionary to avoid DB errors
+                                if "_skip_this_row" in processed_row:
+                                    del processed_row["_skip_this_row"]
+                                continue
+
+                            prepared_positions.append(len(insert_rows))
+                            insert_rows.append(processed_row)
+                            prepared_rows.append((i, row, processed_row, source_row))
+                        except Exception as e:
+                            failed_inserts += 1
+                            error_msg = f"Error inserting {migration_name} data: {str(e)}"
+                            migration_logger.error(error_msg)
+                            migration_logger.error(f"Problematic row: {row}")
+                            print(error_msg)
+                            print(f"Problematic row: {row}")
+                            continue
+
+                    # Transactions split off a row whose processing failed
+                    insert_rows.extend(logic_processor.take_split_off_transactions())
+
+                    # Write the rows the custom logic deferred (client users and wallets, placeholder
+                    # applications)
                     try:
-                        # Create a dictionary with target column names as keys
-                        processed_row = {}
-                        
-                        # Also create a dictionary with source column names for reference
-                        source_row = {}
-                        
-                        for idx, mapping in enumerate(migration):
-                            # Store source values for reference
-                            source_row[mapping["source_column"]] = row[idx]
-                            
-                            # Handle unsupported ODBC SQL types by converting to string
-                            try:
-                                value = row[idx]
-                                # Convert problematic types to strings
-                                if value is not None and not isinstance(value, (str, int, float, bool, datetime.date, datetime.datetime)):
-                                    value = str(value)
-                                processed_row[mapping["target_column"]] = value
-                            except Exception as e:
-                                print(f"Error processing column {mapping['source_column']}: {str(e)}")
-                                processed_row[mapping["target_column"]] = None
-
-                        # Apply custom logic with both source and target data
-                        processed_row = logic_processor.process_columns(
-                            migration_name, 
-                            processed_row, 
-                            source_row=source_row, 
-                            cursor=cursor_dest,
-                            src_cursor=src_cursor
+                        logic_processor.flush_pending_inserts(cursor_dest)
+                    except Exception as e:
+                        failed_inserts += len(prepared_rows)
+                        error_msg = f"Error inserting deferred {migration_name} records, skipping {len(prepared_rows)} rows: {str(e)}"
+                        migration_logger.error(error_msg)
+                        print(error_msg)
+                        continue
+
+                    # The custom logic flags the rows whose deferred records could not be written, they fail alone
+                    skipped = set()
+                    for i, _, processed_row, _ in prepared_rows:
+                        if processed_row.pop("_skip_this_row", False):
+                            failed_inserts += 1
+                            migration_logger.error("Skipping record %s - its deferred records could not be inserted", i + 1)
+                            skipped.add(id(processed_row))
+                    if skipped:
+                        prepared_rows = [entry for entry in prepared_rows if id(entry[2]) not in skipped]
+                        insert_rows = [insert_row for insert_row in insert_rows if id(insert_row) not in skipped]
+                        prepared_ids = {id(processed_row) for _, _, processed_row, _ in prepared_rows}
+                        prepared_positions = [position for position, insert_row in enumerate(insert_rows)
+                                              if id(insert_row) in prepared_ids]
+
+                    # Extract charge data if present (before main insert)
+                    charges_to_add = [
+                        processed_row.pop("_charge_to_add", None) if migration_name == "loans" else None
+                        for _, _, processed_row, _ in prepared_rows
+                    ]
+
+                    # Insert the main records (loans or other records) with multi-row INSERTs. Their IDs are
+                    # checked by external_id where other records link to them
+                    try:
+                        insert_results = insert_records_batched(
+                            cursor_dest,
+                            target_table,
+                            insert_rows,
+                            batch_size=INSERT_BATCH_SIZE,
+                            key_column="external_id" if migration_name in ("officers", "clients", "loans") else None,
+                            logger=migration_logger,
+                            max_bytes=max_insert_bytes
                         )
-                        
-                        # Skip this record if processed_row is None (e.g., transaction type not mapped)
-                        if processed_row is None:
-                            migration_logger.debug(f"Skipping record {i+1} - processing returned None")
+                    except Exception as e:
+                        failed_inserts += len(prepared_rows)
+                        error_msg = f"Error inserting {migration_name} records {batch_start+1}-{batch_start+len(batch)}: {str(e)}"
+                        migration_logger.error(error_msg)
+                        print(error_msg)
+                        continue
+
+                    # Split-off transactions are not counted as records, only their failures are reported
+                    if len(insert_rows) > len(prepared_rows):
+                        prepared_position_set = set(prepared_positions)
+                        for position, (_, insert_error) in enumerate(insert_results):
+                            if insert_error is not None and position not in prepared_position_set:
+                                tx_data = insert_rows[position]
+                                error_msg = f"Failed to create {tx_data['description']} transaction for loan ID {tx_data['loan_id']}: {str(insert_error)}"
+                                migration_logger.error(error_msg)
+                                print(error_msg)
+                        insert_results = [insert_results[position] for position in prepared_positions]
+
+                    # Fetch what the records linked to the batch need in a few IN (...) queries. A map stays
+                    # None if its query failed, the rows then look their details up one by one
+                    client_profiles = application_guarantors = guarantor_clients = client_details_by_key = None
+                    if migration_name == "loans":
+                        client_profiles = get_client_profiles(
+                            cursor_dest,
+                            [processed_row.get("client_id") for _, _, processed_row, _ in prepared_rows],
+                            logger=migration_logger
+                        )
+                        application_guarantors = get_records_by_ids(
+                            src_cursor,
+                            "ilts.c1_loan_application",
+                            [source_row.get("application_key") for _, _, _, source_row in prepared_rows],
+                            GUARANTOR_KEY_COLUMNS,
+                            logger=migration_logger,
+                            id_name="application_key"
+                        )
+                        # The keys come back as stored in the application table, so match on their string form
+                        if application_guarantors is not None:
+                            application_guarantors = {str(key): details for key, details in application_guarantors.items()}
+                            # Both guarantors of every application of the batch, looked up by external_id at once
+                            guarantor_clients = get_records_by_ids(
+                                cursor_dest,
+                                "clients",
+                                [
+                                    details.get(column)
+                                    for details in application_guarantors.values()
+                                    for column in GUARANTOR_KEY_COLUMNS
+                                ],
+                                ["id", "created_at"],
+                                logger=migration_logger,
+                                id_name="external_id"
+                            )
+                            if guarantor_clients is not None:
+                                guarantor_clients = {str(key): details for key, details in guarantor_clients.items()}
+                    elif migration_name == "clients":
+                        client_details_by_key = get_records_by_ids(
+                            src_cursor,
+                            "ilts.c1_client_info_table",
+                            [source_row.get("client_key") for _, _, _, source_row in prepared_rows],
+                            CLIENT_PROFILE_COLUMNS,
+                            logger=migration_logger,
+                            id_name="client_key"
+                        )
+                        if client_details_by_key is not None:
+                            client_details_by_key = {str(key): details for key, details in client_details_by_key.items()}
+
+                    # Records linked to the main records, inserted together once the batch is processed
+                    linked_records = defaultdict(list)
+                    # What the linked record builders of the batch share. "now" is the timestamp of the linked
+                    # records that have none of their own
+                    batch_context = {
+                        "linked_records": linked_records,
+                        "logger": migration_logger,
+                        "cursor_dest": cursor_dest,
+                        "src_cursor": src_cursor,
+                        "now": datetime.datetime.now(),
+                        "client_profiles": client_profiles,
+                        "application_guarantors": application_guarantors,
+                        "guarantor_clients": guarantor_clients,
+                        "client_details_by_key": client_details_by_key,
+                        "missing_national_id": [],
+                    }
+
+                    for (i, row, processed_row, source_row), charge_to_add, (last_inserted_id, insert_error) in zip(
+                            prepared_rows, charges_to_add, insert_results):
+                        if insert_error is not None:
+                            failed_inserts += 1
+                            error_msg = f"Error inserting {migration_name} data: {str(insert_error)}"
+                            migration_logger.error(error_msg)
+                            migration_logger.error(f"Problematic row: {row}")
+                            print(error_msg)
+                            print(f"Problematic row: {row}")
                             continue
-                        
-                        # Check if the row has a skip flag
-                        if processed_row.get("_skip_this_row", False):
-                            migration_logger.debug(f"Skipping record {i+1} - marked for skipping by custom logic")
-                            # Remove the skip flag from the dictionary to avoid DB errors
-                            if "_skip_this_row" in processed_row:
-                                del processed_row["_skip_this_row"]
+
+                        try:
+                            successful_inserts += 1
+
+                            if add_linked_records and last_inserted_id:
+                                add_linked_records(batch_context, i, last_inserted_id, processed_row, source_row, charge_to_add)
+                        except Exception as e:
+                            failed_inserts += 1
+                            error_msg = f"Error inserting {migration_name} data: {str(e)}"
+                            migration_logger.error(error_msg)
+                            migration_logger.error(f"Problematic row: {row}")
+                            print(error_msg)
+                            print(f"Problematic row: {row}")
                             continue
-                        
-                        # Extract charge data if present (before main insert)
-                        charge_to_add = None
-                        if migration_name == "loans" and "_charge_to_add" in processed_row:
-                            # Pop removes the key and returns its value
-                            charge_to_add = processed_row.pop("_charge_to_add") 
-
-                        # Create dynamic SQL based on the processed row (without the charge data)
-                        target_columns = list(processed_row.keys())
-                        placeholders = ", ".join(["%s"] * len(target_columns))
-                        query_dest = f"INSERT INTO {migration[0]['target_table']} ({', '.join(target_columns)}) VALUES ({placeholders})"
-                        
-                        # Execute main insert (loan or other record)
-                        cursor_dest.execute(query_dest, list(processed_row.values()))
-                        successful_inserts += 1
-                        
-                        # Get the ID of the just-inserted record
-                        last_inserted_id = cursor_dest.lastrowid
-
-                        if migration_name == "loans" and last_inserted_id:
-                            # Insert linked charge if applicable (after main loan insert)
-                            if charge_to_add:
-                                charge_data = charge_to_add
-                                charge_data["loan_id"] = last_inserted_id # Add the loan_id now
-                                try:
-                                    insert_record(cursor_dest, "loan_linked_charges", charge_data)
-                                    migration_logger.debug(f"Successfully inserted linked charge for loan ID {last_inserted_id}")
-                                except Exception as charge_e:
-                                    failed_inserts += 1
-                                    successful_inserts -= 1
-                                    error_msg = f"Error inserting linked charge for loan ID {last_inserted_id}: {str(charge_e)}"
-                                    migration_logger.error(error_msg)
-                                    print(f"    {error_msg}")
-
-                            # Insert loan profiles after loan creation
-                            if "client_id" in processed_row:
-                                client_id = processed_row["client_id"]
-                                migration_logger.debug(f"Creating loan profiles for loan ID {last_inserted_id} from client ID {client_id}")
-
-                                # Get client profiles
-                                try:
-                                    client_profiles_query = """
-                                    SELECT id ,document_type_id, document_id, career
-                                    FROM profiles 
-                                    WHERE profileable_type = 'App\\\\Models\\\\Client' AND profileable_id = %s
-                                    """
-                                    cursor_dest.execute(client_profiles_query, (client_id,))
-                                    client_profiles = cursor_dest.fetchall()
-
-                                    if client_profiles:
-                                        for profile in client_profiles:
-                                            # Create loan profile with same data but different model type
-                                            loan_profile_data = {
-                                                "profile_id": profile[0],
-                                                "document_type_id": profile[1],
-                                                "document_id": profile[2],
-                                                "career": profile[3],
-                                                "model_type": "App\\Models\\Loan\\Loan",
-                                                "model_id": last_inserted_id
-                                            }
-                                            insert_record(cursor_dest, "loan_profiles", loan_profile_data)
-
-                                        migration_logger.debug(f"Created {len(client_profiles)} loan profiles for loan ID {last_inserted_id}")
-                                    else:
-                                        migration_logger.warning(f"No client profiles found for client ID {client_id}")
-                                except Exception as e:
-                                    error_msg = f"Error creating loan profiles for loan ID {last_inserted_id}: {str(e)}"
-                                    migration_logger.error(error_msg)
-                                    print(f"    {error_msg}")
-                                    
-                            try:
-                                # Get application details with guarantor information
-                                application_key = source_row.get('application_key')
-                                app_columns = ["co_client_key", "co2_client_key"]
-                                
-                                application_details = get_record_details_by_id(
-                                    src_cursor, 
-                                    "ilts.c1_loan_application", 
-                                    application_key,
-                                    app_columns, 
-                                    logger=migration_logger, 
-                                    id_name='application_key'
-                                )
-                                
-                                if application_details:
-                                    # Process both guarantors
-                                    guarantor_keys = [
-                                        application_details.get("co_client_key"),
-                                        application_details.get("co2_client_key")
-                                    ]
-                                    
-                                    for idx, guarantor_key in enumerate(guarantor_keys):
-                                        if guarantor_key:
-                                            migration_logger.debug(f"Found guarantor key: {guarantor_key} for application {application_key}")
-                                            
-                                            # Find guarantor client by external_id
-                                            guarantor_details = get_record_details_by_id(
-                                                cursor_dest,
-                                                "clients",
-                                                guarantor_key,
-                                                ["id", "created_at"],
-                                                logger=migration_logger,
-                                                id_name='external_id'
-                                            )
-                                            
-                                            if guarantor_details:
-                                                guarantor_id = guarantor_details.get("id")
-                                                guarantor_created_at = guarantor_details.get("created_at")
-                                                
-                                                migration_logger.debug(f"Found guarantor client ID: {guarantor_id}")
-                                                
-                                                # Create loan guarantor record with the correct field structure
-                                                guarantor_data = {
-                                                    "model_type": "App\\Models\\Loan\\Loan",
-                                                    "model_id": last_inserted_id,
-                                                    "guarantor_id": guarantor_id,
-                                                    "created_at": guarantor_created_at or datetime.datetime.now(),
-                                                    "updated_at": guarantor_created_at or datetime.datetime.now()
-                                                }
-                                                
-                                                insert_record(cursor_dest, "loan_guarantors", guarantor_data, migration_logger)
-                                                migration_logger.info(f"Created loan guarantor record for loan ID {last_inserted_id} with guarantor ID {guarantor_id}")
-                                            else:
-                                                migration_logger.warning(f"Guarantor client not found for client key: {guarantor_key}")
-                                        else:
-                                            migration_logger.debug(f"No guarantor {idx+1} found for application {application_key}")
-                                else:
-                                    migration_logger.debug(f"No application details found for application key {application_key}")
-                                    
-                            except Exception as e:
-                                error_msg = f"Error creating loan guarantors for loan ID {last_inserted_id}: {str(e)}"
-                                migration_logger.error(error_msg)
-                                print(f"    {error_msg}")
-
-                            # Insert location data if latitude and longitude are available
-                            if "latitude" in processed_row and "longitude" in processed_row:
-                                location_data = {
-                                    "latitude": processed_row["latitude"],
-                                    "longitude": processed_row["longitude"],
-                                    "locationable_type": "App\\Models\\Loan\\Loan",
-                                    "locationable_id": last_inserted_id,
-                                    "active": 1,
-                                    "role_id": 3
-                                }
-                                insert_record(cursor_dest, "locations", location_data)
-                                migration_logger.debug(f"Created location record for client ID {last_inserted_id}")
-
-                        # Insert wallet after officer creation
-                        if migration_name == "officers" and last_inserted_id:
-                            migration_logger.debug(f"Creating wallet for officer ID {last_inserted_id}")
-                            wallet_data = {
-                                "user_id": last_inserted_id,
-                                "role_id": 60,
-                                "currency_id": 1,
-                                "wallet_type": "cash",
-                                "amount": 0,
-                                "active": True,
-                            }
-                            insert_record(cursor_dest, "wallets", wallet_data)
-
-                        # Insert profiles after client creation
-                        if migration_name == "clients" and last_inserted_id:
-                            migration_logger.debug(f"Creating profiles for client ID {last_inserted_id}")
-                            if "national_id" in processed_row:
-                                client_columns = ['bus_add_1', 'bus_add_2', 'bus_add_3', 'bus_name', 'id_date', 'com_reg', 'tax_reg']
-
-                                client_details = get_record_details_by_id(
-                                    src_cursor, 
-                                    "ilts.c1_client_info_table", 
-                                    source_row.get('client_key'),
-                                    client_columns, 
-                                    logger=migration_logger, 
-                                    id_name='client_key'
-                                )
-                                # Get document_issued_at date and calculate expiry date (8 years later)
-                                document_issued_at = client_details.get('id_date', '')
-                                document_expires_at = None
-                                
-                                if document_issued_at and isinstance(document_issued_at, datetime.datetime):
-                                    document_expires_at = document_issued_at.replace(year=document_issued_at.year + 8)
-                                elif document_issued_at and isinstance(document_issued_at, datetime.date):
-                                    document_expires_at = datetime.datetime.combine(
-                                        document_issued_at.replace(year=document_issued_at.year + 8),
-                                        datetime.datetime.min.time()
-                                    )
-                                
-                                # Define profiles to create
-                                profiles_to_create = [
-                                    {
-                                        "document_type_id": 1,
-                                        "document_id": processed_row["national_id"],
-                                        "document_issued_at": document_issued_at,
-                                        "document_expires_at": document_expires_at,
-                                        "profileable_type": "App\\Models\\Client",
-                                        "profileable_id": last_inserted_id
-                                    },
-                                    {
-                                        "document_type_id": 2,
-                                        "document_id": client_details.get('com_reg'),
-                                        "career": client_details.get('bus_name', ''),
-                                        "employer_address": ", ".join([part for part in [
-                                            client_details.get('bus_add_1', ''),
-                                            client_details.get('bus_add_2', ''),
-                                            client_details.get('bus_add_3', '')
-                                        ] if part and str(part).strip()]) or None,
-                                        "profileable_type": "App\\Models\\Client",
-                                        "profileable_id": last_inserted_id
-                                    }
-                                ]
-                                
-                                # Add tax profile if tax_reg exists
-                                if client_details.get('tax_reg'):
-                                    profiles_to_create.append({
-                                        "document_type_id": 3,
-                                        "document_id": client_details.get('tax_reg'),
-                                        "profileable_type": "App\\Models\\Client",
-                                        "profileable_id": last_inserted_id
-                                    })
-                                
-                                # Create all profiles in a loop
-                                for profile_data in profiles_to_create:
-                                    if profile_data.get("document_id"):
-                                        insert_record(cursor_dest, "profiles", profile_data)
-                                        profile_type = {1: "national ID", 2: "commercial ID", 3: "tax ID"}.get(profile_data["document_type_id"], "unknown")
-                                        migration_logger.debug(f"Created {profile_type} profile for client ID {last_inserted_id}")
-                                
-                                # Insert location data if latitude and longitude are available
-                                if "latitude" in processed_row and "longitude" in processed_row:
-                                    location_data = {
-                                        "latitude": processed_row["latitude"],
-                                        "longitude": processed_row["longitude"],
-                                        "locationable_type": "App\\Models\\Client",
-                                        "locationable_id": last_inserted_id,
-                                        "active": 1,
-                                        "role_id": 3
-                                    }
-                                    insert_record(cursor_dest, "locations", location_data)
-                                    migration_logger.debug(f"Created location record for client ID {last_inserted_id}")
-                            else:
-                                warning_msg = f"Cannot insert profile for client ID {last_inserted_id} due to missing national_id."
-                                migration_logger.warning(warning_msg)
-                                print(f"Warning: {warning_msg}")
 
+                    if batch_context["missing_national_id"]:
+                        warning_msg = (f"Cannot insert profiles for {len(batch_context['missing_national_id'])} clients "
+                                       f"due to missing national_id: IDs {batch_context['missing_national_id']}")
+                        migration_logger.warning(warning_msg)
+                        print(f"Warning: {warning_msg}")
+
+                    # A record whose linked records could not all be inserted counts as failed
+                    try:
+                        linked_failures = insert_linked_records(cursor_dest, linked_records, migration_logger, max_insert_bytes)
                     except Exception as e:
+                        owners = {owner for records in linked_records.values() for owner, _ in records}
+                        linked_failures = dict.fromkeys(owners, e)
+                    for i, error in linked_failures.items():
+                        successful_inserts -= 1
                         failed_inserts += 1
-                        error_msg = f"Error inserting {migration_name} data: {str(e)}"
+                        error_msg = f"Error inserting the records linked to {migration_name} record {i+1}: {str(error)}"
                         migration_logger.error(error_msg)
-                        migration_logger.error(f"Problematic row: {row}")
-                        print(error_msg)
-                        print(f"Problematic row: {row}")
-                        continue
+                        print(f"    {error_msg}")
                 
                 # Commit the transaction if there were successful inserts
                 if successful_inserts > 0:
@@ -643,107 +1060,41 @@ def run_script():
                 
                 # Re-enable foreign key checks if they were disabled
                 if fk_option == "2":
-                    migration_logger.info("Re-enabling foreign key checks")
+                    migration_logger.info("Re-enabling foreign key and unique checks")
                     cursor_dest.execute("SET FOREIGN_KEY_CHECKS=1")
-                    print("Foreign key checks re-enabled.")
+                    cursor_dest.execute("SET UNIQUE_CHECKS=1")
+                    print("Foreign key and unique checks re-enabled.")
 
             elif action == "2":
                 # Perform cleanup on target table
                 logger.info(f"Starting cleanup for {migration_name}")
-                target_table = migration[0]["target_table"]
                 
-                # Define custom cleanup conditions based on migration type
-                cleanup_condition = ""
-                if migration_name == "officers":
-                    try:
-                        logger.info(f"Starting officers-specific cleanup")
-                        cursor_dest = dest_conn.cursor()
-                        cursor_dest.execute("START TRANSACTION")
-                        # Then clean up wallets of clients
-                        cleanup_condition = "WHERE role_id = 60"
-                        logger.info(f"Cleaning up wallets {cleanup_condition}")
-                        perform_cleanup(dest_conn, "wallets", cleanup_condition)
-                        logger.info(f"Cleaning up {target_table} {cleanup_condition}")
-                        perform_cleanup(dest_conn, target_table,  cleanup_condition)
-                        
-                        logger.info("Committing cleanup transaction")
-                        dest_conn.commit()
-                        logger.info(f"Cleanup completed successfully for users and {target_table}")
-                        print(f"Cleanup completed successfully for users and {target_table}!")
-                        continue  # Skip the standard cleanup below
-                    except Exception as e:
-                        error_msg = f"Error during cleanup: {str(e)}"
-                        logger.error(error_msg)
-                        dest_conn.rollback()
-                        print(error_msg)
-                        continue  # Skip the standard cleanup below
-                elif migration_name == "loans":
-                    try:
-                        logger.info(f"Starting loans-specific cleanup")
-                        cursor_dest = dest_conn.cursor()
-                        cursor_dest.execute("START TRANSACTION")
-                        
-                        # First clean up profiles and locations related to loans
-                        logger.info("Cleaning up loan profiles")
-                        perform_cleanup(dest_conn, "loan_profiles", "WHERE model_type = 'App\\\\Models\\\\Loan\\\\Loan'")
-                        logger.info("Cleaning up locations")
-                        perform_cleanup(dest_conn, "locations", "WHERE locationable_type = 'App\\\\Models\\\\Loan\\\\Loan'")
-                        logger.info("Cleaning up loan guarantors")
-                        perform_cleanup(dest_conn, "loan_guarantors",
-                                        "WHERE model_type = 'App\\\\Models\\\\Loan\\\\Loan'")
-                        # Clean up linked charges
-                        logger.info("Cleaning up loan linked charges")
-                        perform_cleanup(dest_conn, "loan_linked_charges", "")
-                        
-                        # Finally clean up loans table
-                        logger.info(f"Cleaning up {target_table}")
-                        perform_cleanup(dest_conn, target_table, "")
-                        
-                        logger.info("Committing cleanup transaction")
-                        dest_conn.commit()
-                        logger.info(f"Cleanup completed successfully for {target_table} and related data")
-                        print(f"Cleanup completed successfully for {target_table} and related data!")
-                        continue  # Skip the standard cleanup below
-                    except Exception as e:
-                        error_msg = f"Error during cleanup: {str(e)}"
-                        logger.error(error_msg)
-                        dest_conn.rollback()
-                        print(error_msg)
-                        continue  # Skip the standard cleanup below
-                elif migration_name == "clients":
-                    try:
-                        cursor_dest = dest_conn.cursor()
-                        cursor_dest.execute("START TRANSACTION")
-                        
-                       # First clean up profiles and locations related to clients
-                        perform_cleanup(dest_conn, "profiles", "WHERE profileable_type = 'App\\\\Models\\\\Client'")
-                        perform_cleanup(dest_conn, "locations", "WHERE locationable_type = 'App\\\\Models\\\\Client'")
-                        cleanup_condition = "WHERE role_id = 3"
-                        # Then clean up users of clients
-                        perform_cleanup(dest_conn, "users", cleanup_condition)
-                        # Then clean up wallets of clients
-                        perform_cleanup(dest_conn, "wallets", cleanup_condition)
-                        # Finally clean up clients table
-                        perform_cleanup(dest_conn, target_table, "")
-                        
-                        dest_conn.commit()
-                        print(f"Cleanup completed successfully for users and {target_table}!")
-                        continue  # Skip the standard cleanup below
-                    except Exception as e:
-                        dest_conn.rollback()
-                        print(f"Error during cleanup: {str(e)}")
-                        continue  # Skip the standard cleanup below
-                
-                # Standard cleanup for other migrations
+                # Delete the migrated records and the records linked to them in one transaction. Tables that
+                # are emptied completely and that no foreign key references are truncated instead: TRUNCATE
+                # does not log every row, but commits the steps before it
                 try:
                     cursor_dest = dest_conn.cursor()
                     cursor_dest.execute("START TRANSACTION")
-                    perform_cleanup(dest_conn, target_table, cleanup_condition)
+                    for table, condition in CLEANUP_STEPS.get(migration_name, DEFAULT_CLEANUP_STEPS):
+                        table = table or target_table
+                        if not condition and not is_table_referenced(cursor_dest, table):
+                            logger.info(f"Truncating {table}")
+                            dest_conn.commit()
+                            perform_cleanup(dest_conn, table, truncate=True)
+                            cursor_dest.execute("START TRANSACTION")
+                        else:
+                            logger.info(f"Cleaning up {table} {condition}".rstrip())
+                            perform_cleanup(dest_conn, table, condition)
+
+                    logger.info("Committing cleanup transaction")
                     dest_conn.commit()
-                    print(f"Cleanup completed successfully for table {target_table}!")
+                    logger.info(f"Cleanup completed successfully for {target_table} and related data")
+                    print(f"Cleanup completed successfully for {target_table} and related data!")
                 except Exception as e:
+                    error_msg = f"Error during cleanup: {str(e)}"
+                    logger.error(error_msg)
                     dest_conn.rollback()
-                    print(f"Error during cleanup: {str(e)}")
+                    print(error_msg)
             
             else:
                  # Back to main menu
@@ -761,11 +1112,15 @@ def run_script():
     # Cleanup connections
     logger.info("Closing database connections and SSH tunnels")
     if src_ssh_tunnel:
-        src_ssh_tunnel.stop()
+        release_tunnel(src_ssh_tunnel)
     if dest_ssh_tunnel:
-        dest_ssh_tunnel.stop()
+        release_tunnel(dest_ssh_tunnel)
+    if stream_ssh_tunnel:
+        release_tunnel(stream_ssh_tunnel)
     src_conn.close()
     dest_conn.close()
+    if stream_conn:
+        stream_conn.close()
     logger.info("=== DATABASE MIGRATION TOOL FINISHED ===")
 
 
@@ -1,9 +1,29 @@
 from __future__ import annotations
 
-from datetime import datetime
+import binascii
+import struct
 
-from general_helper import insert_record
+from general_helper import ensure_index, get_records_by_ids, insert_record
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Header(6) + Latitude(8) + Longitude(8) of the SQL Server '0F' geography point layout
+WKB_POINT_PREFIX = "E6100000010F"
+WKB_POINT_SIZE = 22
+_WKB_LAT_LON = struct.Struct('<6xdd')
+
+# Model types of the polymorphic relations of the migrated records
+CLIENT_MODEL_TYPE = "App\\Models\\Client"
+LOAN_MODEL_TYPE = "App\\Models\\Loan\\Loan"
+
+
+# Governorate ID per 2-digit national ID code, "88" (born outside the country) maps to 1
+_GOVERNORATE_BY_CODE = {f"{code:02d}": code for code in range(100)}
+_GOVERNORATE_BY_CODE["88"] = 1
 
 def get_governorate_from_national_id(national_id):
     """
@@ -15,29 +35,73 @@ def get_governorate_from_national_id(national_id):
     Returns:
         int: Governorate ID or None if invalid
     """
-    if not national_id or len(str(national_id)) != 14:
+    if not national_id:
+        return None
+    national_id = national_id if isinstance(national_id, str) else str(national_id)
+    if len(national_id) != 14:
         return None
         
     # Extract governorate code (8th and 9th digits)
-    gov_code = str(national_id)[7:9]
-    
-    # Handle special case for outside country
-    if gov_code == "88":
-        return 1
-        
+    gov_code = national_id[7:9]
+    governorate_id = _GOVERNORATE_BY_CODE.get(gov_code)
+    if governorate_id is not None:
+        return governorate_id
+
     try:
-        # Convert governorate code to integer
+        # Codes that are not two plain digits, e.g. with a sign or a space
         return int(gov_code)
     except ValueError:
         return None
 
+# Running balances per loan, ordered by transaction id. A disbursement (1) sets the
+# principal and an interest application (11) sets the interest, so each starts a new
+# segment whose first delta is the set amount; charges (10) add to penalties and
+# repayments/write-offs (2, 6) subtract from all three.
+_SETTLE_BALANCES_QUERY = """
+    UPDATE loan_transactions t
+    JOIN (
+        SELECT id,
+               SUM(delta_p) OVER (PARTITION BY loan_id, p_seg ORDER BY id) AS pb,
+               SUM(delta_i) OVER (PARTITION BY loan_id, i_seg ORDER BY id) AS ib,
+               SUM(delta_pen) OVER (PARTITION BY loan_id ORDER BY id) AS peb
+        FROM (
+            SELECT id, loan_id,
+                   CASE WHEN loan_transaction_type_id = 1 THEN COALESCE(principal_repaid_derived, 0)
+                        WHEN loan_transaction_type_id IN (2, 6) THEN -COALESCE(principal_repaid_derived, 0)
+                        ELSE 0 END AS delta_p,
+                   CASE WHEN loan_transaction_type_id = 11 THEN COALESCE(interest_repaid_derived, 0)
+                        WHEN loan_transaction_type_id IN (2, 6) THEN -COALESCE(interest_repaid_derived, 0)
+                        ELSE 0 END AS delta_i,
+                   CASE WHEN loan_transaction_type_id = 10 THEN COALESCE(amount, 0)
+                        WHEN loan_transaction_type_id IN (2, 6) THEN -COALESCE(penalties_repaid_derived, 0)
+                        ELSE 0 END AS delta_pen,
+                   SUM(loan_transaction_type_id = 1) OVER w AS p_seg,
+                   SUM(loan_transaction_type_id = 11) OVER w AS i_seg
+            FROM loan_transactions
+            WHERE loan_id IS NOT NULL
+            WINDOW w AS (PARTITION BY loan_id ORDER BY id)
+        ) deltas
+    ) balances ON t.id = balances.id
+    SET t.principal_balance = balances.pb,
+        t.interest_balance = balances.ib,
+        t.penalties_balance = balances.peb,
+        t.total_balance = balances.pb + balances.ib + balances.peb"""
+
+# Disbursements, charges and interest applications carry no repaid amounts once settled
+_CLEAR_REPAID_QUERY = """
+    UPDATE loan_transactions
+    SET principal_repaid_derived = 0,
+        interest_repaid_derived = 0
+    WHERE loan_id IS NOT NULL
+      AND loan_transaction_type_id IN (1, 10, 11)"""
+
 def settle_transactions(conn, src_conn, logger=None):
     """
     Perform settlement on transactions by calculating and updating balance columns.
     
-    This function processes loan transactions grouped by loan_id and sorted by id.
-    It calculates running balances for principal, interest, fees, penalties, and total balance
-    based on transaction types.
+    Running balances for principal, interest, penalties and total balance are computed
+    per loan_id in id order by the database itself, using window functions, so the
+    whole settlement is two UPDATE statements in one transaction.
     
     Args:
         conn: Destination database connection
@@ -45,147 +109,19 @@ def settle_transactions(conn, src_conn, logger=None):
         logger (logging.Logger, optional): Logger instance for tracking progress
     """
     cursor = conn.cursor()
-    src_cursor = src_conn.cursor()
     
     try:
-        # Get all loan IDs that have transactions
-        message = "Fetching loans with transactions..."
-        if logger:
-            logger.info(message)
-        print(message)
-        
-        cursor.execute("SELECT DISTINCT loan_id FROM loan_transactions WHERE loan_id IS NOT NULL")
-        loan_ids = [row[0] for row in cursor.fetchall()]
-        
-        if not loan_ids:
-            message = "No loans with transactions found."
-            if logger:
-                logger.info(message)
-            print(message)
-            return
-            
-        message = f"Found {len(loan_ids)} loans with transactions to process."
+        message = "Calculating transaction balances..."
         if logger:
             logger.info(message)
         print(message)
         
-        # Process each loan's transactions
-        for i, loan_id in enumerate(loan_ids):
-            if i % 100 == 0:
-                message = f"Processing loan {i+1}/{len(loan_ids)} (ID: {loan_id})"
-                if logger:
-                    logger.info(message)
-                print(message)
-                
-            # Get all transactions for this loan, ordered by ID
-            cursor.execute("""
-                SELECT id, loan_transaction_type_id, principal_repaid_derived, interest_repaid_derived,
-                       penalties_repaid_derived, amount
-                FROM loan_transactions 
-                WHERE loan_id = %s 
-                ORDER BY id
-            """, (loan_id,))
-            
-            transactions = cursor.fetchall()
-            
-            if logger:
-                logger.debug(f"Processing {len(transactions)} transactions for loan ID {loan_id}")
-            
-            # Initialize running balances
-            principal_balance = 0
-            interest_balance = 0
-            penalties_balance = 0
-            
-            # Process each transaction
-            for tx in transactions:
-                tx_id = tx[0]
-                tx_type = tx[1]
-                principal_amount = float(tx[2] or 0)
-                interest_amount = float(tx[3] or 0)
-                penalties_amount = float(tx[4] or 0)
-                amount = float(tx[5] or 0)
-
-                # Update balances based on transaction type
-                if logger:
-                    logger.debug(f"Processing transaction ID {tx_id}, type {tx_type}, amount {amount}")
-                
-                # Handle different transaction types
-                if tx_type == 10:  # Apply Charges - increase penalties balance
-                    penalties_balance += amount
-                    
-                    if logger:
-                        logger.debug(f"Apply Charges: Adding penalties {amount}")
-                    
-                elif tx_type == 1:  # Disbursement - set principal balance
-                    principal_balance = principal_amount
-                    
-                    if logger:
-                        logger.debug(f"Disbursement: Setting principal to {principal_amount}")
-                
-                elif tx_type == 11:  # Apply Interest - set interest balance
-                    interest_balance = interest_amount
-                    
-                    if logger:
-                        logger.debug(f"Apply Interest: Setting interest to {interest_amount}")
-                    
-                elif tx_type in (2, 6):  # Repayment or Write Off - decrease balances
-                    # Decrease principal, interest, and penalties balances
-                    principal_balance -= principal_amount
-                    interest_balance -= interest_amount
-                    penalties_balance -= penalties_amount
-                    
-                    if logger:
-                        logger.debug(f"Repayment/Write-off: Decreasing principal by {principal_amount}, interest by {interest_amount}, penalties by {penalties_amount}")
-                
-                else:
-                    # For any other transaction type, just maintain current balances
-                    if logger:
-                        logger.debug(f"Other transaction type {tx_type}: Maintaining current balances")
-                
-                # Calculate total balance
-                total_balance = principal_balance + interest_balance + penalties_balance
-                
-                # Determine if we need to clear repaid values
-                clear_repaid = tx_type == 1 or tx_type == 10 or tx_type == 11 # Only clear for disbursements or apply charges or apply interest
-                
-                # Build the SQL parameters
-                sql_params = [principal_balance, interest_balance, penalties_balance, total_balance]
-                
-                # Build the SQL query
-                sql_query = """
-                    UPDATE loan_transactions 
-                    SET principal_balance = %s, 
-                        interest_balance = %s,
-                        penalties_balance = %s,
-                        total_balance = %s"""
-                
-                # Add clearing of repaid values if needed
-                if clear_repaid:
-                    sql_query += """,
-                        principal_repaid_derived = 0,
-                        interest_repaid_derived = 0"""
-                
-                # Add the WHERE clause
-                sql_query += """
-                    WHERE id = %s"""
-                
-                # Add the transaction ID to parameters
-                sql_params.append(tx_id)
-                
-                # Execute the update
-                cursor.execute(sql_query, sql_params)
-            
-            # Commit after each loan to avoid long transactions
-            if (i + 1) % 100 == 0:
-                conn.commit()
-                message = f"Committed changes for {i+1} loans"
-                if logger:
-                    logger.info(message)
-                print(message)
-        
-        # Final commit
+        cursor.execute(_SETTLE_BALANCES_QUERY)
+        updated = cursor.rowcount
+        cursor.execute(_CLEAR_REPAID_QUERY)
         conn.commit()
-        message = f"Successfully updated balances for {len(loan_ids)} loans"
+        
+        message = f"Successfully updated balances for {updated} transactions"
         if logger:
             logger.info(message)
         print(message)
@@ -199,7 +135,6 @@ def settle_transactions(conn, src_conn, logger=None):
         raise
     finally:
         cursor.close()
-        src_cursor.close()
 
 def settle_installments(conn, src_conn, logger=None):
     """
@@ -240,17 +175,17 @@ def settle_installments(conn, src_conn, logger=None):
             logger.info(message)
         print(message)
         
-        # Convert list to comma-separated string for SQL IN clause
-        loan_keys_str = "', '".join(str(key) for key in early_settled_loan_keys)
-        
-        # Step 2: Get corresponding loan IDs from destination database
-        dest_query = f"""
-        SELECT id, loan_term, external_id
-        FROM loans
-        WHERE external_id IN ('{loan_keys_str}')
-        """
-        cursor.execute(dest_query)
-        early_settled_loans = cursor.fetchall()
+        # Step 2: Get corresponding loan IDs from destination database, in parameterized chunks
+        loans_by_key = get_records_by_ids(
+            cursor, "loans", [str(key) for key in early_settled_loan_keys],
+            ["id", "loan_term"], logger, id_name="external_id"
+        )
+        if loans_by_key is None:
+            raise RuntimeError("Could not look up early settled loans in destination database")
+        early_settled_loans = [
+            (loan["id"], loan["loan_term"], external_id)
+            for external_id, loan in loans_by_key.items()
+        ]
         
         if not early_settled_loans:
             message = "No matching loans found in destination database."
@@ -264,21 +199,8 @@ def settle_installments(conn, src_conn, logger=None):
             logger.info(message)
         print(message)
         
-        # Process each loan with early settlement
-        for loan in early_settled_loans:
-            loan_id = loan[0]
-            expected_installments = loan[1]
-            external_id = loan[2]
-            
-            message = f"Processing loan ID: {loan_id} (External ID: {external_id}) - Expected installments: {expected_installments}"
-            if logger:
-                logger.info(message)
-            print(message)
-            
-            # Handle early settlement (reverse and apply in one function)
-            handle_early_settlement(conn, loan_id, logger)
-        
-        rows_settled = len(early_settled_loans)
+        # Handle early settlement (reverse and apply) for all loans at once
+        rows_settled = handle_early_settlements(conn, [loan[0] for loan in early_settled_loans], logger)
         message = f"Settled {rows_settled} loans with early settlement"
         if logger:
             logger.info(message)
@@ -295,327 +217,220 @@ def settle_installments(conn, src_conn, logger=None):
         cursor.close()
         src_cursor.close()
 
-def handle_early_settlement(conn, loan_id, logger=None):
+# An installment still owes something once repaid, written off and waived amounts are taken off
+_INSTALLMENT_OUTSTANDING = """
+    (COALESCE(u.principal, 0) + COALESCE(u.interest, 0) + COALESCE(u.fees, 0) + COALESCE(u.penalties, 0)) -
+    (COALESCE(u.principal_repaid_derived, 0) + COALESCE(u.interest_repaid_derived, 0) + COALESCE(u.fees_repaid_derived, 0) + COALESCE(u.penalties_repaid_derived, 0)) -
+    (COALESCE(u.principal_written_off_derived, 0) + COALESCE(u.interest_written_off_derived, 0) + COALESCE(u.fees_written_off_derived, 0) + COALESCE(u.penalties_written_off_derived, 0)) -
+    (COALESCE(u.interest_waived_derived, 0) + COALESCE(u.fees_waived_derived, 0) + COALESCE(u.penalties_waived_derived, 0))"""
+
+# MySQL cannot open a temporary table twice in one statement, so the loan IDs and the
+# per-loan settlement snapshot live in two tables and every statement joins only one
+_EARLY_SETTLEMENT_SETUP = (
+    "DROP TEMPORARY TABLE IF EXISTS early_settled_loan_ids",
+    "DROP TEMPORARY TABLE IF EXISTS early_settlements",
+    "CREATE TEMPORARY TABLE early_settled_loan_ids (loan_id BIGINT PRIMARY KEY)",
+    """
+    CREATE TEMPORARY TABLE early_settlements (
+        loan_id BIGINT PRIMARY KEY,
+        settlement_id BIGINT NOT NULL,
+        fee DECIMAL(20, 6) NOT NULL,
+        paid_by_date DATETIME NULL,
+        branch_id BIGINT NULL,
+        loan_officer_id BIGINT NULL,
+        unpaid_id BIGINT NULL,
+        total_principal DECIMAL(20, 6) NOT NULL DEFAULT 0,
+        total_interest DECIMAL(20, 6) NOT NULL DEFAULT 0,
+        last_principal_balance DECIMAL(20, 6) NOT NULL DEFAULT 0,
+        last_interest_balance DECIMAL(20, 6) NOT NULL DEFAULT 0,
+        last_fees_balance DECIMAL(20, 6) NOT NULL DEFAULT 0,
+        last_penalties_balance DECIMAL(20, 6) NOT NULL DEFAULT 0
+    )""",
+)
+
+_EARLY_SETTLEMENT_TEARDOWN = (
+    "DROP TEMPORARY TABLE IF EXISTS early_settled_loan_ids",
+    "DROP TEMPORARY TABLE IF EXISTS early_settlements",
+)
+
+# The settlement installment is the last one of each loan, its interest is the early settlement fee
+_SNAPSHOT_SETTLEMENTS_QUERY = f"""
+    INSERT INTO early_settlements (loan_id, settlement_id, fee, paid_by_date, branch_id, loan_officer_id, unpaid_id)
+    SELECT s.loan_id, s.id, COALESCE(s.interest, 0), s.paid_by_date, l.branch_id, l.loan_officer_id,
+           (SELECT u.id
+            FROM loan_repayment_schedules u
+            WHERE u.loan_id = s.loan_id AND ({_INSTALLMENT_OUTSTANDING}) > 0
+            ORDER BY u.installment ASC
+            LIMIT 1)
+    FROM (
+        SELECT lrs.id, lrs.loan_id, lrs.interest, lrs.paid_by_date,
+               ROW_NUMBER() OVER (PARTITION BY lrs.loan_id ORDER BY lrs.installment DESC) AS rn
+        FROM loan_repayment_schedules lrs
+        JOIN early_settled_loan_ids e ON e.loan_id = lrs.loan_id
+    ) s
+    JOIN loans l ON l.id = s.loan_id
+    WHERE s.rn = 1"""
+
+_DELETE_SETTLEMENT_TRANSACTIONS_QUERY = """
+    DELETE lt FROM loan_transactions lt
+    JOIN early_settlements es ON lt.repayment_schedule_id = es.settlement_id"""
+
+# Totals exclude the settlement installment, which is deleted below; balances come from
+# each loan's latest remaining transaction
+_SNAPSHOT_TOTALS_QUERY = """
+    UPDATE early_settlements es
+    SET total_principal = COALESCE((SELECT SUM(s.principal) FROM loan_repayment_schedules s
+                                    WHERE s.loan_id = es.loan_id AND s.id >= es.unpaid_id AND s.id <> es.settlement_id), 0),
+        total_interest = COALESCE((SELECT SUM(s.interest) FROM loan_repayment_schedules s
+                                   WHERE s.loan_id = es.loan_id AND s.id >= es.unpaid_id AND s.id <> es.settlement_id), 0),
+        last_principal_balance = COALESCE((SELECT t.principal_balance FROM loan_transactions t
+                                           WHERE t.loan_id = es.loan_id ORDER BY t.id DESC LIMIT 1), 0),
+        last_interest_balance = COALESCE((SELECT t.interest_balance FROM loan_transactions t
+                                          WHERE t.loan_id = es.loan_id ORDER BY t.id DESC LIMIT 1), 0),
+        last_fees_balance = COALESCE((SELECT t.fees_balance FROM loan_transactions t
+                                      WHERE t.loan_id = es.loan_id ORDER BY t.id DESC LIMIT 1), 0),
+        last_penalties_balance = COALESCE((SELECT t.penalties_balance FROM loan_transactions t
+                                           WHERE t.loan_id = es.loan_id ORDER BY t.id DESC LIMIT 1), 0)
+    WHERE es.unpaid_id IS NOT NULL"""
+
+_APPLY_SETTLEMENT_QUERIES = (
+    # The first unpaid installment carries the early settlement fee
+    """
+    UPDATE loan_repayment_schedules lrs
+    JOIN early_settlements es ON lrs.id = es.unpaid_id
+    SET lrs.fees = es.fee,
+        lrs.fees_repaid_derived = es.fee,
+        lrs.is_early_repayment = TRUE""",
+    """
+    DELETE lrs FROM loan_repayment_schedules lrs
+    JOIN early_settlements es ON lrs.id = es.settlement_id
+    WHERE es.unpaid_id IS NOT NULL""",
+    """
+    UPDATE loans l
+    JOIN early_settlements es ON l.id = es.loan_id
+    SET l.loan_term = l.loan_term - 1,
+        l.status = 'closed'
+    WHERE es.unpaid_id IS NOT NULL""",
+    # Installments from the first unpaid one to the last are paid off
+    """
+    UPDATE loan_repayment_schedules lrs
+    JOIN early_settlements es ON lrs.loan_id = es.loan_id AND lrs.id >= es.unpaid_id
+    SET lrs.principal_repaid_derived = lrs.principal,
+        lrs.interest_waived_derived = lrs.interest,
+        lrs.paid_by_date = es.paid_by_date,
+        lrs.status = 'payoff'""",
+    # Early Settlement Fee (15)
+    """
+    INSERT INTO loan_transactions (
+        loan_id, amount, debit, loan_transaction_type_id, created_at, updated_at, submitted_on,
+        branch_id, loan_officer_id, principal_balance, interest_balance, fees_balance,
+        penalties_balance, total_balance, description)
+    SELECT es.loan_id, es.fee, es.fee, 15, COALESCE(es.paid_by_date, CURRENT_DATE),
+           COALESCE(es.paid_by_date, CURRENT_DATE), COALESCE(es.paid_by_date, CURRENT_DATE),
+           es.branch_id, es.loan_officer_id, es.last_principal_balance, es.last_interest_balance,
+           es.last_fees_balance + es.fee, es.last_penalties_balance,
+           es.last_principal_balance + es.last_interest_balance + es.last_fees_balance + es.fee + es.last_penalties_balance,
+           'Apply Early Settlement Fee'
+    FROM early_settlements es
+    WHERE es.unpaid_id IS NOT NULL AND es.fee > 0
+    ORDER BY es.loan_id""",
+    # Early Settlement (14) of the remaining principal plus the fee
     """
-    Handle early settlement for a loan by reversing any existing settlement and applying a new one.
+    INSERT INTO loan_transactions (
+        loan_id, amount, credit, principal_repaid_derived, fees_repaid_derived, loan_transaction_type_id,
+        created_at, updated_at, submitted_on, branch_id, loan_officer_id, principal_balance,
+        interest_balance, fees_balance, penalties_balance, total_balance, description)
+    SELECT es.loan_id, es.total_principal + es.fee, es.total_principal + es.fee, es.total_principal, es.fee, 14,
+           COALESCE(es.paid_by_date, CURRENT_DATE), COALESCE(es.paid_by_date, CURRENT_DATE),
+           COALESCE(es.paid_by_date, CURRENT_DATE), es.branch_id, es.loan_officer_id, 0,
+           es.last_interest_balance, 0, es.last_penalties_balance,
+           es.last_interest_balance + es.last_penalties_balance, 'Early settlement'
+    FROM early_settlements es
+    WHERE es.unpaid_id IS NOT NULL AND es.total_principal + es.fee > 0
+    ORDER BY es.loan_id""",
+    # Waive Interest (4) of the remaining interest
+    """
+    INSERT INTO loan_transactions (
+        loan_id, amount, credit, interest_repaid_derived, loan_transaction_type_id, created_at, updated_at,
+        submitted_on, branch_id, loan_officer_id, principal_balance, interest_balance, fees_balance,
+        penalties_balance, total_balance, description)
+    SELECT es.loan_id, es.total_interest, es.total_interest, es.total_interest, 4,
+           COALESCE(es.paid_by_date, CURRENT_DATE), COALESCE(es.paid_by_date, CURRENT_DATE),
+           COALESCE(es.paid_by_date, CURRENT_DATE), es.branch_id, es.loan_officer_id, 0, 0, 0,
+           es.last_penalties_balance, 0, 'Waive Interest'
+    FROM early_settlements es
+    WHERE es.unpaid_id IS NOT NULL AND es.total_interest > 0
+    ORDER BY es.loan_id""",
+)
+
+def handle_early_settlements(conn, loan_ids, logger=None):
+    """
+    Handle early settlement for many loans at once with set-based statements.
+    
+    For every loan this:
+    1. Snapshots the last installment (settlement installment) and the first unpaid installment
+    2. Deletes the transactions of the settlement installment
+    3. Applies the settlement installment's interest as fees to the first unpaid installment
+    4. Deletes the settlement installment, decreases the loan term by 1 and closes the loan
+    5. Marks the installments from the first unpaid one onwards as paid off
+    6. Creates the early settlement fee, early settlement and interest waiver transactions
     
-    This function:
-    1. Identifies and saves the values from the last installment (settlement installment)
-    2. Deletes the settlement installment
-    3. Decreases the loan term by 1
-    4. Applies the settlement amount as fees to the first unpaid installment
-    5. Marks that installment as an early settlement
-    6. Sets principal_repaid_derived and interest_waived_derived for all installments
-    7. Creates necessary transactions for early settlement
+    Each step is one statement over all loans, joined to a temporary snapshot table,
+    instead of ~10 statements per loan.
     
     Args:
         conn: Database connection
-        loan_id: ID of the loan to handle settlement for
+        loan_ids (list): IDs of the loans to handle settlement for
         logger (logging.Logger, optional): Logger instance for tracking progress
+        
+    Returns:
+        int: Number of loans that were settled
     """
     cursor = conn.cursor()
     
     try:
-        # Find the settlement installment (the last one)
-        message = f"Finding settlement installment for loan ID {loan_id}..."
-        if logger:
-            logger.info(message)
-        
-        query = """
-        SELECT lrs.id, lrs.principal, lrs.interest, lrs.paid_by_date, l.branch_id, l.loan_officer_id
-        FROM loan_repayment_schedules lrs
-        JOIN loans l ON lrs.loan_id = l.id
-        WHERE lrs.loan_id = %s 
-        ORDER BY lrs.installment DESC 
-        LIMIT 1
-        """
-        cursor.execute(query, (loan_id,))
-        settlement = cursor.fetchone()
-        
-        if not settlement:
-            message = f"No installments found for loan ID {loan_id}"
-            if logger:
-                logger.warning(message)
-            print(f"  {message}")
-            return
-            
-        settlement_id = settlement[0]
-        settlement_principal = float(settlement[1] or 0)
-        settlement_fee = float(settlement[2] or 0)  # This is actually the early settlement fee
-        settlement_paid_by_date = settlement[3]     # Save paid_by_date of the settlement installment
-        branch_id = settlement[4]                   # Get branch_id from the installment
-        loan_officer_id = settlement[5]             # Get loan_officer_id from the installment
-        
-        message = f"Found settlement installment ID {settlement_id} with principal={settlement_principal}, early settlement fee={settlement_fee}"
-        if logger:
-            logger.info(message)
-        print(f"  {message}")
-        
-        # Delete any transactions related to the settlement installment
-        delete_tx_query = "DELETE FROM loan_transactions WHERE repayment_schedule_id = %s"
-        cursor.execute(delete_tx_query, (settlement_id,))
-        deleted_count = cursor.rowcount
-        
-        message = f"Deleted {deleted_count} transactions associated with settlement installment ID {settlement_id}"
-        if logger:
-            logger.info(message)
-        print(f"  {message}")
-        
-        # Find the first unpaid installment
-        unpaid_query = """
-        SELECT id 
-        FROM loan_repayment_schedules 
-        WHERE loan_id = %s AND (
-            (COALESCE(principal, 0) + COALESCE(interest, 0) + COALESCE(fees, 0) + COALESCE(penalties, 0)) - 
-            (COALESCE(principal_repaid_derived, 0) + COALESCE(interest_repaid_derived, 0) + COALESCE(fees_repaid_derived, 0) + COALESCE(penalties_repaid_derived, 0)) -
-            (COALESCE(principal_written_off_derived, 0) + COALESCE(interest_written_off_derived, 0) + COALESCE(fees_written_off_derived, 0) + COALESCE(penalties_written_off_derived, 0)) -
-            (COALESCE(interest_waived_derived, 0) + COALESCE(fees_waived_derived, 0) + COALESCE(penalties_waived_derived, 0))
-        ) > 0
-        ORDER BY installment ASC
-        LIMIT 1
-        """
-        cursor.execute(unpaid_query, (loan_id,))
-        unpaid_result = cursor.fetchone()
-        
-        if not unpaid_result:
-            message = f"No unpaid installments found for loan ID {loan_id}"
-            if logger:
-                logger.warning(message)
-            print(f"  {message}")
-            return
-            
-        unpaid_installment_id = unpaid_result[0]
-        
-        message = f"Found first unpaid installment ID {unpaid_installment_id}"
-        if logger:
-            logger.debug(message)
-        print(f"  {message}")
-        
-        # Update the first unpaid installment to mark it as early settlement
-        # and add the settlement fee as fees
-        update_query = """
-        UPDATE loan_repayment_schedules
-        SET 
-            fees = %s,
-            fees_repaid_derived = %s,
-            is_early_repayment = TRUE
-        WHERE id = %s
-        """
-        cursor.execute(update_query, (settlement_fee, settlement_fee, unpaid_installment_id))
-        
-        message = f"Updated installment ID {unpaid_installment_id} with early settlement fee={settlement_fee}"
-        if logger:
-            logger.info(message)
-        print(f"  {message}")
-        
-        # Delete the settlement installment
-        delete_query = "DELETE FROM loan_repayment_schedules WHERE id = %s"
-        cursor.execute(delete_query, (settlement_id,))
-        
-        message = f"Removed early settlement installment ID {settlement_id}"
-        if logger:
-            logger.info(message)
-        print(f"  {message}")
-        
-        # Decrease loan term by 1
-        update_loan_query = """
-        UPDATE loans 
-        SET loan_term = loan_term - 1
-        WHERE id = %s
-        """
-        cursor.execute(update_loan_query, (loan_id,))
-        
-        message = f"Decreased loan term by 1 for loan ID {loan_id}"
+        # The first unpaid installment is a per-loan probe; creating the index commits, so do it first
+        ensure_index(cursor, "loan_repayment_schedules", "loan_id", logger=logger)
+        for statement in _EARLY_SETTLEMENT_SETUP:
+            cursor.execute(statement)
+        cursor.executemany(
+            "INSERT INTO early_settled_loan_ids (loan_id) VALUES (%s)",
+            [(loan_id,) for loan_id in dict.fromkeys(loan_ids)]
+        )
+        
+        cursor.execute(_SNAPSHOT_SETTLEMENTS_QUERY)
+        found = cursor.rowcount
+        message = f"Found settlement installments for {found} of {len(loan_ids)} loans"
         if logger:
             logger.info(message)
         print(f"  {message}")
         
-        # APPLY EARLY SETTLEMENT PART
-        
-        # Set principal_repaid_derived, interest_waived_derived, and paid_by_date for installments from the early settled one to the last one
-        update_all_installments_query = """
-        UPDATE loan_repayment_schedules
-        SET 
-            principal_repaid_derived = principal,
-            interest_waived_derived = interest,
-            paid_by_date = %s,
-            status = 'payoff'
-        WHERE loan_id = %s AND id >= %s
-        """
-        cursor.execute(update_all_installments_query, (settlement_paid_by_date, loan_id, unpaid_installment_id))
-        
-        message = f"Updated all installments for loan ID {loan_id} with principal_repaid_derived, interest_waived_derived, paid_by_date, and status='payoff'"
+        cursor.execute(_DELETE_SETTLEMENT_TRANSACTIONS_QUERY)
+        message = f"Deleted {cursor.rowcount} transactions associated with settlement installments"
         if logger:
             logger.info(message)
         print(f"  {message}")
         
-        # Get total principal and interest for creating transactions
-        totals_query = """
-        SELECT 
-            SUM(principal) as total_principal,
-            SUM(interest) as total_interest
-        FROM loan_repayment_schedules
-        WHERE loan_id = %s AND id >= %s
-        """
-        cursor.execute(totals_query, (loan_id, unpaid_installment_id))
-        totals = cursor.fetchone()
-        
-        if not totals:
-            message = f"Could not calculate totals for loan ID {loan_id}"
+        cursor.execute("SELECT loan_id FROM early_settlements WHERE unpaid_id IS NULL")
+        unpaid_missing = [row[0] for row in cursor.fetchall()]
+        if unpaid_missing:
+            message = f"No unpaid installments found for {len(unpaid_missing)} loans: {unpaid_missing}"
             if logger:
                 logger.warning(message)
             print(f"  {message}")
-            return
-            
-        total_principal = float(totals[0] or 0)
-        total_interest = float(totals[1] or 0)
-        
-        # Get the latest transaction to use as reference for balances
-        last_tx_query = """
-        SELECT principal_balance, interest_balance, fees_balance, penalties_balance
-        FROM loan_transactions
-        WHERE loan_id = %s
-        ORDER BY id DESC
-        LIMIT 1
-        """
-        cursor.execute(last_tx_query, (loan_id,))
-        last_tx = cursor.fetchone()
-        
-        # Set default balances to 0 if no previous transaction exists
-        last_principal_balance = float(last_tx[0] or 0) if last_tx else 0
-        last_interest_balance = float(last_tx[1] or 0) if last_tx else 0
-        last_fees_balance = float(last_tx[2] or 0) if last_tx else 0
-        last_penalties_balance = float(last_tx[3] or 0) if last_tx else 0
-        
-        message = f"Last transaction balances - Principal: {last_principal_balance}, Interest: {last_interest_balance}, Fees: {last_fees_balance}, Penalties: {last_penalties_balance}"
-        if logger:
-            logger.debug(message)
-        print(f"  {message}")
         
-        # Get current date for transactions or use settlement date if available
-        transaction_date = settlement_paid_by_date if settlement_paid_by_date else datetime.now().strftime('%Y-%m-%d')
-        transaction_datetime = datetime.strptime(transaction_date, '%Y-%m-%d') if isinstance(transaction_date, str) else transaction_date
-        
-        # Create transaction for early settlement fee
-        if settlement_fee > 0:
-            # For fee transaction, increase the fees balance
-            new_fees_balance = last_fees_balance + settlement_fee
-            
-            fee_tx_data = {
-                "loan_id": loan_id,
-                "amount": settlement_fee,
-                "debit": settlement_fee,
-                "loan_transaction_type_id": 15,  # Early Settlement Fee
-                "created_at": transaction_datetime,
-                "updated_at": transaction_datetime,
-                "submitted_on": transaction_datetime,
-                "branch_id": branch_id,
-                "loan_officer_id": loan_officer_id,
-                "principal_balance": last_principal_balance,
-                "interest_balance": last_interest_balance,
-                "fees_balance": new_fees_balance,
-                "penalties_balance": last_penalties_balance,
-                "total_balance": last_principal_balance + last_interest_balance + new_fees_balance + last_penalties_balance,
-                "description": "Apply Early Settlement Fee"
-            }
-            
-            insert_record(cursor, "loan_transactions", fee_tx_data, logger)
-            
-            # Update last balances for next transaction
-            last_fees_balance = new_fees_balance
-            
-            message = f"Created early settlement fee transaction for loan ID {loan_id} with amount {settlement_fee}"
-            if logger:
-                logger.info(message)
-            print(f"  {message}")
-        
-        # Create transaction for early settlement (principal + fees)
-        total_settlement_amount = total_principal + settlement_fee
-        if total_settlement_amount > 0:
-            # For settlement transaction, reduce principal and fees balances
-            new_principal_balance = 0 #last_principal_balance - total_principal
-            new_fees_balance = 0 # last_fees_balance - settlement_fee
-            
-            settlement_tx_data = {
-                "loan_id": loan_id,
-                "amount": total_settlement_amount,
-                "credit": total_settlement_amount,
-                "principal_repaid_derived": total_principal,
-                "fees_repaid_derived": settlement_fee,
-                "loan_transaction_type_id": 14,  # Early Settlement
-                "created_at": transaction_datetime,
-                "updated_at": transaction_datetime,
-                "submitted_on": transaction_datetime,
-                "branch_id": branch_id,
-                "loan_officer_id": loan_officer_id,
-                "principal_balance": new_principal_balance,
-                "interest_balance": last_interest_balance,
-                "fees_balance": new_fees_balance,
-                "penalties_balance": last_penalties_balance,
-                "total_balance": new_principal_balance + last_interest_balance + new_fees_balance + last_penalties_balance,
-                "description": "Early settlement"
-            }
-            
-            insert_record(cursor, "loan_transactions", settlement_tx_data, logger)
-            
-            # Update last balances for next transaction
-            last_principal_balance = new_principal_balance
-            last_fees_balance = new_fees_balance
-            
-            message = f"Created early settlement transaction for loan ID {loan_id} with amount {total_settlement_amount} (principal: {total_principal}, fees: {settlement_fee})"
-            if logger:
-                logger.info(message)
-            print(f"  {message}")
-        
-        # Create transaction for interest waiver
-        if total_interest > 0:
-            # For interest waiver, reduce interest balance
-            new_interest_balance = 0 # last_interest_balance - total_interest
-            
-            interest_tx_data = {
-                "loan_id": loan_id,
-                "amount": total_interest,
-                "credit": total_interest,
-                "interest_repaid_derived": total_interest,
-                "loan_transaction_type_id": 4,  # Waive Interest
-                "created_at": transaction_datetime,
-                "updated_at": transaction_datetime,
-                "submitted_on": transaction_datetime,
-                "branch_id": branch_id,
-                "loan_officer_id": loan_officer_id,
-                "principal_balance": 0, # last_principal_balance
-                "interest_balance": new_interest_balance,
-                "fees_balance": 0, # last_fees_balance,
-                "penalties_balance": last_penalties_balance,
-                # "total_balance": last_principal_balance + new_interest_balance + last_fees_balance + last_penalties_balance,
-                "total_balance": 0,
-                "description": "Waive Interest"
-            }
-            
-            insert_record(cursor, "loan_transactions", interest_tx_data, logger)
-            
-            message = f"Created interest waiver transaction for loan ID {loan_id} with amount {total_interest}"
-            if logger:
-                logger.info(message)
-            print(f"  {message}")
-        
-        # Update loan status to closed
-        update_loan_status_query = """
-        UPDATE loans 
-        SET status = 'closed' 
-        WHERE id = %s
-        """
-        cursor.execute(update_loan_status_query, (loan_id,))
-        
-        message = f"Updated loan status to closed for loan ID {loan_id}"
-        if logger:
-            logger.info(message)
-        print(f"  {message}")
+        cursor.execute(_SNAPSHOT_TOTALS_QUERY)
+        settled = found - len(unpaid_missing)
+        for statement in _APPLY_SETTLEMENT_QUERIES:
+            cursor.execute(statement)
         
+        for statement in _EARLY_SETTLEMENT_TEARDOWN:
+            cursor.execute(statement)
         conn.commit()
+        return settled
     except Exception as e:
         conn.rollback()
-        error_msg = f"Error handling early settlement for loan ID {loan_id}: {str(e)}"
+        error_msg = f"Error handling early settlement for {len(loan_ids)} loans: {str(e)}"
         if logger:
             logger.error(error_msg)
         print(f"  {error_msg}")
@@ -623,6 +438,52 @@ def handle_early_settlement(conn, loan_id, logger=None):
     finally:
         cursor.close()
 
+def join_non_empty(*parts, sep=", "):
+    """
+    Join the parts that are not empty or blank, e.g. the lines of an address.
+
+    Args:
+        *parts: Values to join, None and blank strings are skipped
+        sep (str, optional): Separator. Defaults to ", ".
+
+    Returns:
+        str: The joined parts, or None if all of them are empty
+    """
+    kept = []
+    for part in parts:
+        if part is None:
+            continue
+        text = part if isinstance(part, str) else str(part)
+        if text and not text.isspace():
+            kept.append(text)
+    return sep.join(kept) if kept else None
+
+def build_placeholder_application(loan_data, source_row):
+    """
+    Build the loan application record used as placeholder for a loan whose application doesn't exist.
+
+    Args:
+        loan_data (dict): The loan data being processed
+        source_row (dict): The original source row data
+
+    Returns:
+        dict: Column-value pairs of the placeholder application
+    """
+    return {
+        "client_id": loan_data.get("client_id"),
+        "loan_product_id": loan_data.get("loan_product_id"),
+        "branch_id": loan_data.get("branch_id"),
+        "loan_officer_id": loan_data.get("loan_officer_id"),
+        "created_by_id": loan_data.get("created_by_id"),
+        "amount": loan_data.get("approved_amount"),
+        "term": loan_data.get("term"),
+        "status": "approved",
+        "revolving_enabled": False,
+        "created_at": loan_data.get("created_at"),
+        "updated_at": loan_data.get("updated_at"),
+        "external_id": source_row.get("application_key")
+    }
+
 def create_placeholder_application(cursor, loan_data, source_row, logger=None):
     """
     Create a placeholder loan application when a loan references an application that doesn't exist.
@@ -638,26 +499,13 @@ def create_placeholder_application(cursor, loan_data, source_row, logger=None):
     """
     try:
         # Extract necessary data from loan
-        application_data = {
-            "client_id": loan_data.get("client_id"),
-            "loan_product_id": loan_data.get("loan_product_id"),
-            "branch_id": loan_data.get("branch_id"),
-            "loan_officer_id": loan_data.get("loan_officer_id"),
-            "created_by_id": loan_data.get("created_by_id"),
-            "amount": loan_data.get("approved_amount"),
-            "term": loan_data.get("term"),
-            "status": "approved",
-            "revolving_enabled": False,
-            "created_at": loan_data.get("created_at"),
-            "updated_at": loan_data.get("updated_at"),
-            "external_id": source_row.get("application_key")
-        }
+        application_data = build_placeholder_application(loan_data, source_row)
         
         # Insert the application record
         application_id = insert_record(cursor, "loan_applications", application_data, logger)
         
         if logger:
-            logger.info(f"Created placeholder application with ID: {application_id} for loan with external_id: {source_row.get('loan_key')}")
+            logger.info("Created placeholder application with ID: %s for loan with external_id: %s", application_id, source_row.get('loan_key'))
         
         return application_id
         
@@ -668,6 +516,88 @@ def create_placeholder_application(cursor, loan_data, source_row, logger=None):
         print(error_msg)
         return None
 
+def resolve_user_ids(cursor, names, emails, logger=None):
+    """
+    Resolve user IDs by name and by email in a single query.
+
+    Args:
+        cursor: Database cursor
+        names (set[str]): User names to look up
+        emails (set[str]): User emails to look up
+        logger (logging.Logger, optional): Logger instance
+
+    Returns:
+        tuple[dict, dict]: (name -> user ID, email -> user ID) for the users found. The first
+        matching user wins, like the single-row lookups it replaces.
+    """
+    names = [name for name in names if name is not None]
+    emails = [email for email in emails if email is not None]
+    by_name = {}
+    by_email = {}
+    if not names and not emails:
+        return by_name, by_email
+
+    conditions = []
+    params = []
+    if names:
+        conditions.append(f"name IN ({', '.join(['%s'] * len(names))})")
+        params.extend(names)
+    if emails:
+        conditions.append(f"email IN ({', '.join(['%s'] * len(emails))})")
+        params.extend(emails)
+    query = f"SELECT name, email, id FROM users WHERE {' OR '.join(conditions)} ORDER BY id"
+
+    if logger:
+        logger.debug("Resolving %s user names and %s emails", len(names), len(emails))
+    # MySQL compares case-insensitively and ignores trailing spaces, so map rows back to the requested values the same way
+    def normalize(value):
+        return str(value).lower().rstrip() if value is not None else None
+    requested_names = {normalize(name): name for name in names}
+    requested_emails = {normalize(email): email for email in emails}
+
+    cursor.execute(query, params)
+    for name, email, user_id in cursor.fetchall():
+        if normalize(name) in requested_names:
+            by_name.setdefault(requested_names[normalize(name)], user_id)
+        if normalize(email) in requested_emails:
+            by_email.setdefault(requested_emails[normalize(email)], user_id)
+
+    return by_name, by_email
+
+def get_client_profiles(cursor, client_ids, logger=None, chunk_size=1000):
+    """
+    Get the profiles of many clients at once, to copy them onto their loans.
+
+    Args:
+        cursor: Destination database cursor
+        client_ids (iterable): IDs of the clients, None is ignored
+        logger (logging.Logger, optional): Logger instance
+        chunk_size (int, optional): Maximum number of client IDs per query. Defaults to 1000.
+
+    Returns:
+        dict: client ID -> list of (id, document_type_id, document_id, career) tuples, for the clients
+            that have profiles. None if a query failed.
+    """
+    client_ids = [client_id for client_id in dict.fromkeys(client_ids) if client_id is not None]
+    profiles = {}
+    for start in range(0, len(client_ids), chunk_size):
+        chunk = client_ids[start:start + chunk_size]
+        query = (
+            "SELECT profileable_id, id, document_type_id, document_id, career FROM profiles "
+            f"WHERE profileable_type = %s AND profileable_id IN ({', '.join(['%s'] * len(chunk))})"
+        )
+        try:
+            cursor.execute(query, (CLIENT_MODEL_TYPE, *chunk))
+            for client_id, *profile in cursor.fetchall():
+                profiles.setdefault(client_id, []).append(tuple(profile))
+        except Exception as e:
+            error_msg = f"Error getting profiles of {len(chunk)} clients: {str(e)}"
+            if logger:
+                logger.error(error_msg)
+            print(error_msg)
+            return None
+    return profiles
+
 def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | None:
     """
     Parses a SPECIFIC non-standard SQL Server geography Point hex string or binary data.
@@ -684,7 +614,7 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
     NOT handle the standard '...010C...' format.
 
     Args:
-        wkb_data: The WKB data, either as hex string or binary bytes
+        wkb_data: The WKB data, either as hex string or binary bytes (bytes, bytearray or memoryview)
         logger: Optional logger for debugging
 
     Returns:
@@ -695,18 +625,15 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
         ValueError: If the hex string contains non-hexadecimal characters or
                     has an odd number of digits (after removing '0x').
     """
-    import binascii
-    import struct
-    
-    # Handle binary input
-    if isinstance(wkb_data, bytes):
+    # Handle binary input, memoryview and bytearray buffers are read in place
+    if isinstance(wkb_data, (bytes, bytearray, memoryview)):
         if logger:
-            logger.debug(f"Processing binary WKB data of length {len(wkb_data)}")
+            logger.debug("Processing binary WKB data of length %s", len(wkb_data))
         binary_data = wkb_data
     # Handle string input
     elif isinstance(wkb_data, str):
         if logger:
-            logger.debug(f"Processing WKB hex string: {wkb_data[:20]}...")
+            logger.debug("Processing WKB hex string: %s...", wkb_data[:20])
 
         if wkb_data.startswith('0x') or wkb_data.startswith('0X'):
             wkb_data = wkb_data[2:]
@@ -714,11 +641,10 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
                 logger.debug("Removed '0x' prefix from hex string.")
 
         # Specific non-standard prefix observed in the user example
-        specific_prefix = "E6100000010F"
-        if not wkb_data.startswith(specific_prefix):
+        if not wkb_data.startswith(WKB_POINT_PREFIX):
             if logger:
-                logger.warning(f"Input string does not start with the specific prefix '{specific_prefix}' this function handles.")
-            print(f"Error: Input string does not start with the specific prefix '{specific_prefix}' this function handles.")
+                logger.warning("Input string does not start with the specific prefix '%s' this function handles.", WKB_POINT_PREFIX)
+            print(f"Error: Input string does not start with the specific prefix '{WKB_POINT_PREFIX}' this function handles.")
             return None
 
         # Check minimum length for Header(6) + Lat(8) + Lon(8) = 22 bytes = 44 hex chars
@@ -726,7 +652,7 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
         min_len = 76
         if len(wkb_data) < min_len:
             if logger:
-                logger.warning(f"Hex string is too short: {len(wkb_data)} chars. Need at least {min_len} characters.")
+                logger.warning("Hex string is too short: %s chars. Need at least %s characters.", len(wkb_data), min_len)
             print(f"Error: Hex string is too short for the assumed '0F' structure (Header + 4 Doubles). Need at least {min_len} characters.")
             return None
 
@@ -734,7 +660,7 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
             # Convert hex string to bytes
             binary_data = binascii.unhexlify(wkb_data)
             if logger:
-                logger.debug(f"Successfully converted hex to {len(binary_data)} bytes of binary data.")
+                logger.debug("Successfully converted hex to %s bytes of binary data.", len(binary_data))
         except ValueError as e:
             # Catches errors from unhexlify (odd length, non-hex)
             if logger:
@@ -749,42 +675,31 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
 
     try:
         # Check if we have enough data for the coordinates
-        if len(binary_data) < 22:  # Need at least header + lat + lon
+        if len(binary_data) < WKB_POINT_SIZE:  # Need at least header + lat + lon
             if logger:
                 logger.error(f"Binary data too short: {len(binary_data)} bytes")
             print(f"Error: Binary data too short: {len(binary_data)} bytes")
             return None
             
-        # Extract bytes based on the ASSUMED structure for this '0F' variant:
+        # Unpack based on the ASSUMED structure for this '0F' variant, as little-endian doubles:
         # Bytes 6-13 : Assumed Latitude (Double 1)
         # Bytes 14-21: Assumed Longitude (Double 2)
-        lat_bytes = binary_data[6:14]
-        lon_bytes = binary_data[14:22]
-
-        if len(lon_bytes) != 8 or len(lat_bytes) != 8:
-            if logger:
-                logger.error("Could not extract 8 bytes for assumed Latitude and Longitude.")
-            print("Error: Could not extract 8 bytes for assumed Latitude and Longitude.")
-            return None
-
-        # Unpack as little-endian doubles ('<d')
-        latitude = struct.unpack('<d', lat_bytes)[0]
-        longitude = struct.unpack('<d', lon_bytes)[0]
+        latitude, longitude = _WKB_LAT_LON.unpack_from(binary_data)
         if logger:
-            logger.debug(f"Unpacked coordinates: Latitude={latitude}, Longitude={longitude}")
+            logger.debug("Unpacked coordinates: Latitude=%s, Longitude=%s", latitude, longitude)
 
         # Optional: Basic validation print
         if not (-90 <= latitude <= 90):
             if logger:
-                logger.warning(f"Parsed Latitude ({latitude}) is outside valid range [-90, 90].")
+                logger.warning("Parsed Latitude (%s) is outside valid range [-90, 90].", latitude)
             print(f"Warning: Parsed Latitude ({latitude}) is outside valid range [-90, 90].")
         if not (-180 <= longitude <= 180):
             if logger:
-                logger.warning(f"Parsed Longitude ({longitude}) outside valid range [-180, 180].")
+                logger.warning("Parsed Longitude (%s) outside valid range [-180, 180].", longitude)
             print(f"Warning: Parsed Longitude ({longitude}) outside valid range [-180, 180].")
 
         if logger:
-            logger.info(f"Successfully extracted coordinates: Latitude={latitude}, Longitude={longitude}")
+            logger.info("Successfully extracted coordinates: Latitude=%s, Longitude=%s", latitude, longitude)
         return latitude, longitude
 
     except (struct.error, IndexError) as e:
@@ -792,3 +707,60 @@ def extract_lat_lon_from_wkb(wkb_data, logger=None) -> tuple[float, float] | Non
             logger.error(f"Error parsing binary data structure: {str(e)}")
         print(f"Error parsing binary data structure: {e}")
         return None
+
+
+def extract_lat_lon_batch(wkb_values, logger=None) -> list[tuple[float, float] | None]:
+    """
+    Parse many SQL Server geography points at once, with the layout assumed by extract_lat_lon_from_wkb.
+
+    Well-formed values are sliced to their first 22 bytes, joined into one buffer and decoded in a
+    single NumPy pass (or one struct pass when NumPy is not installed). Anything else, and points
+    whose coordinates fall outside the valid ranges, goes through extract_lat_lon_from_wkb so it
+    reports the problem exactly as before.
+
+    Args:
+        wkb_values (list): WKB data, each either a hex string or binary bytes
+        logger: Optional logger for debugging
+
+    Returns:
+        list: (latitude, longitude) per input value, or None where parsing failed
+    """
+    results = [None] * len(wkb_values)
+    fast_indexes = []
+    chunks = []
+    for index, wkb_data in enumerate(wkb_values):
+        if isinstance(wkb_data, (bytes, bytearray, memoryview)) and len(wkb_data) >= WKB_POINT_SIZE:
+            chunks.append(wkb_data[:WKB_POINT_SIZE])
+            fast_indexes.append(index)
+        elif isinstance(wkb_data, str):
+            hex_data = wkb_data[2:] if wkb_data[:2] in ('0x', '0X') else wkb_data
+            # Same minimum length check as the per-row parser (header + 4 doubles)
+            if hex_data.startswith(WKB_POINT_PREFIX) and len(hex_data) >= 76:
+                try:
+                    chunks.append(binascii.unhexlify(hex_data[:WKB_POINT_SIZE * 2]))
+                    fast_indexes.append(index)
+                except ValueError:
+                    pass
+
+    if chunks:
+        buffer = b"".join(chunks)
+        if NUMPY_AVAILABLE:
+            points = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, WKB_POINT_SIZE)
+            latitudes = points[:, 6:14].copy().view('<f8').ravel().tolist()
+            longitudes = points[:, 14:22].copy().view('<f8').ravel().tolist()
+            coordinates = zip(latitudes, longitudes)
+        else:
+            coordinates = (_WKB_LAT_LON.unpack_from(buffer, offset) for offset in range(0, len(buffer), WKB_POINT_SIZE))
+        for index, (latitude, longitude) in zip(fast_indexes, coordinates):
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                results[index] = (latitude, longitude)
+
+    fallback = 0
+    for index, wkb_data in enumerate(wkb_values):
+        if results[index] is None and wkb_data:
+            results[index] = extract_lat_lon_from_wkb(wkb_data, logger=logger)
+            fallback += 1
+
+    if logger:
+        logger.debug("Parsed %s geography points in bulk, %s one by one", len(chunks), fallback)
+    return results
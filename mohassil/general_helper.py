@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import atexit
 import csv
+import queue
+import threading
 from collections import defaultdict
+from functools import lru_cache
+from itertools import groupby
 
 import mysql.connector
 import pyodbc
@@ -13,6 +18,63 @@ try:
 except ImportError:
     PYMSSQL_AVAILABLE = False
 
+# Running SSH tunnels shared by every connection to the same remote, with how many connections use each
+_TUNNELS = {}
+
+def open_tunnel(ssh_host, ssh_user, ssh_password, remote_host, remote_port):
+    """
+    Get a running SSH tunnel to a remote database, reusing an open one instead of negotiating a new SSH session.
+
+    Args:
+        ssh_host (str): SSH server
+        ssh_user (str): SSH user name
+        ssh_password (str): SSH password, or None
+        remote_host (str): Database host as seen from the SSH server
+        remote_port (int): Database port as seen from the SSH server
+
+    Returns:
+        SSHTunnelForwarder: Started tunnel, to be given back with release_tunnel
+    """
+    key = (ssh_host, ssh_user, remote_host, remote_port)
+    entry = _TUNNELS.get(key)
+    if entry and entry[0].is_active:
+        entry[1] += 1
+        return entry[0]
+
+    tunnel = SSHTunnelForwarder(
+        (ssh_host, 22),
+        ssh_username=ssh_user,
+        ssh_password=ssh_password if ssh_password else None,
+        ssh_pkey=False,
+        host_pkey_directories=[],
+        remote_bind_address=(remote_host, remote_port)
+    )
+    tunnel.start()
+    _TUNNELS[key] = [tunnel, 1]
+    return tunnel
+
+def release_tunnel(tunnel):
+    """
+    Give back a tunnel from open_tunnel, stopping it once no connection uses it anymore.
+
+    Args:
+        tunnel (SSHTunnelForwarder): Tunnel to release
+    """
+    for key, entry in _TUNNELS.items():
+        if entry[0] is tunnel:
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del _TUNNELS[key]
+            break
+    tunnel.stop()
+
+@atexit.register
+def _close_tunnels():
+    for tunnel, _ in list(_TUNNELS.values()):
+        tunnel.stop()
+    _TUNNELS.clear()
+
 # Modify the test_connection function to use pymssql
 def test_connection(conn_details):
     """Test database connection with the provided details."""
@@ -32,17 +94,9 @@ def test_connection(conn_details):
         mysql_port = 3306
         port = sql_server_port if db_type == "sqlserver" else mysql_port
         
-        # Set up SSH tunnel if needed
+        # Set up SSH tunnel if needed, sharing one already open to the same database
         if ssh_host and ssh_user:
-            tunnel = SSHTunnelForwarder(
-                (ssh_host, 22),
-                ssh_username=ssh_user,
-                ssh_password=ssh_password if ssh_password else None,
-                ssh_pkey=False,
-                host_pkey_directories=[],
-                remote_bind_address=(host, port)
-            )
-            tunnel.start()
+            tunnel = open_tunnel(ssh_host, ssh_user, ssh_password, host, port)
             host = "127.0.0.1"
             port = tunnel.local_bind_port
         
@@ -84,7 +138,7 @@ def test_connection(conn_details):
     except Exception as e:
         print(f"Connection Error: {e}")
         if tunnel:
-            tunnel.stop()
+            release_tunnel(tunnel)
         return None
 
 def get_db_connection_details(prompt_message):
@@ -177,22 +231,59 @@ def load_migration_config(file_path):
     """
     migrations = defaultdict(list)
 
-    with open(file_path, mode="r") as file:
-        reader = csv.DictReader(file)
+    with open(file_path, mode="r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None) or []
 
         # Validate the presence of required headers
         required_headers = {"migration_name", "source_table", "source_column", "target_table", "target_column"}
-        if not required_headers.issubset(reader.fieldnames):
+        if not required_headers.issubset(header):
             raise ValueError(f"CSV file is missing one or more required headers: {required_headers}")
 
-        # Process each row and group by migration_name
+        # Resolve the column positions once instead of building a dict per row
+        migration_idx, source_table_idx, source_column_idx, target_table_idx, target_column_idx = (
+            header.index(name) for name in
+            ("migration_name", "source_table", "source_column", "target_table", "target_column"))
+        width = len(header)
+
+        # Process each row and group by migration_name, skipping blank lines and padding short rows like DictReader
         for row in reader:
-            migrations[row["migration_name"]].append(
-                {"source_table": row["source_table"], "source_column": row["source_column"],
-                    "target_table": row["target_table"], "target_column": row["target_column"]})
+            if not row:
+                continue
+            if len(row) < width:
+                row += [None] * (width - len(row))
+            migrations[row[migration_idx]].append(
+                {"source_table": row[source_table_idx], "source_column": row[source_column_idx],
+                    "target_table": row[target_table_idx], "target_column": row[target_column_idx]})
 
     return migrations
 
+@lru_cache(maxsize=None)
+def build_insert_query(table, columns):
+    """
+    Build the parameterized INSERT statement for a table and column tuple.
+    The statement only depends on the schema, so it is built once and reused for every record.
+    Args:
+        table (str): Table name
+        columns (tuple[str]): Column names, in placeholder order
+    Returns:
+        str: INSERT statement with one %s placeholder per column
+    """
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+@lru_cache(maxsize=None)
+def build_select_by_id_query(table, columns, id_name="id"):
+    """
+    Build the parameterized SELECT of some columns of one record, built once per table and column tuple.
+    Args:
+        table (str): Table name
+        columns (tuple[str]): Column names to select
+        id_name (str): Name of the ID column
+    Returns:
+        str: SELECT statement with one %s placeholder for the ID
+    """
+    return f"SELECT {', '.join(columns)} FROM {table} WHERE {id_name} = %s"
+
 def insert_record(cursor, table, data, logger=None):
     """
     Insert a record into the specified table and return the inserted ID.
@@ -204,21 +295,222 @@ def insert_record(cursor, table, data, logger=None):
     Returns:
         int: ID of the inserted record
     """
-    columns = list(data.keys())
-    placeholders = ", ".join(["%s"] * len(columns))
-    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    query = build_insert_query(table, tuple(data))
     
     if logger:
-        logger.debug(f"Executing insert query on {table}: {query}")
+        logger.debug("Executing insert query on %s: %s", table, query)
     
     cursor.execute(query, list(data.values()))
     last_id = cursor.lastrowid
     
     if logger:
-        logger.debug(f"Inserted record in {table} with ID: {last_id}")
+        logger.debug("Inserted record in %s with ID: %s", table, last_id)
     
     return last_id
 
+def insert_records(cursor, table, rows, logger=None):
+    """
+    Insert many records into the specified table with a single executemany call.
+    Args:
+        cursor: Database cursor
+        table (str): Table name
+        rows (list[dict]): Dictionaries of column-value pairs, all with the same columns
+        logger (logging.Logger, optional): Logger instance
+    Returns:
+        list[int]: IDs of the inserted records, in the order of rows
+    """
+    if not rows:
+        return []
+
+    columns = tuple(rows[0])
+    query = build_insert_query(table, columns)
+
+    if logger:
+        logger.debug("Executing bulk insert of %s rows on %s: %s", len(rows), table, query)
+
+    # mysql.connector sends this as one multi-row INSERT, whose lastrowid is the ID of the first row
+    cursor.executemany(query, [[row[column] for column in columns] for row in rows])
+    first_id = cursor.lastrowid
+
+    if logger:
+        logger.debug("Inserted %s records in %s starting at ID: %s", len(rows), table, first_id)
+
+    return list(range(first_id, first_id + len(rows)))
+
+def check_inserted_ids(cursor, table, ids, key_column, keys):
+    """
+    Make sure a bulk insert got the consecutive IDs it was assumed to get.
+    Multi-row inserts only hand out consecutive IDs when nothing else inserts concurrently.
+    Args:
+        cursor: Database cursor
+        table (str): Table the records were inserted into
+        ids (list[int]): Assumed IDs of the records
+        key_column (str): Column identifying the records
+        keys (list): key_column value of each record, in insert order
+    Raises:
+        RuntimeError: If the IDs belong to other records
+    """
+    cursor.execute(
+        f"SELECT id, {key_column} FROM {table} WHERE id BETWEEN %s AND %s ORDER BY id",
+        (ids[0], ids[-1])
+    )
+    inserted = [(record_id, str(key)) for record_id, key in cursor.fetchall()]
+    if inserted != [(record_id, str(key)) for record_id, key in zip(ids, keys)]:
+        raise RuntimeError(f"{table} ids {ids[0]}-{ids[-1]} were not assigned to this batch")
+
+def get_max_allowed_packet(cursor, default=4 * 1024 * 1024, logger=None):
+    """
+    Get the largest statement the MySQL server accepts.
+    Args:
+        cursor: Database cursor
+        default (int, optional): Size to assume if it cannot be read. Defaults to 4 MiB, the MySQL 8 default.
+        logger (logging.Logger, optional): Logger instance
+    Returns:
+        int: max_allowed_packet of the session in bytes
+    """
+    try:
+        cursor.execute("SELECT @@max_allowed_packet")
+        return int(cursor.fetchone()[0])
+    except Exception as e:
+        if logger:
+            logger.warning("Could not read max_allowed_packet, assuming %s bytes: %s", default, e)
+        return default
+
+def split_batches(rows, batch_size, max_bytes=None):
+    """
+    Split records into batches of at most batch_size records and, optionally, of an estimated size of at
+    most max_bytes once sent as one multi-row INSERT.
+    Args:
+        rows (list[dict]): Dictionaries of column-value pairs
+        batch_size (int): Maximum number of records per batch
+        max_bytes (int, optional): Maximum estimated size of the values of a batch
+    Yields:
+        list[dict]: Consecutive records of rows
+    """
+    if not max_bytes:
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+        return
+
+    batch = []
+    batch_bytes = 0
+    for row in rows:
+        # Quotes, separator and escaping included, a value takes about twice its string length
+        row_bytes = sum(2 * len(str(value)) + 4 for value in row.values())
+        if batch and (len(batch) >= batch_size or batch_bytes + row_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(row)
+        batch_bytes += row_bytes
+    if batch:
+        yield batch
+
+def insert_records_batched(cursor, table, rows, batch_size=1000, key_column=None, logger=None, max_bytes=None):
+    """
+    Insert records with one multi-row INSERT per batch of consecutive records sharing the same columns.
+    A batch that fails is rolled back to a savepoint and inserted one record at a time, so only the
+    failing records are lost.
+    Args:
+        cursor: Database cursor
+        table (str): Table name
+        rows (list[dict]): Dictionaries of column-value pairs, in insert order
+        batch_size (int, optional): Maximum number of records per INSERT. Defaults to 1000.
+        key_column (str, optional): Column identifying the records. If the records have it, the IDs
+            assumed from each multi-row INSERT are checked against it.
+        logger (logging.Logger, optional): Logger instance
+        max_bytes (int, optional): Maximum estimated size of the values of one INSERT, so that it fits in
+            the server's max_allowed_packet instead of being rejected and retried one record at a time
+    Returns:
+        list[tuple]: (ID, None) for each inserted record and (None, exception) for each record that
+            could not be inserted, in the order of rows
+    """
+    results = []
+    for columns, group in groupby(rows, key=tuple):
+        for batch in split_batches(list(group), batch_size, max_bytes):
+            cursor.execute("SAVEPOINT insert_batch")
+            try:
+                ids = insert_records(cursor, table, batch, logger)
+                if key_column in columns:
+                    check_inserted_ids(cursor, table, ids, key_column, [row[key_column] for row in batch])
+                cursor.execute("RELEASE SAVEPOINT insert_batch")
+                results.extend((record_id, None) for record_id in ids)
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_batch")
+                if logger:
+                    logger.warning("Bulk insert of %s records in %s failed, inserting them one by one: %s", len(batch), table, e)
+                for row in batch:
+                    try:
+                        results.append((insert_record(cursor, table, row, logger), None))
+                    except Exception as row_e:
+                        results.append((None, row_e))
+    return results
+
+def fetch_batches(cursor, batch_size=1000):
+    """
+    Stream the result set of an executed query in batches instead of fetching it all at once.
+    Args:
+        cursor: Database cursor the query was executed on
+        batch_size (int, optional): Maximum number of rows per batch. Defaults to 1000.
+    Yields:
+        tuple: (index of the first row of the batch, list of rows)
+    """
+    batch_start = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch_start, batch
+        batch_start += len(batch)
+
+def fetch_batches_ahead(cursor, batch_size=1000, depth=2):
+    """
+    Stream the result set of an executed query in batches, fetching the next batches in a background
+    thread while the current one is processed. The cursor must not be used by anything else meanwhile.
+    Args:
+        cursor: Database cursor the query was executed on
+        batch_size (int, optional): Maximum number of rows per batch. Defaults to 1000.
+        depth (int, optional): Maximum number of batches fetched ahead. Defaults to 2.
+    Yields:
+        tuple: (index of the first row of the batch, list of rows)
+    """
+    batches = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer stopped, rather than waiting on a full queue forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in fetch_batches(cursor, batch_size):
+                if not put(item):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # The cursor is free again once the producer is done
+        stop.set()
+        producer.join()
+
 def get_record_details_by_id(cursor, table_name, record_id, columns, conn=None, logger=None, id_name="id"):
     """
     Get details for a specific record by its ID from any table.
@@ -255,11 +547,10 @@ def get_record_details_by_id(cursor, table_name, record_id, columns, conn=None,
             print(error_msg)
             return None
             
-        column_list = ", ".join(columns)
-        query = f"SELECT {column_list} FROM {table_name} WHERE {id_name} = %s"
+        query = build_select_by_id_query(table_name, tuple(columns), id_name)
         
         if logger:
-            logger.debug(f"Executing query: {query} with ID: {record_id}")
+            logger.debug("Executing query: %s with ID: %s", query, record_id)
             
         use_cursor.execute(query, (record_id,))
         result = use_cursor.fetchone()
@@ -269,7 +560,7 @@ def get_record_details_by_id(cursor, table_name, record_id, columns, conn=None,
             return dict(zip(columns, result))
         
         if logger:
-            logger.debug(f"No record found in {table_name} with {id_name}={record_id}")
+            logger.debug("No record found in %s with %s=%s", table_name, id_name, record_id)
         return None
         
     except Exception as e:
@@ -279,17 +570,61 @@ def get_record_details_by_id(cursor, table_name, record_id, columns, conn=None,
         print(error_msg)
         return None
 
-def get_record_value(table, condition, column, cursor=None, conn=None, logger=None):
+def get_records_by_ids(cursor, table_name, record_ids, columns, logger=None, id_name="id", chunk_size=1000):
+    """
+    Get details for many records at once, one IN (...) query per chunk of IDs.
+
+    Args:
+        cursor: Database cursor
+        table_name (str): The name of the table to query.
+        record_ids (iterable): The IDs of the records to fetch.
+        columns (list): A list of column names to select.
+        logger (logging.Logger, optional): Logger instance
+        id_name (str, optional): The name of the ID column. Defaults to "id".
+        chunk_size (int, optional): Maximum number of IDs per query. Defaults to 1000
+            to stay below SQL Server's parameter limit.
+
+    Returns:
+        dict: Mapping of each found ID (as returned by the database) to a dictionary of the requested columns,
+            or None if a query failed.
+    """
+    records = {}
+    record_ids = [record_id for record_id in dict.fromkeys(record_ids) if record_id is not None]
+    if not record_ids or not columns:
+        return records
+
+    column_list = ", ".join(columns)
+    for start in range(0, len(record_ids), chunk_size):
+        chunk = record_ids[start:start + chunk_size]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        query = f"SELECT {id_name}, {column_list} FROM {table_name} WHERE {id_name} IN ({placeholders})"
+        try:
+            if logger:
+                logger.debug("Executing query: %s with %s IDs", query, len(chunk))
+            cursor.execute(query, tuple(chunk))
+            for result in cursor.fetchall():
+                records[result[0]] = dict(zip(columns, result[1:]))
+        except Exception as e:
+            error_msg = f"Error getting details for {len(chunk)} records from {table_name}: {str(e)}"
+            if logger:
+                logger.error(error_msg)
+            print(error_msg)
+            return None
+
+    return records
+
+def get_record_value(table, condition, column, cursor=None, conn=None, logger=None, params=None):
     """
     Get any record value from any table based on a condition.
     
     Args:
         table (str): The table to query
-        condition (str): The WHERE condition (without the 'WHERE' keyword)
+        condition (str): The WHERE condition (without the 'WHERE' keyword), with %s placeholders when params is given
         column (str): The column name to return
         cursor: Database cursor to use (uses the connection's cursor if None)
         conn: Database connection to use if cursor is None
         logger (logging.Logger, optional): Logger instance
+        params (tuple, optional): Values bound to the placeholders of condition
         
     Returns:
         Any: The value of the specified column if found, None otherwise
@@ -308,7 +643,7 @@ def get_record_value(table, condition, column, cursor=None, conn=None, logger=No
             return None
         
         # For clients, we need to check with composite external_id
-        if table == "clients" and "external_id" in condition and "branch_id" in condition:
+        if params is None and table == "clients" and "external_id" in condition and "branch_id" in condition:
             parts = condition.split(" and ")
             external_id_part = next((p for p in parts if "external_id" in p), None)
             branch_id_part = next((p for p in parts if "branch_id" in p), None)
@@ -319,36 +654,93 @@ def get_record_value(table, condition, column, cursor=None, conn=None, logger=No
                 branch_id = branch_id_part.split("'")[1]
                 
                 # Get branch code from branch_id
-                branch_code_query = f"SELECT external_id FROM branches WHERE id = '{branch_id}' LIMIT 1"
-                use_cursor.execute(branch_code_query)
+                use_cursor.execute("SELECT external_id FROM branches WHERE id = %s LIMIT 1", (branch_id,))
                 branch_result = use_cursor.fetchone()
                 
                 if branch_result and len(branch_result) > 0:
                     branch_code = branch_result[0]
-                    # Create composite external_id
-                    composite_id = f"{branch_code}-{client_code}"
-                    # Update condition
-                    condition = f"external_id = '{composite_id}'"
+                    # Create composite external_id and look it up with a bound parameter
+                    condition = "external_id = %s"
+                    params = (f"{branch_code}-{client_code}",)
         
         query = f"SELECT {column} FROM {table} WHERE {condition} LIMIT 1"
-        use_cursor.execute(query)
+        if params is None:
+            use_cursor.execute(query)
+        else:
+            # The query text stays the same for every value, so the server can reuse its plan
+            use_cursor.execute(query, params)
         result = use_cursor.fetchone()
         
         if result and len(result) > 0:
             return result[0]
         else:
             if logger:
-                logger.debug(f"No record found in {table} where {condition}")
+                logger.debug("No record found in %s where %s %s", table, condition, params or '')
             return None
             
     except Exception as e:
-        error_msg = f"Error looking up record in {table} where {condition}: {str(e)}"
+        error_msg = f"Error looking up record in {table} where {condition} {params or ''}: {str(e)}"
         if logger:
             logger.error(error_msg)
         print(error_msg)
         return None
 
-def perform_cleanup(conn, table_name, condition=""):
+def ensure_index(cursor, table_name, column, logger=None):
+    """
+    Create an index on a column unless the table already has an index starting with it.
+    MySQL commits the open transaction when it creates an index, so call this before starting one.
+
+    Args:
+        cursor: Database cursor
+        table_name (str): The table to index
+        column (str): The column to index
+        logger (logging.Logger, optional): Logger instance
+
+    Returns:
+        bool: True if the index exists or was created, False on error
+    """
+    try:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s AND seq_in_index = 1 LIMIT 1",
+            (table_name, column)
+        )
+        if cursor.fetchone():
+            return True
+
+        index_name = f"{table_name}_{column}_index"
+        cursor.execute(f"CREATE INDEX {index_name} ON {table_name} ({column})")
+        message = f"Created index {index_name} on {table_name}({column})"
+        if logger:
+            logger.info(message)
+        print(message)
+        return True
+    except Exception as e:
+        error_msg = f"Error creating index on {table_name}({column}): {str(e)}"
+        if logger:
+            logger.error(error_msg)
+        print(error_msg)
+        return False
+
+def is_table_referenced(cursor, table_name):
+    """
+    Check whether a foreign key of the current database references a table.
+
+    Args:
+        cursor: Database cursor
+        table_name (str): Name of the table
+
+    Returns:
+        bool: True if at least one foreign key references the table
+    """
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE REFERENCED_TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME = %s",
+        (table_name,)
+    )
+    return cursor.fetchone()[0] > 0
+
+def perform_cleanup(conn, table_name, condition="", truncate=False):
     """
     Perform cleanup on the target table.
 
@@ -356,10 +748,18 @@ def perform_cleanup(conn, table_name, condition=""):
         conn: Database connection
         table_name (str): Name of the table to clean up
         condition (str): Optional WHERE clause for conditional cleanup
+        truncate (bool, optional): Empty the table with TRUNCATE instead of deleting its rows one by one.
+            Only applies without a condition. TRUNCATE commits implicitly and fails on tables referenced
+            by a foreign key.
     """
     cursor = conn.cursor()
 
     try:
+        if truncate and not condition:
+            cursor.execute(f"TRUNCATE TABLE {table_name}")
+            print(f"Truncated {table_name}")
+            return
+
         # Build the DELETE query with the optional condition
         query = f"DELETE FROM {table_name}"
         if condition:
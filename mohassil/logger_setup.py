@@ -1,5 +1,8 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime as dt
 
 def setup_logger(migration_name=None):
@@ -10,6 +13,12 @@ def setup_logger(migration_name=None):
     Returns:
         logging.Logger: Configured logger instance
     """
+    logger = logging.getLogger(migration_name or 'migration')
+    
+    # Reuse the handler and listener thread of an earlier call for the same logger
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
+    
     # Create logs directory if it doesn't exist
     log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
     os.makedirs(log_dir, exist_ok=True)
@@ -26,18 +35,24 @@ def setup_logger(migration_name=None):
     log_path = os.path.join(log_dir, log_filename)
     
     # Configure logger
-    logger = logging.getLogger(migration_name or 'migration')
     logger.setLevel(logging.INFO)
     
-    # Create file handler
-    file_handler = logging.FileHandler(log_path)
+    # Create file handler, the file is opened on the first record
+    file_handler = logging.FileHandler(log_path, delay=True)
     file_handler.setLevel(logging.INFO)
     
     # Create formatter
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     file_handler.setFormatter(formatter)
     
+    # Hand records to a background thread so file writes stay off the migration loop,
+    # and flush whatever is still queued when the process exits
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
     # Add handler to logger
-    logger.addHandler(file_handler)
+    logger.addHandler(QueueHandler(log_queue))
     
     return logger
\ No newline at end of file
@@ -9,6 +9,29 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Number of users inserted and committed per round trip
+INSERT_BATCH_SIZE = 500
+
+# Set role_id to 4 for every migrated user
+USER_ROLE_ID = 4
+
+# Above this many Excel rows all existing emails are loaded in one scan instead of looked up
+EMAIL_LOOKUP_THRESHOLD = 10000
+
+# Rows per page when streaming every existing email
+EMAIL_FETCH_SIZE = 10000
+
+# Maximum number of emails per IN (...) lookup
+EMAIL_LOOKUP_CHUNK_SIZE = 1000
+
+# Excel columns the migration reads, everything else in the sheet is skipped
+USER_COLUMNS = ['user_name', 'user_full_name', 'branch_name', 'start_date', 'user_status']
+
+INSERT_USER_QUERY = """
+INSERT INTO users (name, email, branch_id, created_at, updated_at, active, role_id)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
 # Function to get database configuration based on environment choice
 def get_db_config():
     # Get environment variables for server configuration
@@ -66,7 +89,7 @@ def create_db_connection(db_config):
             database=database,
             port=port,
             connection_timeout=30,  # Add timeout
-            use_pure=True  # Use pure Python implementation
+            use_pure=False  # Use the C extension when installed, the connector falls back to pure Python otherwise
         )
         
         print(f"Connected to {database} database")
@@ -90,41 +113,57 @@ def process_users_excel(file_path):
     db_config = get_db_config()
     
     # Read the Excel file
-    df = pd.read_excel(file_path)
+    df = pd.read_excel(file_path, engine='openpyxl', usecols=USER_COLUMNS, dtype={'user_status': 'category'})
     
     # Connect to the database
     connection, tunnel = create_db_connection(db_config)
     if connection is None:
         return
     
+    insert_cursor = None
     try:
-        # Get all existing emails for faster lookups
-        existing_emails = get_all_existing_emails(connection)
+        # Get all branches for faster lookups
+        branch_map = get_branch_map(connection)
         
         # Track statistics
         total_users = 0
         successful_inserts = 0
         failed_inserts = 0
         skipped_emails = 0
+        pending = []
+        # One cursor serves every insert batch of the run
+        insert_cursor = connection.cursor(buffered=True)
+        
+        # Prepare whole columns at once instead of per row
+        # If user_full_name is NULL, use user_name instead
+        use_user_name = df['user_full_name'].isna() | (df['user_full_name'] == 'NULL')
+        df['user_full_name'] = df['user_full_name'].mask(use_user_name, df['user_name'])
+        df['use_user_name'] = use_user_name
+        # Format email
+        df['email'] = df['user_name'].astype(str) + '@sandah.org'
+        # Convert status to active flag (1 for Active, 0 for Not Active)
+        df['active'] = (df['user_status'] == 'Active').astype(int)
+        # Convert start_date to the string format that MySQL accepts, NaN where it cannot be parsed
+        if pd.api.types.is_datetime64_any_dtype(df['start_date']):
+            df['created_at'] = df['start_date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            # Cells of mixed types or formats are parsed one by one, each in its own format
+            df['created_at'] = df['start_date'].map(format_start_date)
+        
+        columns = ['user_name', 'user_full_name', 'use_user_name', 'branch_name', 'email', 'active', 'created_at']
+        
+        # Look up only the emails of this file, unless it is large enough that one full scan is cheaper
+        if len(df) > EMAIL_LOOKUP_THRESHOLD:
+            existing_emails = get_all_existing_emails(connection)
+        else:
+            existing_emails = get_existing_emails(connection, df['email'].unique().tolist())
         
         # Iterate over each row in the Excel file
-        for index, row in df.iterrows():
+        for user_name, user_full_name, use_user_name, branch_name, email, active, created_at in df[columns].itertuples(index=False, name=None):
             total_users += 1
             
-            # Extract data from Excel
-            user_name = row['user_name']
-            user_full_name = row['user_full_name']
-            branch_name = row['branch_name']
-            start_date = row['start_date']
-            user_status = row['user_status']
-            
-            # If user_full_name is NULL, use user_name instead
-            if pd.isna(user_full_name) or user_full_name == 'NULL':
+            if use_user_name:
                 print(f"Using username '{user_name}' as full name for user {user_name}")
-                user_full_name = user_name
-            
-            # Format email
-            email = f"{user_name}@sandah.org"
             
             # Check if email already exists (using the pre-loaded set)
             if email.lower() in existing_emails:
@@ -132,52 +171,29 @@ def process_users_excel(file_path):
                 skipped_emails += 1
                 continue
             
-            # Convert status to active flag (1 for Active, 0 for Not Active)
-            active = 1 if user_status == 'Active' else 0
-            
-            # Convert start_date to datetime
-            try:
-                created_at = pd.to_datetime(start_date)
-                # Convert to string format that MySQL accepts
-                created_at = created_at.strftime('%Y-%m-%d %H:%M:%S')
-            except:
+            if pd.isna(created_at):
                 print(f"Error converting date for user {user_name}. Using current date.")
                 created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
             # Get branch ID
-            branch_id = get_branch_id(connection, branch_name)
+            branch_id = branch_map.get(branch_key(branch_name))
             if not branch_id:
                 print(f"Branch '{branch_name}' not found for user {user_name}. Skipping...")
                 failed_inserts += 1
                 continue
             
-            # Insert user directly (no need to check email again)
-            cursor = connection.cursor(buffered=True)
-            try:
-                # Set role_id to 4
-                role_id = 4
-                
-                query = """
-                INSERT INTO users (name, email, branch_id, created_at, updated_at, active, role_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                values = (user_full_name, email, branch_id, created_at, created_at, active, role_id)
-                
-                cursor.execute(query, values)
-                connection.commit()
-                user_id = cursor.lastrowid
-                
-                # Add the new email to our set to prevent duplicates in this run
-                existing_emails.add(email.lower())
-                
-                print(f"Successfully inserted user: {user_full_name} with ID: {user_id}")
-                successful_inserts += 1
-            except Error as e:
-                print(f"Error inserting user {user_full_name}: {e}")
-                failed_inserts += 1
-            finally:
-                cursor.close()
+            # Queue the user, adding the email to our set to prevent duplicates in this run
+            pending.append((user_full_name, email, branch_id, created_at, created_at, active, USER_ROLE_ID))
+            existing_emails.add(email.lower())
+            if len(pending) >= INSERT_BATCH_SIZE:
+                inserted, failed = insert_users(connection, insert_cursor, pending)
+                successful_inserts += inserted
+                failed_inserts += failed
+                pending.clear()
+        
+        inserted, failed = insert_users(connection, insert_cursor, pending)
+        successful_inserts += inserted
+        failed_inserts += failed
         
         # Print summary
         print(f"\nMigration Summary:")
@@ -187,7 +203,9 @@ def process_users_excel(file_path):
         print(f"Failed to insert: {failed_inserts}")
     
     finally:
-        # Close the database connection and SSH tunnel
+        # Close the insert cursor, the database connection and SSH tunnel
+        if insert_cursor:
+            insert_cursor.close()
         if connection:
             connection.close()
         if tunnel:
@@ -197,30 +215,95 @@ def process_users_excel(file_path):
 # Path to your Excel file
 excel_file_path = 'users.xlsx'
 
-# Function to get branch ID by name
-def get_branch_id(connection, branch_name):
+# Function to convert one start_date cell to the string format that MySQL accepts, None if it cannot be parsed
+def format_start_date(start_date):
+    try:
+        return pd.to_datetime(start_date).strftime('%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return None
+
+# Function to normalize a branch name the way MySQL compares it (case-insensitive, trailing spaces ignored)
+def branch_key(branch_name):
+    return str(branch_name).rstrip().lower()
+
+# Function to get all branch IDs by name, so each user does not need its own query
+def get_branch_map(connection):
     cursor = connection.cursor()
     try:
-        query = "SELECT id FROM branches WHERE name = %s"
-        cursor.execute(query, (branch_name,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        cursor.execute("SELECT id, name FROM branches WHERE name IS NOT NULL ORDER BY id")
+        branch_map = {}
+        for branch_id, name in cursor:
+            branch_map.setdefault(branch_key(name), branch_id)
+        print(f"Loaded {len(branch_map)} branches from database")
+        return branch_map
     finally:
         cursor.close()
 
-# Function to check if email already exists
-# Function to get all existing emails
-def get_all_existing_emails(connection):
+# Function to insert a batch of users with one multi-row INSERT and one commit
+# Falls back to one INSERT per user when the batch fails, so a bad row only fails itself
+def insert_users(connection, cursor, rows):
+    if not rows:
+        return 0, 0
+    
+    try:
+        cursor.executemany(INSERT_USER_QUERY, rows)
+        connection.commit()
+        # The multi-row INSERT gets consecutive IDs starting at lastrowid
+        first_id = cursor.lastrowid
+        for offset, row in enumerate(rows):
+            print(f"Successfully inserted user: {row[0]} with ID: {first_id + offset}")
+        return len(rows), 0
+    except Error as e:
+        connection.rollback()
+        print(f"Error inserting batch of {len(rows)} users, retrying one by one: {e}")
+    
+    successful = 0
+    failed = 0
+    for row in rows:
+        try:
+            cursor.execute(INSERT_USER_QUERY, row)
+            connection.commit()
+            print(f"Successfully inserted user: {row[0]} with ID: {cursor.lastrowid}")
+            successful += 1
+        except Error as e:
+            connection.rollback()
+            print(f"Error inserting user {row[0]}: {e}")
+            failed += 1
+    return successful, failed
+
+# Function to get which of the given emails already exist, lowercased by the database
+def get_existing_emails(connection, emails):
     cursor = connection.cursor(buffered=True)
     existing_emails = set()
     
     try:
-        query = "SELECT email FROM users"
+        for start in range(0, len(emails), EMAIL_LOOKUP_CHUNK_SIZE):
+            chunk = emails[start:start + EMAIL_LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT LOWER(email) FROM users WHERE email IN ({placeholders})", chunk)
+            existing_emails.update(row[0] for row in cursor)
+        print(f"Found {len(existing_emails)} of {len(emails)} emails already in the database")
+        return existing_emails
+    except Error as e:
+        print(f"Error fetching existing emails: {e}")
+        return set()
+    finally:
+        cursor.close()
+
+# Function to get all existing emails, lowercased by the database
+def get_all_existing_emails(connection):
+    # Unbuffered, so only one fetchmany page of rows is held in memory at a time
+    cursor = connection.cursor()
+    existing_emails = set()
+    
+    try:
+        query = "SELECT LOWER(email) FROM users WHERE email IS NOT NULL"
         cursor.execute(query)
-        for row in cursor:
-            email = row[0]
-            if email is not None:  # Check if email is not None
-                existing_emails.add(email.lower())
+        while True:
+            rows = cursor.fetchmany(EMAIL_FETCH_SIZE)
+            if not rows:
+                break
+            existing_emails.update(row[0] for row in rows)
         print(f"Loaded {len(existing_emails)} existing emails from database")
         return existing_emails
     except Error as e: